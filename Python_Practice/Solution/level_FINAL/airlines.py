@@ -1,7 +1,30 @@
 #!python
 
-from collections import defaultdict
-from datetime import datetime
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Mapping, Sequence
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import accumulate, chain, compress
+from operator import add, itemgetter, sub
+
+# NumPy is optional: get_delays falls back to pure Python (None if not installed)
+# NOTE: imported at the first call of get_delays (see get_numpy), as importing NumPy
+# takes more time than reading a small file of records
+np = ...
+
+
+def get_numpy():
+    """Get the module NumPy, imported at first call (None if it is not installed)"""
+    global np
+    if np is ...:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
 
 
 # #-- CALCULATION OF TIME DELTA --##
@@ -64,6 +87,573 @@ def get_delay_2(expected: str, takeoff: str) -> int:
 # end::get_delay[]
 
 
+def get_delays(expected: Sequence[str], takeoff: Sequence[str]):
+    """\
+    Measure the time differences in minutes for many couples of times at once
+    delays[i] = <take-off[i]> - <expected[i]> (same rules as get_delay)
+
+    Args:
+        expected: expected departure times (e.g. ["23:45", "8:05"])
+        takeoff: real departure times (e.g. ["23:55", "8:00"])
+
+    Returns:
+        NumPy array of delays (or array("h") if NumPy is not installed)
+    """
+    if len(expected) != len(takeoff):
+        raise ValueError(
+            f"Got {len(expected)} expected times for {len(takeoff)} take-off times"
+        )
+    if get_numpy() is None:
+        return array("h", get_delays_cached(expected, takeoff))
+    if len(expected) == 0:
+        return np.zeros(0, dtype=np.int16)
+
+    def min_in_times(times: Sequence[str]):
+        # "H:MM" => columns ["H", ":", "MM"] => HH * 60 + MM
+        hhmm = np.char.partition(np.asarray(times, dtype=str), ":")
+        return hhmm[:, 0].astype(np.int32) * 60 + hhmm[:, 2].astype(np.int32)
+
+    # Same rules as get_delay_2, applied on all the times at once:
+    # a delta of more than half-day (in any direction) crosses midnight
+    min_in_day = 60 * 24
+    delta = min_in_times(takeoff) - min_in_times(expected)
+    delta[delta > min_in_day // 2] -= min_in_day
+    delta[delta < -min_in_day // 2] += min_in_day
+    return delta.astype(np.int16)
+
+
+# #-- CACHED CALCULATION OF TIME DELTA --##
+# There are only 1440 minutes in a day: times and couples of times are converted once
+@lru_cache(maxsize=4096)
+def get_minutes(hhmm: str) -> int:
+    """\
+    Get the number of minutes in the day of a time (e.g. "8:05" or "08:05" => 485)
+    Results are cached: each distinct string is converted only once
+
+    Args:
+        hhmm: time (e.g. "23:45")
+    """
+    hours, minutes = hhmm.split(":")
+    hours, minutes = int(hours), int(minutes)
+    # Same validation as strptime(hhmm, "%H:%M") in get_delay
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"time data {hhmm!r} does not match format '%H:%M'")
+    return hours * 60 + minutes
+
+
+@lru_cache(maxsize=1 << 16)
+def get_delay_cached(expected: str, takeoff: str) -> int:
+    """\
+    Same as get_delay, but times and couples (expected, takeoff) are cached
+
+    Args:
+        expected: expected departure time (e.g. 23:45)
+        takeoff: real departure time (e.g. 23:55)
+    """
+    # Same rules as get_delay_2: a delta of more than half-day crosses midnight
+    min_in_day = 60 * 24
+    delta = get_minutes(takeoff) - get_minutes(expected)
+    if delta > min_in_day // 2:
+        return delta - min_in_day
+    elif delta < -min_in_day // 2:
+        return delta + min_in_day
+    return delta
+
+
+def get_delays_cached(expected: Sequence[str], takeoff: Sequence[str]):
+    """\
+    Same as get_delays, with the minutes of each time in cache (see get_minutes)
+    Faster than get_delays with NumPy, which parses all the strings
+
+    Args:
+        expected: expected departure times (e.g. ["23:45", "8:05"])
+        takeoff: real departure times (e.g. ["23:55", "8:00"])
+
+    Returns:
+        list of delays
+    """
+    if len(expected) != len(takeoff):
+        raise ValueError(
+            f"Got {len(expected)} expected times for {len(takeoff)} take-off times"
+        )
+    return get_delays_minutes(map(get_minutes, expected), map(get_minutes, takeoff))
+
+
+def get_delays_minutes(expected: Iterable[int], takeoff: Iterable[int]):
+    """\
+    Same as get_delays_cached, with times given as minutes in the day (see get_minutes)
+
+    Returns:
+        list of delays
+    """
+    global nb_delays_minutes
+    # Same rules as get_delay_cached, on whole columns (no function call for each couple)
+    min_in_day = 60 * 24
+    deltas = map(sub, takeoff, expected)
+    delays = [
+        delta - min_in_day
+        if delta > min_in_day // 2
+        else delta + min_in_day
+        if delta < -min_in_day // 2
+        else delta
+        for delta in deltas
+    ]
+    nb_delays_minutes += len(delays)
+    return delays
+
+
+# Number of delays calculated by get_delays_minutes in this process
+nb_delays_minutes = 0
+
+
+def count_delay_calls() -> int:
+    """\
+    Get the number of delays calculated in this process: couples of times not found
+    in the cache of get_delay_cached, and delays calculated by get_delays_minutes
+    (compare 2 calls to count the delays calculated in between)
+    """
+    return get_delay_cached.cache_info().misses + nb_delays_minutes
+
+
+def select_positions(positions: Sequence[int]):
+    """\
+    Get a function selecting the elements at some positions of a column (as a tuple)
+    e.g. select_positions([0, 2])(["a", "b", "c"]) => ("a", "c")
+
+    Args:
+        positions: positions of the elements to select
+    """
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda column: (column[position],)
+    return itemgetter(*positions)
+
+
+def group_positions(values: Iterable) -> dict:
+    """\
+    Get the positions of each value of a column (in order of first appearance)
+    e.g. group_positions(["a", "b", "a"]) => {"a": [0, 2], "b": [1]}
+
+    Args:
+        values: column of values (e.g. flight codes, or their IDs in a catalog)
+    """
+    positions = dict()
+    for position, value in enumerate(values):
+        value_positions = positions.get(value)
+        if value_positions is None:
+            positions[value] = [position]
+        else:
+            value_positions.append(position)
+    return positions
+
+
+# #-- RATINGS --##
+# A flight is late if it takes off more than LATE_DELAY minutes after expected time
+LATE_DELAY = 30
+
+
+def get_rating(nb_records: int, nb_late: int, total_delay: int):
+    """\
+    Get a rating from the counters of a set of records
+
+    Args:
+        nb_records: number of records
+        nb_late: number of records late (delay > LATE_DELAY)
+        total_delay: sum of the delays of the records (in minutes)
+
+    Returns:
+        ('% late', 'average delay'), both int
+    """
+    percent = int(nb_late / nb_records * 100)
+    average = int(total_delay / nb_records)
+    return percent, average
+
+
+# #-- COMPACT STORAGE OF RECORDS --##
+# Flag added to the minutes when the hour of a time has a leading zero (e.g. "08:05")
+# so the original string can be rebuilt (a day has 1440 minutes < 2048)
+HOUR_PADDING = 1 << 11
+
+
+@lru_cache(maxsize=4096)
+def encode_time(hhmm: str) -> int:
+    """\
+    Convert a time (e.g. "8:05" or "08:05") into a small integer
+    <number of minutes in the day> (+ HOUR_PADDING if the hour has a leading zero)
+
+    Args:
+        hhmm: time to convert
+    """
+    value = get_minutes(hhmm)
+    if hhmm.index(":") == 2 and hhmm[0] == "0":
+        value |= HOUR_PADDING
+    return value
+
+
+@lru_cache(maxsize=4096)
+def encode_date(date_iso: str) -> int:
+    """\
+    Convert a date (e.g. "2015-08-20") into its day ordinal (see date.toordinal)
+
+    Args:
+        date_iso: date to convert
+    """
+    return date.fromisoformat(date_iso).toordinal()
+
+
+def is_valid_date(date_iso: str) -> bool:
+    """\
+    Check that a date can be stored (see encode_date): False for "2015-02-30" or "n/a"
+
+    Args:
+        date_iso: date to check
+    """
+    try:
+        encode_date(date_iso)
+    except ValueError:
+        return False
+    return True
+
+
+def decode_time(value: int) -> str:
+    """\
+    Convert back an integer created by encode_time into the original time string
+
+    Args:
+        value: encoded time
+    """
+    hours, minutes = divmod(value & ~HOUR_PADDING, 60)
+    if value & HOUR_PADDING:
+        return f"{hours:02d}:{minutes:02d}"
+    return f"{hours}:{minutes:02d}"
+
+
+class DateBuckets:
+    """Counters of records per date: number of records, number late and total delay
+
+    The dates (day ordinals) are kept sorted, so the counters of a date range are
+    the sum of the counters of its dates: the cost of a query depends on the number
+    of dates, not on the number of records.
+    """
+
+    __slots__ = ("days", "counters")
+
+    def __init__(self):
+        self.days = list()  # sorted day ordinals
+        self.counters = dict()  # day ordinal => [nb_records, nb_late, total_delay]
+
+    def add(self, day: int, delay: int):
+        """Add a record (day ordinal, delay in minutes)"""
+        counters = self.counters.get(day)
+        if counters is None:
+            counters = self.counters[day] = [0, 0, 0]
+            insort(self.days, day)
+        counters[0] += 1
+        counters[2] += delay
+        if delay > LATE_DELAY:
+            counters[1] += 1
+
+    def update(self, other: "DateBuckets"):
+        """Add the counters of another DateBuckets"""
+        for day, (nb_records, nb_late, total_delay) in other.counters.items():
+            counters = self.counters.get(day)
+            if counters is None:
+                self.counters[day] = [nb_records, nb_late, total_delay]
+                insort(self.days, day)
+            else:
+                counters[0] += nb_records
+                counters[1] += nb_late
+                counters[2] += total_delay
+
+    def get_counters(self, start: str = None, end: str = None):
+        """\
+        Sum the counters of the dates between start and end (included)
+
+        Args:
+            start: first date (e.g. "2015-08-20"), default: first date of the records
+            end: last date, default: last date of the records
+
+        Returns:
+            (nb_records, nb_late, total_delay)
+        """
+        first = 0 if start is None else bisect_left(self.days, encode_date(start))
+        last = len(self.days) if end is None else bisect_right(self.days, encode_date(end))
+        nb_records = nb_late = total_delay = 0
+        for day in self.days[first:last]:
+            counters = self.counters[day]
+            nb_records += counters[0]
+            nb_late += counters[1]
+            total_delay += counters[2]
+        return nb_records, nb_late, total_delay
+
+    def get_rating(self, start: str = None, end: str = None):
+        """Rating of the records between 2 dates (None, None if there is no record)"""
+        nb_records, nb_late, total_delay = self.get_counters(start, end)
+        if not nb_records:
+            return None, None
+        return get_rating(nb_records, nb_late, total_delay)
+
+    def get_date_range(self):
+        """First and last dates (ISO format) of the records (None, None if no record)"""
+        if not self.days:
+            return None, None
+        return tuple(date.fromordinal(day).isoformat() for day in (self.days[0], self.days[-1]))
+
+
+# Percentiles of the delays shown in the report
+PERCENTILES = (50, 90, 99)
+
+
+class DelayHistogram:
+    """Number of records for each delay (in minutes) found in a set of records
+
+    Only the delays found are counted (a flight with a few records takes a few
+    entries): percentiles are exact. Histograms of several sets of records are
+    merged by adding their counts.
+    """
+
+    __slots__ = ("counts",)
+
+    def __init__(self, delays: Iterable[int] = ()):
+        # NOTE: Counter counts the delays without a loop in Python
+        self.counts = Counter(delays)
+
+    def add_delays(self, delays: Iterable[int]):
+        """Count delays (in minutes)"""
+        self.counts.update(delays)
+
+    def update(self, other: "DelayHistogram"):
+        """Add the counts of another DelayHistogram"""
+        self.counts.update(other.counts)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def get_percentiles(self, percents: Sequence[int] = PERCENTILES):
+        """\
+        Get percentiles of the delays: smallest delay such that at least <percent>%
+        of the records have a delay lower or equal (e.g. 50 => median)
+
+        Args:
+            percents: percentages, in increasing order
+
+        Returns:
+            tuple of delays in minutes, one per percentage (None if no record)
+        """
+        if not self.counts:
+            return None
+        # NOTE: the first delay whose cumulated count reaches the rank is searched
+        # by bisection (only the distinct delays are sorted)
+        delays = sorted(self.counts)
+        cumulated = list(accumulate(map(self.counts.__getitem__, delays)))
+        # Rank of each percentile (e.g. 90% of 21 records => 19th record)
+        ranks = [max(1, -(-percent * cumulated[-1] // 100)) for percent in percents]
+        return tuple(delays[bisect_left(cumulated, rank)] for rank in ranks)
+
+
+class DateHistograms:
+    """Histograms of the delays per date (day ordinal => DelayHistogram)
+
+    Same principle as DateBuckets: the histogram of a date range merges the
+    histograms of its dates, so its cost depends on the number of dates and of
+    distinct delays, not on the number of records.
+    """
+
+    __slots__ = ("days", "histograms")
+
+    def __init__(self):
+        self.days = list()  # sorted day ordinals
+        self.histograms = dict()  # day ordinal => DelayHistogram
+
+    def add_records(self, days: Iterable[int], delays: Iterable[int]):
+        """Add records given as columns (day ordinals, delays in minutes)"""
+        # NOTE: Counter counts the couples (day, delay) without a loop in Python
+        for (day, delay), nb_records in Counter(zip(days, delays)).items():
+            histogram = self.histograms.get(day)
+            if histogram is None:
+                histogram = self.histograms[day] = DelayHistogram()
+                insort(self.days, day)
+            histogram.counts[delay] += nb_records
+
+    def get_histogram(self, start: str = None, end: str = None):
+        """Histogram of the delays between 2 dates (e.g. "2015-08-20", included)"""
+        first = 0 if start is None else bisect_left(self.days, encode_date(start))
+        last = len(self.days) if end is None else bisect_right(self.days, encode_date(end))
+        histogram = DelayHistogram()
+        for day in self.days[first:last]:
+            histogram.update(self.histograms[day])
+        return histogram
+
+
+class FlightRecords:
+    """Records of a flight stored as typed arrays (one array per field)
+
+    A record takes 8 bytes instead of a dict with 3 keys:
+        * dates: day ordinal of the date (see date.toordinal)
+        * times: expected take-off time (see encode_time)
+        * delays: delay in minutes
+
+    The number of late records and the total delay are updated for each record
+    so the rating of the flight does not need to loop on the delays. The counters
+    per date (for the rating of a date range) are computed only when needed.
+    """
+
+    __slots__ = ("dates", "times", "delays", "nb_late", "total_delay", "_buckets")
+
+    def __init__(self):
+        self.dates = array("i")
+        self.times = array("h")
+        self.delays = array("h")
+        self.nb_late = 0
+        self.total_delay = 0
+        self._buckets = None
+
+    def append(self, date_iso: str, time: str, delay: int):
+        """Add a record (date as "YYYY-MM-DD", time as "HH:MM", delay in minutes)"""
+        self.dates.append(encode_date(date_iso))
+        self.times.append(encode_time(time))
+        self.delays.append(delay)
+        self.total_delay += delay
+        if delay > LATE_DELAY:
+            self.nb_late += 1
+
+    def extend(self, other: "FlightRecords"):
+        """Add the records of another FlightRecords (after the current ones)"""
+        self.dates.extend(other.dates)
+        self.times.extend(other.times)
+        self.delays.extend(other.delays)
+        self.total_delay += other.total_delay
+        self.nb_late += other.nb_late
+
+    @property
+    def buckets(self):
+        """Counters of the records per date (see DateBuckets)"""
+        # NOTE: only the records added since last call are counted, so adding
+        # records stays as fast as without the counters per date
+        if self._buckets is None:
+            self._buckets = (0, DateBuckets())
+        nb_counted, buckets = self._buckets
+        if nb_counted < len(self.delays):
+            for day, delay in zip(self.dates[nb_counted:], self.delays[nb_counted:]):
+                buckets.add(day, delay)
+            self._buckets = (len(self.delays), buckets)
+        return buckets
+
+    @property
+    def histogram(self):
+        """Histogram of the delays (see DelayHistogram)"""
+        # NOTE: not kept: a flight has few records, counted again at each call
+        return DelayHistogram(self.delays)
+
+    def get_histogram(self, start: str = None, end: str = None):
+        """Histogram of the delays of the records between 2 dates (e.g. "2015-08-20")"""
+        # NOTE: the records of the flight are scanned (about one record per date);
+        # the Airlines keep histograms per date instead (see Airline.get_histogram)
+        if start is None and end is None:
+            return self.histogram
+        first = -1 if start is None else encode_date(start)
+        last = float("inf") if end is None else encode_date(end)
+        return DelayHistogram(compress(self.delays, (first <= d <= last for d in self.dates)))
+
+    def __len__(self):
+        return len(self.delays)
+
+    def __iter__(self):
+        """Records as dict with keys 'date', 'time' and 'delay'"""
+        for ordinal, time, delay in zip(self.dates, self.times, self.delays):
+            yield {
+                "date": date.fromordinal(ordinal).isoformat(),
+                "time": decode_time(time),
+                "delay": delay,
+            }
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class FlightRollup:
+    """\
+    Records of a flight in several shards (e.g. the FlightRecords of each airport)
+
+    The records are not copied: counters, counters per date and histograms are
+    combined from the FlightRecords of the shards (see Airline.add_shard).
+    """
+
+    __slots__ = ("parts", "_buckets")
+
+    def __init__(self):
+        self.parts = list()
+        self._buckets = None
+
+    def add(self, records: FlightRecords):
+        """Add the records of the flight in another shard"""
+        self.parts.append(records)
+
+    @property
+    def nb_late(self):
+        return sum(records.nb_late for records in self.parts)
+
+    @property
+    def total_delay(self):
+        return sum(records.total_delay for records in self.parts)
+
+    @property
+    def buckets(self):
+        """Counters of the records per date (see DateBuckets)"""
+        # Combined again when records were added to a shard since last call
+        if self._buckets is None or self._buckets[0] != len(self):
+            buckets = DateBuckets()
+            for records in self.parts:
+                buckets.update(records.buckets)
+            self._buckets = (len(self), buckets)
+        return self._buckets[1]
+
+    @property
+    def histogram(self):
+        """Histogram of the delays (see DelayHistogram)"""
+        return DelayHistogram(chain.from_iterable(records.delays for records in self.parts))
+
+    def get_histogram(self, start: str = None, end: str = None):
+        """Histogram of the delays of the records between 2 dates (e.g. "2015-08-20")"""
+        if start is None and end is None:
+            return self.histogram
+        histogram = DelayHistogram()
+        for records in self.parts:
+            histogram.update(records.get_histogram(start, end))
+        return histogram
+
+    def __len__(self):
+        return sum(map(len, self.parts))
+
+    def __iter__(self):
+        """Records as dict (see FlightRecords), shard after shard"""
+        return chain.from_iterable(self.parts)
+
+
+class FlightsView(Mapping):
+    """Read-only view showing the records of each flight as lists of dict"""
+
+    def __init__(self, flight_records):
+        self._flight_records = flight_records
+
+    def __getitem__(self, flight):
+        if flight not in self._flight_records:
+            raise KeyError(flight)
+        return list(self._flight_records[flight])
+
+    def __contains__(self, flight):
+        return flight in self._flight_records
+
+    def __iter__(self):
+        return iter(self._flight_records)
+
+    def __len__(self):
+        return len(self._flight_records)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 # tag::header[]
 
 
@@ -74,8 +664,21 @@ class Airline:
         """Creation of an airline with records"""
         self.name = name
         self.code = code
-        self.flights = defaultdict(list)  # So ".append(...)" will work automatically
+        # Records of each flight are stored in typed arrays (see FlightRecords)
+        # NOTE: defaultdict creates the FlightRecords automatically
+        self.flight_records = defaultdict(FlightRecords)
         self.destination = dict()
+        # Counters on all the records of the airline (updated by "add_info")
+        self.nb_records = 0
+        self.nb_late = 0
+        self.total_delay = 0
+        # Flights with new records, in the order of the changes: code => number of
+        # records of the airline after the change (see ranking.RankingIndex)
+        self.changed_flights = dict()
+        # Counters per date, computed only for the rating of a date range (see "buckets")
+        # and histograms of the delays per date, computed only for percentiles
+        self._buckets = None
+        self._histograms = None
 
     # tag::add_info[]
     def add_info(self, record):
@@ -83,85 +686,273 @@ class Airline:
 
         Args:
             record(dict): dictionary with keys:
-                * 'date': date of the flight, stored as a string (e.g. "2018-02-30")
+                * 'date': date of the flight, stored as a string (e.g. "2018-02-28")
                 * 'time': expected take-off time, stored as a string (e.g. "15:30")
                 * 'code': code of flight (e.g. "MU123")
                 * 'destination'
                 * 'take-off': real take-off time, stored as a string
+
+        Raises:
+            ValueError: if the date does not exist (e.g. "2018-02-30"), before the
+                airline is modified (the readers skip such lines, see processRecords)
         """
         # end::header[]
         code = record["code"]
+        encode_date(record["date"])  # Checked first (cached: the record reuses it)
 
         # Save destination
         if code not in self.destination:
             self.destination[code] = record["destination"]
-            # self.flights[code] = list()  # mandatory if defaultdict(list) is not used
 
-        # Record to save in the list of records
-        # saved_record = {k: record[k] for k in ("date", "time")}
-        saved_record = {
-            "date": record["date"],
-            "time": record["time"],
-            "delay": get_delay(record["time"], record["take-off"]),
-        }
+        # Save record: date, time and delay (NOTE: defaultdict ensure to initialize the arrays)
+        # NOTE: get_delay_cached gives the same result as get_delay, much faster
+        delay = get_delay_cached(record["time"], record["take-off"])
+        self.flight_records[code].append(record["date"], record["time"], delay)
 
-        # Save record (NOTE: defaultdict ensure to initialize the list)
-        self.flights[code].append(saved_record)
+        # Update counters of the airline, so the rating does not loop on records
+        self.nb_records += 1
+        self.total_delay += delay
+        if delay > LATE_DELAY:
+            self.nb_late += 1
+        # The flight is moved at the end of the changes (see "set_changed")
+        self.changed_flights.pop(code, None)
+        self.changed_flights[code] = self.nb_records
 
     # end::add_info[]
+
+    @property
+    def flights(self):
+        """Records of each flight, as lists of dict with keys 'date', 'time', 'delay'"""
+        return FlightsView(self.flight_records)
+
+    @property
+    def buckets(self):
+        """Counters of the records per date (see DateBuckets)"""
+        # Combined from the counters of the flights when records were added since last call
+        if self._buckets is None or self._buckets[0] != self.nb_records:
+            buckets = DateBuckets()
+            for records in self.flight_records.values():
+                buckets.update(records.buckets)
+            self._buckets = (self.nb_records, buckets)
+        return self._buckets[1]
+
+    @property
+    def histograms(self):
+        """Histograms of the delays of all the flights per date (see DateHistograms)"""
+        # Counted again from the records when records were added since last call
+        # NOTE: no histogram is kept for each flight (see FlightRecords.histogram)
+        if self._histograms is None or self._histograms[0] != self.nb_records:
+            histograms = DateHistograms()
+            parts = list(self.iter_flight_parts())
+            histograms.add_records(
+                chain.from_iterable(records.dates for records in parts),
+                chain.from_iterable(records.delays for records in parts),
+            )
+            self._histograms = (self.nb_records, histograms)
+        return self._histograms[1]
+
+    def iter_flight_parts(self):
+        """FlightRecords of the flights (of each shard for a FlightRollup)"""
+        for records in self.flight_records.values():
+            if isinstance(records, FlightRollup):
+                yield from records.parts
+            else:
+                yield records
+
+    @property
+    def histogram(self):
+        """Histogram of the delays of all the flights (see DelayHistogram)"""
+        # NOTE: counted from the delays of the flights (faster than merging the dates)
+        return DelayHistogram(
+            chain.from_iterable(records.delays for records in self.iter_flight_parts())
+        )
+
+    def get_histogram(self, start: str = None, end: str = None):
+        """Histogram of the delays of the records between 2 dates (e.g. "2015-08-20")"""
+        if start is None and end is None:
+            return self.histogram
+        return self.histograms.get_histogram(start, end)
+
+    def add_records(self, batch: dict, catalog=None):
+        """Add many records of the airline at once (same result as "add_info" on each)
+
+        Args:
+            batch(dict): columns of the records: sequences with keys 'date', 'time',
+                'code', 'destination' and 'take-off' (see "add_info"), or 'delay'
+                instead of 'take-off' if the delays are already calculated
+            catalog(catalog.Catalog): if given, the columns are integers (see
+                processRecords.RecordBatches.iter_id_batches): 'date' and 'time'
+                encoded (see FlightRecords), 'code' and 'destination' IDs in the catalog
+
+        Raises:
+            ValueError: if a date does not exist, before any record is added
+        """
+        # Delays, dates and times are converted by column (no call for each record)
+        delays = batch.get("delay")
+        if delays is None:
+            delays = get_delays_cached(batch["time"], batch["take-off"])
+        # Positions of the records of each flight in the columns
+        positions = group_positions(batch["code"])
+        if catalog is None:
+            dates = list(map(encode_date, batch["date"]))
+            times = list(map(encode_time, batch["time"]))
+            get_destination = batch["destination"].__getitem__
+        else:
+            # Records grouped by ID of flight: each code is resolved once (not per record)
+            dates, times = batch["date"], batch["time"]
+            codes = catalog.code.names
+            positions = {codes[code_id]: ids for code_id, ids in positions.items()}
+            destinations, destination_ids = catalog.destination.names, batch["destination"]
+
+            def get_destination(position):
+                return destinations[destination_ids[position]]
+
+        self.add_flight_columns(positions, dates, times, delays, get_destination)
+
+    def add_flight_columns(self, positions: dict, dates, times, delays, get_destination):
+        """\
+        Add the records of columns to each flight (see add_records)
+
+        Args:
+            positions: positions of the records of each flight: code => list
+            dates, times, delays: columns of the records (encoded, see FlightRecords)
+            get_destination: function giving the destination of a record (position)
+        """
+        # The records of each flight are added at once
+        nb_late = 0
+        for code, flight_positions in positions.items():
+            if code not in self.destination:
+                # Like "add_info", we keep the first destination found for a flight
+                self.destination[code] = get_destination(flight_positions[0])
+            select = select_positions(flight_positions)
+            flight_delays = select(delays)
+            flight_nb_late = sum(map(LATE_DELAY.__lt__, flight_delays))
+
+            records = self.flight_records[code]
+            records.dates.extend(select(dates))
+            records.times.extend(select(times))
+            records.delays.extend(flight_delays)
+            records.total_delay += sum(flight_delays)
+            records.nb_late += flight_nb_late
+            nb_late += flight_nb_late
+
+        self.nb_records += len(delays)
+        self.nb_late += nb_late
+        self.total_delay += sum(delays)
+        self.set_changed(positions)
+
+    def set_changed(self, codes: Iterable[str]):
+        """Move flights at the end of "changed_flights" (after records are added)"""
+        for code in codes:
+            # NOTE: removed first, so the dictionary is kept in the order of the changes
+            self.changed_flights.pop(code, None)
+            self.changed_flights[code] = self.nb_records
+
     # tag::header[]
 
     # tag::get_rating_flight[]
-    def get_rating_flight(self, flight: str):
+    def get_rating_flight(self, flight: str, start: str = None, end: str = None):
         """Get the rating of a given flight
 
         Args:
             flight: code of a flight
+            start, end: only records between these dates, e.g. "2015-08-20" (optional)
 
         Returns:
             ('% late', 'average delay') for a flight, both int
         """
         # end::header[]
         # Flight unknown
-        if flight not in self.flights:
+        if flight not in self.flight_records:
             return None, None
-        # Known flight: calculate number of flights late and total delay
-        nb_late, total_delay = 0.0, 0.0
-        for record in self.flights[flight]:
-            total_delay += record["delay"]
-            if record["delay"] > 30:
-                nb_late += 1
-
-        nb_flights = len(self.flights[flight])
-        percent = int(nb_late / nb_flights * 100)
-        average = int(total_delay / nb_flights)
-        return percent, average
+        # Date range: sum of the counters of each date (None, None if no record)
+        if start is not None or end is not None:
+            return self.flight_records[flight].buckets.get_rating(start, end)
+        # Known flight: number of flights late and total delay are kept up to date
+        # by "add_info" so we do not need to loop on the records
+        records = self.flight_records[flight]
+        return get_rating(len(records), records.nb_late, records.total_delay)
 
     # end::get_rating_flight[]
     # tag::header[]
 
     # tag::get_rating_airline[]
-    def get_rating_airline(self):
+    def get_rating_airline(self, start: str = None, end: str = None):
         """Get the rating of the airline
 
+        Args:
+            start, end: only records between these dates, e.g. "2015-08-20" (optional)
+
         Returns:
             ('% late', 'average delay') for the airline, both int
         """
         # end::header[]
+        if start is not None or end is not None:
+            return self.buckets.get_rating(start, end)
         # We could use the previous version to avoid duplicate code
         # HOWEVER, get_rating_flight returns "int" so the result would be inexact
-        # We will do a copy of the code with a loop on "flight" [arghhh :( duplicate code!!]
-        nb_late, total_delay = 0.0, 0.0
-        nb_flights = 0
-        for records in self.flights.values():
-            nb_flights += len(records)
-            for record in records:
-                total_delay += record["delay"]
-                if record["delay"] > 30:
-                    nb_late += 1
-
-        percent = int(nb_late / nb_flights * 100)
-        average = int(total_delay / nb_flights)
-        return percent, average
+        # We use instead the counters of the airline, updated by "add_info"
+        return get_rating(self.nb_records, self.nb_late, self.total_delay)
     # end::get_rating_airline[]
 
+    def get_percentiles_flight(self, flight: str, start: str = None, end: str = None):
+        """Get percentiles of the delays of a flight (see DelayHistogram.get_percentiles)
+
+        Args:
+            flight: code of a flight
+            start, end: only records between these dates, e.g. "2015-08-20" (optional)
+
+        Returns:
+            (p50, p90, p99) delays in minutes (None if no record)
+        """
+        if flight not in self.flight_records:
+            return None
+        return self.flight_records[flight].get_histogram(start, end).get_percentiles()
+
+    def get_percentiles_airline(self, start: str = None, end: str = None):
+        """Get percentiles of the delays of the airline (see get_percentiles_flight)"""
+        return self.get_histogram(start, end).get_percentiles()
+
+    def merge(self, other: "Airline"):
+        """Add the records of another Airline (e.g. built from another part of a file)
+
+        The records of "other" are added after the current ones, so merging the
+        Airlines built from consecutive parts of a file gives the same result as
+        adding all the records of the file with "add_info".
+
+        Args:
+            other: Airline with the same name
+        """
+        for code, records in other.flight_records.items():
+            # Like "add_info", we keep the first destination found for a flight
+            self.destination.setdefault(code, other.destination[code])
+            self.flight_records[code].extend(records)
+
+        self.nb_records += other.nb_records
+        self.nb_late += other.nb_late
+        self.total_delay += other.total_delay
+        self.set_changed(other.flight_records)
+        return self
+
+    def add_shard(self, other: "Airline"):
+        """Add the flights of the Airline of another shard (e.g. of another airport)
+
+        Unlike "merge", the records are not copied: each flight is a FlightRollup
+        of the records of the shards, so the Airline shall not get other records
+        (with "add_info", "add_records" or "merge").
+
+        Args:
+            other: Airline with the same name
+        """
+        for code, records in other.flight_records.items():
+            # Like "add_info", we keep the first destination found for a flight
+            self.destination.setdefault(code, other.destination[code])
+            if code not in self.flight_records:
+                self.flight_records[code] = FlightRollup()
+            self.flight_records[code].add(records)
+
+        self.nb_records += other.nb_records
+        self.nb_late += other.nb_late
+        self.total_delay += other.total_delay
+        self.set_changed(other.flight_records)
+        return self
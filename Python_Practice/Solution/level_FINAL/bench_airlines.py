@@ -0,0 +1,238 @@
+#!python
+
+"""Benchmark of the stages of processRecords on synthetic take-off records
+
+For each number of rows, a file is generated (see generate_records.py) and each
+stage is timed separately (the resident memory given is the peak of the process
+since its start, "--trace-memory" measures the memory allocated by each stage).
+Results are saved in JSON to compare runs, e.g.:
+
+    python bench_airlines.py --sizes 1000 100000 -o before.json
+    python bench_airlines.py --sizes 1000 100000 -o after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import airlines
+import columnar_log
+import processRecords as rec
+from generate_records import generate_records
+from profiling import get_max_rss
+
+# Number of (expected, take-off) couples used to measure the delay functions
+NB_DELAYS = 100_000
+
+
+def time_stage(results: list, stage: str, nb_items: int, func, *args, trace_memory=False):
+    """\
+    Run a function and append its measures to the list of results
+
+    Args:
+        results: list of measures (dict) to update
+        stage: name of the stage
+        nb_items: number of items (e.g. records) processed by the stage
+        func: function to run with the arguments "args"
+        trace_memory: measure the peak of memory allocated by the stage (slow)
+
+    Returns:
+        result of the function
+    """
+    if trace_memory:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    measure = {
+        "stage": stage,
+        "items": nb_items,
+        "wall_s": round(wall, 6),
+        "cpu_s": round(cpu, 6),
+        "items_per_s": round(nb_items / wall) if wall > 0 else None,
+        # NOTE: peak of the whole process so far (cumulative), not the memory of the
+        # stage: use trace_memory for the peak allocated by the stage
+        "process_peak_rss_kb": get_max_rss(),
+    }
+    if trace_memory:
+        measure["peak_alloc_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    results.append(measure)
+    return result
+
+
+def count(iterable):
+    """Consume an iterable and return its number of elements"""
+    return sum(1 for _ in iterable)
+
+
+def run_command(args: list):
+    """Run a command in another process (output not shown)"""
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+
+
+def run_benchmark(file_path: str, nb_rows: int, nb_ranking: int = 10, trace_memory=False):
+    """\
+    Measure each stage of processRecords on a file of records
+
+    Args:
+        file_path: Path of file with records
+        nb_rows: number of lines of the file
+        nb_ranking: number of best/worse airlines and flights
+        trace_memory: measure the peak of memory allocated by each stage (slow)
+
+    Returns:
+        list of measures (dict), one per stage
+    """
+    results = list()
+
+    def stage(name, nb_items, func, *args):
+        return time_stage(results, name, nb_items, func, *args, trace_memory=trace_memory)
+
+    # Delay of first records, with each available function
+    couples = [
+        (r["time"], r["take-off"])
+        for r in itertools.islice(rec.iter_flight_records(file_path), NB_DELAYS)
+    ]
+    expected, takeoff = [c[0] for c in couples], [c[1] for c in couples]
+    for name in ("get_delay", "get_delay_2", "get_delay_cached"):
+        func = getattr(airlines, name)
+        stage(name, len(couples), lambda: [func(e, t) for e, t in couples])
+    stage("get_delays", len(couples), airlines.get_delays, expected, takeoff)
+
+    # Reading only, then reading and creating the Airlines (streamed)
+    for parser, read in rec.RECORD_PARSERS.items():
+        stage(f"read[{parser}]", nb_rows, count, read(file_path))
+    airlines_dic = stage(
+        "read+get_ratings_airlines",
+        nb_rows,
+        rec.get_ratings_airlines,
+        rec.iter_flight_records(file_path),
+    )
+    # Records read by blocks and added by airline (see Airline.add_records)
+    stage(
+        "read+get_ratings_airlines[columns]",
+        nb_rows,
+        rec.get_ratings_airlines,
+        rec.RecordBatches(file_path),
+    )
+    # Columnar log: conversion (once), then reading of the columns
+    log_path = os.path.splitext(file_path)[0] + ".alog"
+    stage("columnar_log.convert_log", nb_rows, columnar_log.convert_log, file_path, log_path)
+    stage(
+        "read+get_ratings_airlines[columnar]",
+        nb_rows,
+        rec.get_ratings_airlines,
+        columnar_log.ColumnarLog(log_path),
+    )
+
+    # Rankings
+    nb_flights = sum(len(a.flight_records) for a in airlines_dic.values())
+    stage("list_sorted_ratings", nb_flights, rec.list_sorted_ratings, airlines_dic)
+    stage(
+        "list_first_last_ratings",
+        nb_flights,
+        rec.list_first_last_ratings,
+        airlines_dic,
+        nb_ranking,
+    )
+
+    # Whole program in a new process (see run_report.py), against Python alone
+    stage("python -c pass", 0, run_command, [sys.executable, "-c", "pass"])
+    report_args = [sys.executable, "run_report.py", file_path, "-o", os.devnull]
+    stage("run_report.py", nb_rows, run_command, report_args)
+    return results
+
+
+def compare_results(results: dict, baseline: dict):
+    """\
+    Print the ratio of wall time of each stage against a baseline
+
+    Args:
+        results: content of the JSON file of the current run
+        baseline: content of the JSON file of a previous run
+    """
+    base_times = {
+        (run["rows"], m["stage"]): m["wall_s"]
+        for run in baseline["runs"]
+        for m in run["stages"]
+    }
+    for run in results["runs"]:
+        for measure in run["stages"]:
+            base_time = base_times.get((run["rows"], measure["stage"]))
+            if base_time:
+                ratio = measure["wall_s"] / base_time
+                print(f"{run['rows']:>12} {measure['stage']:<36} x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**3, 10**4, 10**5],
+        help="Numbers of rows of the files (e.g. 1000 ... 100000000)",
+    )
+    parser.add_argument("--airlines", type=int, default=20, help="Number of airlines")
+    parser.add_argument("--flights", type=int, default=50, help="Flights per airline")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--midnight-rate", type=float, default=0.01)
+    parser.add_argument("--days", type=int, default=30, help="Number of days")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-n", dest="nb_ranking", type=int, default=10)
+    parser.add_argument(
+        "--data-dir", default="bench_data", help="Folder of generated files (reused)"
+    )
+    parser.add_argument("--trace-memory", action="store_true", help="Peak memory per stage")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    cmd = parser.parse_args()
+
+    options = dict(
+        nb_airlines=cmd.airlines,
+        nb_flights=cmd.flights,
+        malformed_rate=cmd.malformed_rate,
+        midnight_rate=cmd.midnight_rate,
+        nb_days=cmd.days,
+        seed=cmd.seed,
+    )
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "runs": list(),
+    }
+
+    os.makedirs(cmd.data_dir, exist_ok=True)
+    for nb_rows in cmd.sizes:
+        # Generated files are reused: the name contains all the options
+        name = "_".join(str(v) for v in [nb_rows, *options.values()])
+        file_path = os.path.join(cmd.data_dir, f"records_{name}.txt")
+        if not os.path.exists(file_path):
+            generate_records(file_path, nb_rows, **options)
+
+        print(f"== {nb_rows} rows ==")
+        stages = run_benchmark(file_path, nb_rows, cmd.nb_ranking, cmd.trace_memory)
+        for measure in stages:
+            print(
+                f"{measure['stage']:<36} {measure['wall_s']:>10.3f} s"
+                f" {measure['items_per_s'] or 0:>12} items/s"
+            )
+        results["runs"].append({"rows": nb_rows, "file": file_path, "stages": stages})
+
+    with open(cmd.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Successfully wrote results {cmd.output!r}")
+
+    if cmd.compare:
+        with open(cmd.compare) as f:
+            compare_results(results, json.load(f))
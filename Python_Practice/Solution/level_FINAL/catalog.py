@@ -0,0 +1,59 @@
+#!python
+
+"""Catalog of the names of the records: dense integer IDs of the airlines, flight codes
+and destinations
+
+The readers of blocks of records (see processRecords.RecordBatches and
+columnar_log.ColumnarLog, method "iter_id_batches") give the names as columns of IDs:
+the records are grouped by airline and by flight with their IDs, and a name is
+resolved (as a string) once per airline or flight of a block, not once per record.
+
+Example:
+    catalog = Catalog()
+    catalog.code["MU553"]       # => 0 (new name: next ID)
+    catalog.code["EK303"]       # => 1
+    catalog.code.names[0]       # => "MU553"
+"""
+
+# Names given IDs by the catalog (keys of the records)
+KINDS = ("airline", "code", "destination")
+
+
+class SymbolTable(dict):
+    """Dense integer ID of each name, in order of first appearance: name => ID
+    The names are in list "names": names[ID] => name
+    """
+
+    def __init__(self, names=()):
+        super().__init__()
+        self.names = list()
+        self.get_ids(names)
+
+    def __missing__(self, name: str) -> int:
+        index = self[name] = len(self.names)
+        self.names.append(name)
+        return index
+
+    def get_ids(self, names) -> list:
+        """IDs of names (new IDs are given to unknown names)"""
+        return list(map(self.__getitem__, names))
+
+
+class Catalog:
+    """Symbol tables of the airlines, flight codes and destinations (see SymbolTable)"""
+
+    __slots__ = KINDS
+    kinds = KINDS
+
+    def __init__(self):
+        self.airline = SymbolTable()
+        self.code = SymbolTable()
+        self.destination = SymbolTable()
+
+    def __getitem__(self, kind: str) -> SymbolTable:
+        """Symbol table of "airline", "code" or "destination" """
+        return getattr(self, kind)
+
+    def __len__(self):
+        """Number of names of all the symbol tables"""
+        return sum(len(self[kind]) for kind in self.kinds)
@@ -0,0 +1,341 @@
+#!python
+
+"""Columnar log: binary file of take-off records, stored by columns of integers
+
+The records are stored in row groups (blocks of records). In each row group, each
+column is an array of integers written as raw bytes (little-endian):
+    * day: day ordinal of the date (see airlines.encode_date)
+    * time, takeoff: expected/real take-off times (see airlines.encode_time)
+    * delay: delay in minutes (see airlines.get_delay)
+    * airline, code, destination: index in the dictionary of the column
+
+The dictionaries (names of airlines, flight codes and destinations) and the position
+of each row group are in a JSON footer at the end of the file:
+
+    MAGIC | row group 1 | ... | row group N | footer (JSON) | footer size | MAGIC
+
+Reading a row group only copies bytes into arrays (no parsing of text), from the
+file or from the memory-mapped file.
+
+Convert a text log (see list_records.txt):
+    python columnar_log.py list_records.txt list_records.alog
+"""
+
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+from datetime import date
+from itertools import compress
+
+import airlines
+from catalog import SymbolTable
+
+MAGIC = b"AIRLOG01"
+# Size of the footer (number of bytes, little-endian), before the final MAGIC
+FOOTER_SIZE = struct.Struct("<Q")
+# Columns of a row group: (name, typecode of array)
+COLUMNS = (
+    ("day", "i"),
+    ("time", "h"),
+    ("takeoff", "h"),
+    ("delay", "h"),
+    ("airline", "i"),
+    ("code", "i"),
+    ("destination", "i"),
+)
+# Columns stored as index in a dictionary of names
+DICTIONARY_COLUMNS = ("airline", "code", "destination")
+# Keys of the records (same as processRecords.iter_flight_records)
+RECORD_KEYS = ("date", "time", "code", "airline", "destination", "take-off")
+
+
+def is_columnar_log(file_path: str) -> bool:
+    """Check if a file is a columnar log (False if it cannot be read)"""
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class Decoded(dict):
+    """Cache of the conversions of a function: value => function(value)"""
+
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    def __missing__(self, value):
+        result = self[value] = self.function(value)
+        return result
+
+
+def convert_log(
+    text_path: str, log_path: str, batch_size: int = None, counters: Counter = None
+):
+    """\
+    Convert a text log into a columnar log (one row group per block of lines)
+
+    Args:
+        text_path: Path of text file with records (see processRecords.RecordBatches)
+        log_path: Path of columnar log to write
+        batch_size: number of bytes of lines of a row group (default: BATCH_SIZE)
+        counters: if given, "malformed_lines" is incremented for each line skipped
+
+    Returns:
+        number of records written
+    """
+    # NOTE: imported here as processRecords reads columnar logs with this module
+    import json
+    import processRecords as rec
+
+    dictionaries = {name: SymbolTable() for name in DICTIONARY_COLUMNS}
+    row_groups = list()  # (position, number of records)
+
+    # NOTE: written in a temporary file, so a reader never sees an incomplete log
+    tmp_path = f"{log_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        batches = rec.RecordBatches(
+            text_path, counters=counters, batch_size=batch_size or rec.BATCH_SIZE
+        )
+        for columns in batches.iter_batches():
+            values = {
+                "day": map(airlines.encode_date, columns["date"]),
+                "time": map(airlines.encode_time, columns["time"]),
+                "takeoff": map(airlines.encode_time, columns["take-off"]),
+                "delay": airlines.get_delays_cached(columns["time"], columns["take-off"]),
+            }
+            for name in DICTIONARY_COLUMNS:
+                values[name] = map(dictionaries[name].__getitem__, columns[name])
+
+            row_groups.append((f.tell(), len(columns["date"])))
+            for name, typecode in COLUMNS:
+                column = array(typecode, values[name])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                column.tofile(f)
+
+        footer = {
+            "columns": COLUMNS,
+            "row_groups": row_groups,
+            "dictionaries": {name: d.names for name, d in dictionaries.items()},
+        }
+        footer = json.dumps(footer).encode()
+        f.write(footer + FOOTER_SIZE.pack(len(footer)) + MAGIC)
+    os.replace(tmp_path, log_path)
+    return sum(nb_records for _, nb_records in row_groups)
+
+
+class ColumnarLog:
+    """\
+    Records of a columnar log, read by row groups
+
+    Same usage as processRecords.RecordBatches: "iter_batches" gives the columns
+    of the records of each row group, iterating on the object gives dict records.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        start: int = 0,
+        end: int = None,
+        counters: Counter = None,
+        use_mmap: bool = False,
+        record_filter=None,
+    ):
+        """\
+        Args:
+            file_path: Path of columnar log
+            start, end: only the row groups starting in this range of positions
+                (in bytes) are read (e.g. chunks of processRecords.split_file)
+            counters: not used (a columnar log has no malformed line)
+            use_mmap: memory-map the file instead of reading the row groups
+            record_filter(record_filter.RecordFilter): if given, only the matching
+                records are read (see filter_row_group)
+        """
+        self.file_path = file_path
+        self.start = start
+        self.end = end
+        self.use_mmap = use_mmap
+        import json  # Only imported when needed (see processRecords.IMPORT_TIME)
+
+        try:
+            with open(file_path, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(size - FOOTER_SIZE.size - len(MAGIC))
+                footer_size = FOOTER_SIZE.unpack(f.read(FOOTER_SIZE.size))[0]
+                if f.read() != MAGIC:
+                    raise ValueError("not a columnar log")
+                self.data_end = f.seek(size - FOOTER_SIZE.size - len(MAGIC) - footer_size)
+                footer = json.loads(f.read(footer_size))
+        except Exception as e:
+            raise IOError(f"Error while trying to read input file {file_path!r}: {e}")
+
+        self.columns = [tuple(column) for column in footer["columns"]]
+        self.row_groups = [tuple(row_group) for row_group in footer["row_groups"]]
+        self.dictionaries = footer["dictionaries"]
+
+        # Criteria of the filter on the columns: (column, function checking a value)
+        # NOTE: the names are compared once per file (each index of the dictionaries)
+        self.filter_checks = list()
+        if record_filter:
+            for name in DICTIONARY_COLUMNS:
+                ids = record_filter.get_name_ids(name, self.dictionaries[name])
+                if ids is not None:
+                    self.filter_checks.append((name, ids.__contains__))
+            if record_filter.start:
+                start = airlines.encode_date(record_filter.start)
+                self.filter_checks.append(("day", start.__le__))
+            if record_filter.end:
+                end = airlines.encode_date(record_filter.end)
+                self.filter_checks.append(("day", end.__ge__))
+
+    def __len__(self):
+        """Number of records in the selected row groups"""
+        return sum(nb_records for _, nb_records in self.iter_row_group_positions())
+
+    def iter_row_group_positions(self):
+        """Position and number of records of the row groups in range start/end"""
+        for position, nb_records in self.row_groups:
+            if position >= self.start and (self.end is None or position < self.end):
+                yield position, nb_records
+
+    def iter_row_groups(self):
+        """\
+        Read the row groups
+
+        Yields:
+            dict: array of integers by column name
+        """
+        try:
+            with open(self.file_path, "rb") as f:
+                if not self.use_mmap:
+                    for position, nb_records in self.iter_row_group_positions():
+                        f.seek(position)
+                        columns = self.filter_row_group(self.read_row_group(f.read, nb_records))
+                        if columns:
+                            yield columns
+                    return
+                import mmap
+
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for position, nb_records in self.iter_row_group_positions():
+                        data.seek(position)
+                        columns = self.filter_row_group(self.read_row_group(data.read, nb_records))
+                        if columns:
+                            yield columns
+        except Exception as e:
+            raise IOError(f"Error while trying to read input file {self.file_path!r}: {e}")
+
+    def read_row_group(self, read, nb_records: int):
+        """\
+        Read the columns of a row group
+
+        Args:
+            read: function reading a number of bytes (from the start of the row group)
+            nb_records: number of records of the row group
+        """
+        columns = dict()
+        for name, typecode in self.columns:
+            column = array(typecode)
+            # NOTE: the bytes are copied as they are into the array (no parsing)
+            column.frombytes(read(nb_records * column.itemsize))
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns[name] = column
+        return columns
+
+    def filter_row_group(self, columns: dict):
+        """\
+        Keep only the records of a row group matching the record filter
+
+        Returns:
+            columns of the matching records (None if no record matches)
+        """
+        if not self.filter_checks:
+            return columns
+        nb_records = len(columns["day"])
+        positions = range(nb_records)
+        for name, check in self.filter_checks:
+            # NOTE: each criterion only checks the records matching the previous ones
+            column = columns[name]
+            if len(positions) < nb_records:
+                column = airlines.select_positions(positions)(column)
+            positions = list(compress(positions, map(check, column)))
+            if not positions:
+                return None
+        if len(positions) == nb_records:
+            return columns
+        select = airlines.select_positions(positions)
+        return {name: array(column.typecode, select(column)) for name, column in columns.items()}
+
+    def iter_batches(self):
+        """\
+        Read the row groups as columns of strings (see processRecords.RecordBatches)
+        with the delays already calculated
+
+        Yields:
+            dict: list of values by key of record, and "delay"
+        """
+        # Each distinct day or time is converted to a string only once
+        dates = Decoded(lambda day: date.fromordinal(day).isoformat())
+        times = Decoded(airlines.decode_time)
+        names = {name: self.dictionaries[name] for name in DICTIONARY_COLUMNS}
+        for columns in self.iter_row_groups():
+            # NOTE: each column is converted with "map", no loop in Python
+            yield {
+                "date": list(map(dates.__getitem__, columns["day"])),
+                "time": list(map(times.__getitem__, columns["time"])),
+                "code": list(map(names["code"].__getitem__, columns["code"])),
+                "airline": list(map(names["airline"].__getitem__, columns["airline"])),
+                "destination": list(
+                    map(names["destination"].__getitem__, columns["destination"])
+                ),
+                "take-off": list(map(times.__getitem__, columns["takeoff"])),
+                "delay": columns["delay"].tolist(),
+            }
+
+    def iter_id_batches(self, catalog):
+        """\
+        Read the row groups as columns of integers (see processRecords.RecordBatches):
+        the indexes of the dictionaries of the file are replaced by IDs of the catalog
+
+        Args:
+            catalog(catalog.Catalog): catalog giving the IDs of the names
+
+        Yields:
+            dict: array of integers by column name: "date" (column "day"), "time",
+                "delay", and the IDs of "airline", "code", "destination"
+        """
+        # NOTE: the names are looked up in the catalog once per file, not per record
+        ids = {kind: catalog[kind].get_ids(self.dictionaries[kind]) for kind in catalog.kinds}
+        for columns in self.iter_row_groups():
+            batch = {"date": columns["day"], "time": columns["time"], "delay": columns["delay"]}
+            for kind in catalog.kinds:
+                batch[kind] = list(map(ids[kind].__getitem__, columns[kind]))
+            yield batch
+
+    def __iter__(self):
+        for columns in self.iter_batches():
+            values = [columns[key] for key in RECORD_KEYS]
+            for record in zip(*values):
+                yield dict(zip(RECORD_KEYS, record))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input_path", help="Text file with records")
+    parser.add_argument("output_path", help="Columnar log to write")
+    cmd = parser.parse_args()
+
+    counters = Counter()
+    nb_records = convert_log(cmd.input_path, cmd.output_path, counters=counters)
+    print(
+        f"Successfully wrote {nb_records} records in {cmd.output_path!r}"
+        f" ({counters['malformed_lines']} malformed lines skipped)"
+    )
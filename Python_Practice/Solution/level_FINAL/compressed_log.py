@@ -0,0 +1,179 @@
+#!python
+
+"""Text logs compressed with gzip, bz2, xz or zstd, decompressed while they are read
+
+The compression is detected from the first bytes of the file (not from its name).
+The decompressed lines are read by large blocks, optionally decompressed by another
+thread while the records are parsed (the decompressors release the GIL):
+
+    with open_log("list_records.txt.gz", threaded=True) as f:
+        for line in f:
+            ...
+
+Reading zstd logs needs the module "compression.zstd" (Python 3.14+) or the
+package "zstandard" (pip install zstandard).
+"""
+
+import io
+
+# Number of bytes of decompressed data read at once
+BLOCK_SIZE = 1 << 20
+# Number of blocks decompressed in advance by the thread (see ThreadedReader)
+NB_BLOCKS_AHEAD = 4
+# First bytes of the compressed files: magic number => compression
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+
+def get_compression(file_path: str):
+    """Get the compression of a file: "gzip", "bz2", "xz", "zstd" (None if not compressed
+    or if it cannot be read)
+    """
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(max(map(len, MAGIC_NUMBERS)))
+    except OSError:
+        return None
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_decompressed(file_path: str, compression: str):
+    """\
+    Open a compressed file to read its decompressed data
+
+    Args:
+        file_path: Path of file to read
+        compression: "gzip", "bz2", "xz" or "zstd" (see get_compression)
+    """
+    # NOTE: the modules are imported only when a compressed file is read
+    if compression == "gzip":
+        import gzip
+
+        return gzip.GzipFile(file_path, "rb")
+    if compression == "bz2":
+        import bz2
+
+        return bz2.BZ2File(file_path, "rb")
+    if compression == "xz":
+        import lzma
+
+        return lzma.LZMAFile(file_path, "rb")
+    if compression == "zstd":
+        try:
+            from compression import zstd
+
+            return zstd.ZstdFile(file_path, "rb")
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("reading zstd logs needs the package 'zstandard'")
+        # NOTE: the file is closed with the stream
+        f = open(file_path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(f, read_size=BLOCK_SIZE)
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+class ThreadedReader(io.RawIOBase):
+    """\
+    Stream of the blocks read from another stream by a thread
+
+    The thread reads the next blocks (e.g. decompresses them) while the previous
+    ones are processed: at most NB_BLOCKS_AHEAD blocks are kept in memory.
+    """
+
+    def __init__(self, stream, block_size: int = BLOCK_SIZE):
+        """\
+        Args:
+            stream: stream to read (closed with the ThreadedReader)
+            block_size: number of bytes read at once by the thread
+        """
+        # NOTE: the modules are imported only when a file is read by a thread
+        import queue, threading
+
+        super().__init__()
+        self.stream = stream
+        self.block_size = block_size
+        self.blocks = queue.Queue(NB_BLOCKS_AHEAD)
+        self.block = memoryview(b"")
+        self.at_end = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.read_blocks, daemon=True)
+        self.thread.start()
+
+    def read_blocks(self):
+        """Read all the blocks of the stream (in the thread), b"" at the end"""
+        import queue
+
+        block = None
+        while block != b"" and not self.stopping.is_set():
+            try:
+                block = self.stream.read(self.block_size)
+            except Exception as e:
+                # NOTE: the error is raised by the reader of the blocks
+                block = e
+            while not self.stopping.is_set():
+                try:
+                    self.blocks.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue  # Blocks not read yet
+            if isinstance(block, Exception):
+                return
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.block and not self.at_end:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            self.block = memoryview(block)
+            self.at_end = not block
+        nb_bytes = min(len(buffer), len(self.block))
+        buffer[:nb_bytes] = self.block[:nb_bytes]
+        self.block = self.block[nb_bytes:]
+        return nb_bytes
+
+    def close(self):
+        if not self.closed:
+            # The thread stops after the block being read (it never waits for a reader)
+            self.stopping.set()
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+def open_log(file_path: str, start: int = 0, threaded: bool = False):
+    """\
+    Open a log (compressed or not) to read its lines in binary mode
+
+    Args:
+        file_path: Path of file to read
+        start: position of the first byte to read (in the decompressed data)
+        threaded: decompress in another thread (not used if the file is not compressed)
+
+    Returns:
+        file object (to use with "with")
+    """
+    compression = get_compression(file_path)
+    if compression is None:
+        f = open(file_path, "rb")
+        f.seek(start)
+        return f
+
+    stream = open_decompressed(file_path, compression)
+    if start:
+        stream.seek(start)  # NOTE: the data before "start" is decompressed
+    if threaded:
+        stream = ThreadedReader(stream)
+    return io.BufferedReader(stream, buffer_size=BLOCK_SIZE)
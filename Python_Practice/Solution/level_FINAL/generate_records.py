@@ -0,0 +1,134 @@
+#!python
+
+"""Generate synthetic take-off records (same format as list_records.txt)
+
+Each line contains: <date>, <expected time>, <flight code>, <airline>, <destination>, <take-off>
+The generation is deterministic: the same options always give the same file.
+"""
+
+import argparse
+import datetime
+import random
+import string
+
+DESTINATIONS = [
+    "Paris Ch. de Gaulle", "Frankfurt", "Dubai", "Singapore", "Seoul", "Tokyo Narita",
+    "Osaka Kansai", "Hong Kong", "Bangkok", "Sydney", "Los Angeles", "New York JFK",
+    "London Heathrow", "Amsterdam", "Moscow", "Beijing", "Manila", "Kalibo",
+]
+
+
+def format_minutes(minutes: int) -> str:
+    """Format a number of minutes in the day as "H:MM" (e.g. 5 => "0:05")"""
+    hours, minutes = divmod(minutes % (24 * 60), 60)
+    return f"{hours}:{minutes:02d}"
+
+
+def get_airline_code(index: int) -> str:
+    """\
+    Get the 2-character code of an airline (e.g. 0 => "AA", 1 => "AB", 36 => "BA"),
+    unique for each index: after "Z9" (index 935) the codes start with a digit
+
+    Raises:
+        ValueError: if the index is too large for a unique code (1296 airlines)
+    """
+    characters = string.ascii_uppercase + string.digits
+    if not 0 <= index < len(characters) ** 2:
+        raise ValueError(f"No unique airline code for more than {len(characters) ** 2} airlines")
+    first, second = divmod(index, len(characters))
+    return characters[first] + characters[second]
+
+
+def iter_synthetic_lines(
+    nb_rows: int,
+    nb_airlines: int = 20,
+    nb_flights: int = 50,
+    malformed_rate: float = 0.0,
+    midnight_rate: float = 0.01,
+    nb_days: int = 30,
+    seed: int = 0,
+):
+    """\
+    Generate lines of take-off records
+
+    Args:
+        nb_rows: number of lines to generate
+        nb_airlines: number of airlines
+        nb_flights: number of flights per airline
+        malformed_rate: probability of a line with an incorrect number of data
+        midnight_rate: probability of a take-off after midnight for a flight expected before
+        nb_days: number of days covered by the records
+        seed: seed of the random generator
+
+    Yields:
+        lines (str) ending with a newline
+    """
+    rnd = random.Random(seed)
+
+    # Each flight has a destination and an expected time
+    flights = list()
+    for index in range(nb_airlines):
+        name, code = f"Airline {index:03d}", get_airline_code(index)
+        for number in rnd.sample(range(10000), min(nb_flights, 10000)):
+            destination = rnd.choice(DESTINATIONS)
+            flights.append((name, f"{code}{number:03d}", destination, rnd.randrange(24 * 60)))
+
+    first_day = datetime.date(2015, 8, 20)
+    for row in range(nb_rows):
+        day = first_day + datetime.timedelta(days=row * nb_days // max(nb_rows, 1))
+        name, code, destination, expected = rnd.choice(flights)
+        if rnd.random() < midnight_rate:
+            # Expected just before midnight, taking off just after
+            expected = 24 * 60 - rnd.randint(1, 30)
+            delay = 24 * 60 - expected + rnd.randint(0, 60)
+        else:
+            delay = min(int(rnd.expovariate(1 / 20)), 600) - 10
+
+        fields = [
+            day.isoformat(),
+            format_minutes(expected),
+            code,
+            name,
+            destination,
+            format_minutes(expected + delay),
+        ]
+        if rnd.random() < malformed_rate:
+            del fields[rnd.randrange(len(fields))]
+        yield ", ".join(fields) + "\n"
+
+
+def generate_records(file_path: str, nb_rows: int, **options):
+    """\
+    Write a file of synthetic take-off records (see iter_synthetic_lines for options)
+
+    Args:
+        file_path: Path of file to write
+        nb_rows: number of lines to generate
+    """
+    with open(file_path, "w") as f:
+        f.writelines(iter_synthetic_lines(nb_rows, **options))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_path")
+    parser.add_argument("-r", "--rows", type=int, default=1000, help="Number of lines")
+    parser.add_argument("--airlines", type=int, default=20, help="Number of airlines")
+    parser.add_argument("--flights", type=int, default=50, help="Flights per airline")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--midnight-rate", type=float, default=0.01)
+    parser.add_argument("--days", type=int, default=30, help="Number of days")
+    parser.add_argument("--seed", type=int, default=0)
+    cmd = parser.parse_args()
+
+    generate_records(
+        cmd.output_path,
+        cmd.rows,
+        nb_airlines=cmd.airlines,
+        nb_flights=cmd.flights,
+        malformed_rate=cmd.malformed_rate,
+        midnight_rate=cmd.midnight_rate,
+        nb_days=cmd.days,
+        seed=cmd.seed,
+    )
+    print(f"Successfully wrote {cmd.rows} records in {cmd.output_path!r}")
@@ -1,24 +1,69 @@
 #!python
 
+import time
+
+# Time to import the modules used by the program (see main, stage "import")
+_import_start = time.perf_counter()
+
 import airlines
-import re, argparse, datetime
+import datetime, os
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
+from itertools import repeat
+from operator import itemgetter
 
-# tag::header[]
+# NOTE: the other modules (e.g. columnar_log, ranking, report_template, snapshot,
+# multiprocessing) are imported by the functions using them: for a small file, starting
+# the program takes more time than reading the records
+IMPORT_TIME = time.perf_counter() - _import_start
+# Maximum import time in seconds (counter "import_budget_exceeded" is set above it)
+# NOTE: about 11 ms measured with the compiled modules (__pycache__), up to 30 ms when
+# the modules are compiled at import
+IMPORT_TIME_BUDGET = 0.02
+
+# Number of bytes of lines read at once by RecordBatches (~ 20000 records)
+BATCH_SIZE = 1 << 20
+# Columns of the records given to Airline.add_records (see add_record_columns)
+BATCH_KEYS = ("date", "time", "code", "destination", "delay")
 
 
-def read_flight_records(file_path: str):
+def iter_flight_records(
+    file_path: str,
+    start: int = 0,
+    end: int = None,
+    counters: Counter = None,
+    threaded: bool = False,
+    record_filter=None,
+    quarantine=None,
+    first_line_number: int = 1,
+):
     """\
-    Read flight records from a given file and returns the list of take-off records.
+    Lazily read flight records from a given file, yielding one take-off record at a time.
     Each element is a dict with keys: date, time, code, airline, destination, take-off
 
+    Lines with an incorrect number of data or a date which does not exist (e.g.
+    "2015-02-30") are reported and skipped.
+    Compressed files are decompressed while they are read (see compressed_log.py).
+
     Args:
         file_path: Path of file to read
+        start: position (in bytes) of the first line to read
+        end: lines starting at or after this position (in bytes) are not read
+            (positions shall be at the beginning of a line, see split_file)
+        counters: if given, "malformed_lines" is incremented for each line skipped
+        threaded: decompress a compressed file in another thread
+        record_filter(record_filter.RecordFilter): if given, only the matching records
+            are read (the other lines are skipped before being decoded, and are not
+            checked for an incorrect number of data)
+        quarantine(validation.Quarantine): if given, the format of each line is checked
+            (see validation.LineValidator): the invalid lines are written in the
+            quarantine file instead of being printed
+        first_line_number: number of the line at position "start" (in the quarantine)
 
-    Returns:
-        list of take off records
+    Yields:
+        take off records (dict)
     """
-    # end::header[]
-    list_records = list()
     record_keys = ["date", "time", "code", "airline", "destination", "take-off"]
 
     # We will extract each info and match it to "record_keys" by using zip(l1, l2)
@@ -33,17 +78,45 @@ def read_flight_records(file_path: str):
     )
     # Solution #2: using <line>.split(",") and stripping all spaces around each element
     # We then need to check the number of elements in split result
+    # NOTE: the strict validation mode checks each line with a compiled pattern
+    # (option "quarantine", see validation.py)
+    if quarantine is not None:
+        from validation import LineValidator
+
+        validator = LineValidator()
+        strings = DecodedFields()
+    valid_dates = CheckedDates()
+    import compressed_log
 
     try:
-        with open(file_path) as f:
-            for record in f:
+        # NOTE: we read bytes to know the position of each line in the file
+        with compressed_log.open_log(file_path, start, threaded) as f:
+            position = start
+            for line_number, line in enumerate(f, first_line_number):
+                if end is not None and position >= end:
+                    break
+                position += len(line)
+                if quarantine is not None:
+                    fields = line.split(b",")
+                    if not validator.match_fields(fields):
+                        if line.strip():  # Skip empty lines
+                            quarantine.add(file_path, line_number, line)
+                        continue
+                    # NOTE: the fields split for the validation are decoded once each
+                    data = list(map(strings.__getitem__, fields))
+                    if record_filter is None or record_filter.match_fields(data):
+                        yield dict(zip(record_keys, data))
+                    continue
+                if record_filter is not None and not record_filter.match_line(line):
+                    continue  # Cannot match: not decoded
+                record = line.decode()
+
                 # == Solution #1 (regex) ==
                 # if record.strip() == "":
                 #     continue  # Skip empty lines
                 # match_record = re.match(pattern, record)
                 # if match_record:
-                #     record_dict = dict(zip(record_keys, match_record.groups()))
-                #     list_records.append(record_dict)
+                #     yield dict(zip(record_keys, match_record.groups()))
                 # else:
                 #     print(f"Following line of {file_path!r} does not match pattern: {record!r}")
 
@@ -57,24 +130,429 @@ def read_flight_records(file_path: str):
                     print(
                         f"Following line of {file_path!r} has incorrect number of data: {record!r}"
                     )
-                else:
-                    record_dict = dict(zip(record_keys, data))
-                    list_records.append(record_dict)
+                    if counters is not None:
+                        counters["malformed_lines"] += 1
+                elif not valid_dates[data[0]]:
+                    print(f"Following line of {file_path!r} has an invalid date: {record!r}")
+                    if counters is not None:
+                        counters["malformed_lines"] += 1
+                elif record_filter is None or record_filter.match_fields(data):
+                    # NOTE: "yield" hands the record to the caller right away,
+                    # so we never keep more than one line in memory
+                    yield dict(zip(record_keys, data))
+
+    except Exception as e:
+        raise IOError(f"Error while trying to read input file {file_path!r}: {e}")
+
+
+class DecodedFields(dict):
+    """Cache of the fields found in a file: raw field (bytes) => stripped field (str)
+    Each distinct field is decoded once and the same string is returned afterwards
+    """
+
+    def __missing__(self, field: bytes) -> str:
+        value = self[field] = field.strip().decode()
+        return value
+
+
+class CheckedDates(dict):
+    """Cache of the dates found in a file: date field (str or raw bytes) => True if the
+    date exists (see airlines.is_valid_date). Each distinct date is checked once
+    """
+
+    def __missing__(self, field) -> bool:
+        date_iso = field.decode() if isinstance(field, bytes) else field
+        valid = self[field] = airlines.is_valid_date(date_iso.strip())
+        return valid
+
+
+def iter_flight_records_mmap(
+    file_path: str,
+    start: int = 0,
+    end: int = None,
+    counters: Counter = None,
+    record_filter=None,
+    quarantine=None,
+    first_line_number: int = 1,
+):
+    """\
+    Same as iter_flight_records, but the file is memory-mapped and scanned as bytes
+
+    Each distinct field (e.g. a date, a destination, a time) is decoded only once:
+    records share the same string objects instead of allocating new ones per line.
+
+    Args:
+        file_path: Path of file to read
+        start: position (in bytes) of the first line to read
+        end: lines starting at or after this position (in bytes) are not read
+        counters: if given, "malformed_lines" is incremented for each line skipped
+        record_filter: if given, only the matching records are read (see
+            iter_flight_records)
+        quarantine, first_line_number: if given, the invalid lines are written in the
+            quarantine file (see iter_flight_records)
+
+    Yields:
+        take off records (dict)
+    """
+    record_keys = ["date", "time", "code", "airline", "destination", "take-off"]
+    import mmap
+
+    strings = DecodedFields()
+    valid_dates = CheckedDates()
+    if quarantine is not None:
+        from validation import LineValidator
+
+        validator = LineValidator()
+
+    try:
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if start >= end:
+                return  # NOTE: an empty file cannot be memory-mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                data.seek(start)
+                position = start
+                for line_number, line in enumerate(iter(data.readline, b""), first_line_number):
+                    if position >= end:
+                        break
+                    position += len(line)
+                    if quarantine is not None:
+                        # NOTE: the fields are validated once split (see LineValidator)
+                        fields = line.split(b",")
+                        if not validator.match_fields(fields):
+                            if line.strip():
+                                quarantine.add(file_path, line_number, line)
+                            continue
+                    elif record_filter is not None and not record_filter.match_line(line):
+                        continue
+                    else:
+                        fields = line.split(b",")
+                    if len(fields) != len(record_keys):
+                        if line.strip():  # Skip empty lines
+                            print(
+                                f"Following line of {file_path!r} has incorrect "
+                                f"number of data: {line.decode()!r}"
+                            )
+                            if counters is not None:
+                                counters["malformed_lines"] += 1
+                        continue
+                    if not valid_dates[fields[0]]:
+                        print(
+                            f"Following line of {file_path!r} has an invalid date: "
+                            f"{line.decode()!r}"
+                        )
+                        if counters is not None:
+                            counters["malformed_lines"] += 1
+                        continue
+                    if record_filter is not None and not record_filter.match_fields(fields):
+                        continue
+
+                    date, time, code, airline, destination, takeoff = fields
+                    yield {
+                        "date": strings[date],
+                        "time": strings[time],
+                        "code": strings[code],
+                        "airline": strings[airline],
+                        "destination": strings[destination],
+                        "take-off": strings[takeoff],
+                    }
 
     except Exception as e:
         raise IOError(f"Error while trying to read input file {file_path!r}: {e}")
 
-    return list_records
+
+class RecordBatches:
+    """\
+    Records of a file read by blocks of lines: each block is split in columns
+    (one list per key of record) so that the records can be added to the Airlines
+    without a dict and a call for each record (see get_ratings_airlines)
+
+    Iterating on the object gives the same dict records as iter_flight_records.
+    """
+
+    record_keys = ("date", "time", "code", "airline", "destination", "take-off")
+
+    def __init__(
+        self,
+        file_path: str,
+        start: int = 0,
+        end: int = None,
+        counters: Counter = None,
+        batch_size: int = BATCH_SIZE,
+        threaded: bool = False,
+        record_filter=None,
+        quarantine=None,
+        first_line_number: int = 1,
+    ):
+        """\
+        Args:
+            file_path: Path of file to read
+            start, end, counters, threaded, record_filter: see iter_flight_records
+            batch_size: number of bytes of lines read at once
+            quarantine: if given, the invalid lines are written in the quarantine file
+                (each distinct field is checked once, see validation.FieldValidator)
+            first_line_number: number of the line at position "start" (in the quarantine)
+        """
+        self.file_path = file_path
+        self.start = start
+        self.end = end
+        self.counters = counters
+        self.batch_size = batch_size
+        self.threaded = threaded
+        self.record_filter = record_filter
+        self.quarantine = quarantine
+        self.first_line_number = first_line_number
+
+    def iter_batches(self):
+        """\
+        Read the file by blocks of lines
+
+        Yields:
+            dict: list of values (str) of the records of a block, by key of record
+        """
+        strings = DecodedFields()  # Each distinct field is decoded once
+        for columns in self.iter_columns():
+            yield {key: list(map(strings.__getitem__, column)) for key, column in columns.items()}
+
+    def iter_id_batches(self, catalog):
+        """\
+        Read the file by blocks of lines, with the values converted to integers
+
+        Args:
+            catalog(catalog.Catalog): catalog giving the IDs of the airlines, codes and
+                destinations
+
+        Yields:
+            dict: columns of the records of a block: "date", "time" (encoded, see
+                airlines.FlightRecords), "delay", and "airline", "code", "destination"
+                (IDs in the catalog)
+        """
+        import columnar_log
+
+        def converted(function):
+            # Each distinct field is converted once (same as DecodedFields)
+            return columnar_log.Decoded(lambda field: function(field.strip().decode()))
+
+        days, times = converted(airlines.encode_date), converted(airlines.encode_time)
+        minutes = converted(airlines.get_minutes)
+        ids = {kind: converted(catalog[kind].__getitem__) for kind in catalog.kinds}
+        for columns in self.iter_columns():
+            batch = {
+                "date": list(map(days.__getitem__, columns["date"])),
+                "time": list(map(times.__getitem__, columns["time"])),
+                "delay": airlines.get_delays_minutes(
+                    map(minutes.__getitem__, columns["time"]),
+                    map(minutes.__getitem__, columns["take-off"]),
+                ),
+            }
+            for kind in catalog.kinds:
+                batch[kind] = list(map(ids[kind].__getitem__, columns[kind]))
+            yield batch
+
+    def iter_columns(self):
+        """\
+        Read the file by blocks of lines split in fields (malformed lines are removed)
+
+        Yields:
+            dict: raw fields (bytes) of the records of a block, by key of record
+        """
+        if self.quarantine is not None:
+            import validation
+
+            validator = validation.FieldValidator()
+            line_number = self.first_line_number - 1  # number of lines before the block
+        valid_dates = CheckedDates()
+        import compressed_log
+
+        try:
+            with compressed_log.open_log(self.file_path, self.start, self.threaded) as f:
+                position = self.start
+                while self.end is None or position < self.end:
+                    lines = f.readlines(self.batch_size)
+                    if not lines:
+                        break
+                    size = sum(map(len, lines))
+                    if self.end is not None and position + size > self.end:
+                        # Only the lines starting before "end"
+                        nb_lines, size = 0, 0
+                        while position + size < self.end:
+                            size += len(lines[nb_lines])
+                            nb_lines += 1
+                        lines = lines[:nb_lines]
+                    position += size
+
+                    if self.quarantine is not None:
+                        # NOTE: all the lines are validated (not only the lines to read)
+                        columns = self.remove_invalid(lines, line_number, validator)
+                        line_number += len(lines)
+                        if self.record_filter is not None and columns:
+                            rows = zip(*columns.values())
+                            rows = list(filter(self.record_filter.match_fields, rows))
+                            columns = dict(zip(self.record_keys, zip(*rows)))
+                    else:
+                        if self.record_filter is not None:
+                            # Lines which cannot match are not split (see RecordFilter)
+                            lines = self.record_filter.filter_lines(lines)
+                        rows = [line.split(b",") for line in lines]
+                        if set(map(len, rows)) != {len(self.record_keys)}:
+                            rows = self.remove_malformed(lines, rows)
+                        if not all(map(valid_dates.__getitem__, map(itemgetter(0), rows))):
+                            rows = self.remove_invalid_dates(rows, valid_dates)
+                        if self.record_filter is not None:
+                            rows = list(filter(self.record_filter.match_fields, rows))
+                        # NOTE: zip(*rows) transposes the rows into columns
+                        columns = dict(zip(self.record_keys, zip(*rows)))
+                    if columns:
+                        yield columns
+
+        except Exception as e:
+            raise IOError(f"Error while trying to read input file {self.file_path!r}: {e}")
+
+    def remove_malformed(self, lines, rows):
+        """Remove the rows with an incorrect number of data and report their lines
+        (empty lines are skipped)
+        """
+        rows_ok = list()
+        for line, row in zip(lines, rows):
+            if len(row) == len(self.record_keys):
+                rows_ok.append(row)
+            elif line.strip():
+                print(
+                    f"Following line of {self.file_path!r} has incorrect "
+                    f"number of data: {line.decode()!r}"
+                )
+                if self.counters is not None:
+                    self.counters["malformed_lines"] += 1
+        return rows_ok
+
+    def remove_invalid_dates(self, rows, valid_dates: CheckedDates):
+        """Remove the rows with a date which does not exist and report their lines"""
+        rows_ok = list()
+        for row in rows:
+            if valid_dates[row[0]]:
+                rows_ok.append(row)
+            else:
+                print(
+                    f"Following line of {self.file_path!r} has an invalid date: "
+                    f"{b','.join(row).decode()!r}"
+                )
+                if self.counters is not None:
+                    self.counters["malformed_lines"] += 1
+        return rows_ok
+
+    def remove_invalid(self, lines, line_number: int, validator):
+        """\
+        Split the lines in columns of fields and remove the invalid lines, written in
+        the quarantine file (empty lines are skipped)
+
+        Args:
+            lines: lines of a block
+            line_number: number of lines before the block
+            validator(validation.FieldValidator): fields already validated
+
+        Returns:
+            dict: raw fields (bytes) of the valid records, by key of record
+        """
+        rows = [line.split(b",") for line in lines]
+        if set(map(len, rows)) == {len(self.record_keys)}:
+            columns = dict(zip(self.record_keys, zip(*rows)))
+            invalid = validator.get_invalid_positions(columns)
+            if not invalid:
+                return columns  # Usual case: all the lines are valid
+            valid = [position for position in range(len(rows)) if position not in invalid]
+        else:
+            valid = [p for p, row in enumerate(rows) if len(row) == len(self.record_keys)]
+            columns = dict(zip(self.record_keys, zip(*(rows[p] for p in valid))))
+            invalid = validator.get_invalid_positions(columns) if valid else ()
+            valid = [position for i, position in enumerate(valid) if i not in invalid]
+
+        for position in sorted(set(range(len(lines))).difference(valid)):
+            if lines[position].strip():
+                self.quarantine.add(self.file_path, line_number + position + 1, lines[position])
+        return dict(zip(self.record_keys, zip(*(rows[position] for position in valid))))
+
+    def __iter__(self):
+        for columns in self.iter_batches():
+            for values in zip(*columns.values()):
+                yield dict(zip(self.record_keys, values))
+
+
+# Functions to read the records of a file, by name of parser (see option "--parser")
+RECORD_PARSERS = {
+    "split": iter_flight_records,
+    "mmap": iter_flight_records_mmap,
+    "columns": RecordBatches,
+}
+
+
+def get_record_parser(
+    file_path: str,
+    parser: str = "split",
+    threaded: bool = False,
+    record_filter=None,
+    quarantine=None,
+):
+    """Get the function reading the records of a file (key of RECORD_PARSERS)
+    Columnar logs are detected and read by row groups, memory-mapped with "mmap"
+    (see columnar_log.ColumnarLog). Compressed logs are decompressed while they are
+    read, in another thread if "threaded" (see compressed_log.open_log).
+    With a record_filter, the function reads only the matching records.
+    With a quarantine, the lines of a text log are validated (see validation.py).
+    """
+    import columnar_log, compressed_log
+
+    options = {} if record_filter is None else {"record_filter": record_filter}
+    if columnar_log.is_columnar_log(file_path):
+        return partial(columnar_log.ColumnarLog, use_mmap=parser == "mmap", **options)
+    if quarantine is not None:
+        options["quarantine"] = quarantine
+    if compressed_log.get_compression(file_path):
+        # NOTE: decompressed data cannot be memory-mapped: it is read by blocks of lines
+        if parser == "mmap":
+            parser = "columns"
+        return partial(RECORD_PARSERS[parser], threaded=threaded, **options)
+    if options:
+        return partial(RECORD_PARSERS[parser], **options)
+    return RECORD_PARSERS[parser]
 
 
 # tag::header[]
 
 
-def get_ratings_airlines(list_records):
+def read_flight_records(file_path: str, record_filter=None):
+    """\
+    Read flight records from a given file and returns the list of take-off records.
+    Each element is a dict with keys: date, time, code, airline, destination, take-off
+
+    Args:
+        file_path: Path of file to read
+        record_filter: if given, only the matching records are read (see
+            iter_flight_records)
+
+    Returns:
+        list of take off records
+    """
+    # end::header[]
+    # All the work is done by the generator: we only gather its records in a list
+    # (use "iter_flight_records" directly to process the records one by one)
+    return list(iter_flight_records(file_path, record_filter=record_filter))
+
+
+# tag::header[]
+
+
+def get_ratings_airlines(list_records, airlines_dic=None, catalog=None):
     """From the list of records, create a dictionary with all Airlines
 
     Args:
-        list_records(list): list of dict returned by read_flight_records
+        list_records(iterable): dict records returned by read_flight_records
+            (or yielded by iter_flight_records, to stream records from the file)
+            or RecordBatches/columnar_log.ColumnarLog (records added by blocks,
+            see add_record_columns)
+        airlines_dic(dict): existing dictionary to update with the records (optional)
+        catalog(catalog.Catalog): IDs of the names read by blocks (optional, see
+            add_record_columns)
 
     Returns:
         dictionary "airlines_dic" with:
@@ -85,7 +563,23 @@ def get_ratings_airlines(list_records):
     # We will loop each element of input list and
     # * Create a new Airline if it does not exist in the dictionary
     # * Add the record in the Airline object
-    airlines_dic = dict()
+    if airlines_dic is None:
+        airlines_dic = dict()
+
+    # Records read as columns: each block is added at once, with the names given as
+    # integers if the reader can (names are resolved once per airline and flight)
+    if hasattr(list_records, "iter_id_batches"):
+        if catalog is None:
+            from catalog import Catalog
+
+            catalog = Catalog()
+        for columns in list_records.iter_id_batches(catalog):
+            add_record_columns(columns, airlines_dic, catalog)
+        return airlines_dic
+    if hasattr(list_records, "iter_batches"):
+        for columns in list_records.iter_batches():
+            add_record_columns(columns, airlines_dic)
+        return airlines_dic
 
     for record in list_records:
         name = record["airline"]
@@ -99,30 +593,548 @@ def get_ratings_airlines(list_records):
     return airlines_dic
 
 
-# tag::header[]
+def add_record_columns(columns: dict, airlines_dic: dict, catalog=None):
+    """Add a block of records given as columns to the Airlines: the records are
+    grouped by airline and added at once (same result as adding them one by one)
+
+    Args:
+        columns(dict): lists of values by key of record (see RecordBatches),
+            with the delays in key "delay" if they are already calculated
+        airlines_dic(dict): dictionary of Airlines to update (key = airline name)
+        catalog(catalog.Catalog): if given, the columns are integers (see
+            RecordBatches.iter_id_batches): the name of each airline is resolved
+            once per block
+    """
+    # Delays of the block are calculated at once (see airlines.get_delays_cached)
+    if "delay" not in columns:
+        columns = dict(columns)
+        columns["delay"] = airlines.get_delays_cached(columns["time"], columns["take-off"])
 
+    # Positions of the records of each airline (in order of first appearance)
+    positions = airlines.group_positions(columns["airline"])
+    for name, airline_positions in positions.items():
+        code = columns["code"][airline_positions[0]]
+        if catalog is not None:
+            name, code = catalog.airline.names[name], catalog.code.names[code]
+        if name not in airlines_dic:
+            airlines_dic[name] = airlines.Airline(name, code[:2])  # First 2 characters
+        select = airlines.select_positions(airline_positions)
+        batch = {key: select(columns[key]) for key in BATCH_KEYS}
+        airlines_dic[name].add_records(batch, catalog)
 
-def list_sorted_ratings(airlines_dic):
-    """Sort the airlines and flights based on the probability to be late
+
+def count_records(airlines_dic):
+    """Number of records in all the Airlines of a dictionary"""
+    return sum(airline.nb_records for airline in airlines_dic.values())
+
+
+def split_file(file_path: str, nb_chunks: int):
+    """Split a file in chunks of similar size, cut at the beginning of a line
 
     Args:
-        airlines_dic(dict): Dictionary with Airline objects
+        file_path: Path of file to split
+        nb_chunks: number of chunks (fewer chunks are returned for small files)
 
     Returns:
-        rating_airlines(list): list of Airlines sorted by late probability (less late first)
-        rating_flights(list): list of flights sorted by late probability (less late first)
+        list of (start, end) positions in bytes, to be used with iter_flight_records
+    """
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, "rb") as f:
+        for index in range(1, nb_chunks):
+            # Go just before the approximate position and skip to the next line
+            f.seek(max(size * index // nb_chunks - 1, boundaries[-1]))
+            f.readline()
+            position = f.tell()
+            if position > boundaries[-1] and position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
 
-    NOTE: Each element of the returned lists contains the following tuple:
-        (<airline|flight code>, <% late>, <average delay>)
+
+def get_ratings_airlines_chunk(
+    file_path: str, start: int, end: int, parser: str = "split", record_filter=None
+):
+    """Create the dictionary of Airlines with the records of a chunk of a file
+    (parser is a key of RECORD_PARSERS, see get_record_parser for record_filter)
+
+    Returns:
+        dictionary "airlines_dic", counters of the parser (e.g. "malformed_lines") and
+        "get_delay_calls" (delays calculated by the process, see read_ratings_airlines)
+    """
+    counters = Counter()
+    nb_delay_calls = airlines.count_delay_calls()
+    read_records = get_record_parser(file_path, parser, record_filter=record_filter)
+    airlines_dic = get_ratings_airlines(read_records(file_path, start, end, counters))
+    counters["get_delay_calls"] += airlines.count_delay_calls() - nb_delay_calls
+    return airlines_dic, counters
+
+
+def merge_ratings_airlines(list_airlines_dic):
+    """Merge dictionaries of Airlines (e.g. created for each chunk of a file)
+
+    Args:
+        list_airlines_dic(iterable): dictionaries returned by get_ratings_airlines,
+            in the order of the records
+
+    Returns:
+        new dictionary "airlines_dic" with all the records
+        (same as calling get_ratings_airlines with all the records)
+    """
+    airlines_dic = dict()
+    for partial_dic in list_airlines_dic:
+        for name, partial_airline in partial_dic.items():
+            if name not in airlines_dic:
+                airlines_dic[name] = airlines.Airline(name, partial_airline.code)
+            airlines_dic[name].merge(partial_airline)
+    return airlines_dic
+
+
+def get_ratings_airlines_parallel(
+    file_path: str,
+    nb_workers: int,
+    parser: str = "split",
+    counters: Counter = None,
+    record_filter=None,
+):
+    """Create the dictionary of Airlines by reading a file with several processes
+    Each process reads a chunk of the file; the resulting Airlines are then merged
+
+    Args:
+        file_path: Path of file to read
+        nb_workers: number of processes
+        parser: name of the function reading the records (key of RECORD_PARSERS)
+        counters: if given, updated with the counters of the parser of each chunk
+        record_filter: if given, only the matching records are read
+
+    Returns:
+        dictionary "airlines_dic" (same as get_ratings_airlines on all the records)
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = split_file(file_path, nb_workers)
+    with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+        # NOTE: "map" returns the results in the order of the chunks
+        starts, ends = zip(*chunks)
+        paths, parsers = repeat(file_path, len(chunks)), repeat(parser, len(chunks))
+        filters = repeat(record_filter, len(chunks))
+        results = list(
+            executor.map(get_ratings_airlines_chunk, paths, starts, ends, parsers, filters)
+        )
+
+    if counters is not None:
+        for _, chunk_counters in results:
+            counters.update(chunk_counters)
+    return merge_ratings_airlines(partial_dic for partial_dic, _ in results)
+
+
+def find_end_last_line(file_path: str, block_size: int = 1 << 16):
+    """Find the position after the last complete line of a file (i.e. after last newline)
+
+    Args:
+        file_path: Path of file
+        block_size: size of blocks read from the end of the file
+
+    Returns:
+        position in bytes (0 if the file has no complete line)
+    """
+    with open(file_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - block_size, 0)
+            f.seek(start)
+            position = f.read(end - start).rfind(b"\n")
+            if position >= 0:
+                return start + position + 1
+            end = start
+    return 0
+
+
+def count_lines(file_path: str, start: int = 0, end: int = None, block_size: int = 1 << 20):
+    """Count the lines of a file between 2 positions (i.e. the newlines)
+
+    Args:
+        file_path: Path of file
+        start, end: positions in bytes (end of file if end is None)
+        block_size: size of blocks read at once
+    """
+    nb_lines = 0
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        position = start
+        while end is None or position < end:
+            block = f.read(block_size if end is None else min(block_size, end - position))
+            if not block:
+                break
+            nb_lines += block.count(b"\n")
+            position += len(block)
+    return nb_lines
+
+
+def get_ratings_airlines_incremental(
+    file_path: str,
+    checkpoint_path: str,
+    parser: str = "split",
+    counters: Counter = None,
+    quarantine=None,
+):
+    """Update the Airlines saved in a checkpoint with the lines appended to a file
+
+    Only the lines after the position saved in the checkpoint are read.
+    All the file is read again if there is no checkpoint or if the file
+    was truncated or replaced (e.g. rotation of logs).
+
+    NOTE: a last line without newline is not read until it is completed
+    (a compressed file cannot be read from a position: ValueError is raised)
+
+    Args:
+        file_path: Path of file to read
+        checkpoint_path: Path of checkpoint file (updated with the new state)
+        parser: name of the function reading the records (key of RECORD_PARSERS)
+        counters: if given, updated with the counters of the parser and with
+            "records", the number of records added to the Airlines
+        quarantine: if given, the new lines are validated (see get_record_parser): their
+            numbers follow the number of lines saved in the checkpoint
+
+    Returns:
+        dictionary "airlines_dic" (same as get_ratings_airlines on all the records)
+    """
+    import columnar_log, compressed_log, snapshot
+
+    if compressed_log.get_compression(file_path):
+        raise ValueError(f"Compressed file {file_path!r} cannot be read incrementally")
+    start, airlines_dic, nb_lines = snapshot.load_checkpoint(checkpoint_path, file_path)
+    options = dict()
+    if columnar_log.is_columnar_log(file_path):
+        end = columnar_log.ColumnarLog(file_path).data_end  # Row groups are before the footer
+        nb_lines = None
+    elif quarantine is not None:
+        end = find_end_last_line(file_path)
+        # NOTE: the lines are counted only for the quarantine (the new lines are read twice)
+        if nb_lines is None:
+            nb_lines = count_lines(file_path, 0, start)  # Not counted by last update
+        options["first_line_number"] = nb_lines + 1
+        nb_lines += count_lines(file_path, start, end)
+    else:
+        end = find_end_last_line(file_path)
+        nb_lines = None
+    nb_records = count_records(airlines_dic or {})
+    read_records = get_record_parser(file_path, parser, quarantine=quarantine)
+    records = read_records(file_path, start, end, counters, **options)
+    airlines_dic = get_ratings_airlines(records, airlines_dic)
+    if counters is not None:
+        counters["records"] += count_records(airlines_dic) - nb_records
+    snapshot.save_checkpoint(checkpoint_path, file_path, end, airlines_dic, nb_lines)
+    return airlines_dic
+
+
+def read_ratings_airlines(
+    file_path: str,
+    nb_workers: int = 1,
+    parser: str = "split",
+    cache_path: str = None,
+    checkpoint_path: str = None,
+    counters: Counter = None,
+    threaded: bool = False,
+    record_filter=None,
+    quarantine=None,
+):
+    """Create the dictionary of Airlines from a file, with the options of the program
+
+    Args:
+        file_path: Path of file to read
+        nb_workers: number of processes (see get_ratings_airlines_parallel)
+        parser: name of the function reading the records (key of RECORD_PARSERS)
+        cache_path: Path of cache file (see snapshot.load_cached_ratings), not used
+            with a quarantine (the lines shall be validated)
+        checkpoint_path: Path of checkpoint file (see get_ratings_airlines_incremental)
+        counters: if given, updated with (only "records" if the cache is used):
+            * "malformed_lines": number of lines skipped
+            * "records": number of records added to the Airlines
+            * "get_delay_calls": number of delays calculated by the processes (see
+              airlines.count_delay_calls): couples of times already in cache and
+              delays saved in a columnar log, a cache or a checkpoint are not counted
+        threaded: decompress a compressed file in another thread (see get_record_parser)
+        record_filter(record_filter.RecordFilter): if given, only the matching records
+            are read (not allowed with a cache or a checkpoint, which keep all the records)
+        quarantine(validation.Quarantine): if given, the lines are validated and the
+            invalid lines are written in the quarantine file (counter "invalid_lines");
+            the file is read by one process (lines are numbered from the beginning)
+
+    Returns:
+        dictionary "airlines_dic" (same as get_ratings_airlines on all the records)
+    """
+    import compressed_log
+
+    if record_filter and (cache_path or checkpoint_path):
+        raise ValueError("Filtered records cannot be saved in a cache or a checkpoint")
+    if counters is None:
+        counters = Counter()
+    counters.update(malformed_lines=0, records=0, get_delay_calls=0)
+    if quarantine is not None:
+        nb_invalid_lines = quarantine.nb_lines
+        counters.update(invalid_lines=0)
+
+    if cache_path and quarantine is not None:
+        # NOTE: the lines are read again, so the invalid lines are in the quarantine
+        print(f"Cache {cache_path!r} not used with a quarantine")
+        cache_path = None
+
+    # The airlines of a previous run are reused if the input file did not change
+    if cache_path:
+        import snapshot
+
+        # NOTE: the key is computed before the records are read, so a file changed
+        # while it is read is not taken from the cache by the next run
+        file_key = snapshot.get_file_key(file_path)
+        airlines_dic = snapshot.load_cached_ratings(file_path, cache_path, file_key)
+        if airlines_dic is not None:
+            print(f"Airlines loaded from cache {cache_path!r}")
+            counters["records"] += count_records(airlines_dic)
+            return airlines_dic
+
+    # NOTE: the delays calculated by the workers are in the counters of their chunks
+    nb_delay_calls = airlines.count_delay_calls()
+    if checkpoint_path:
+        airlines_dic = get_ratings_airlines_incremental(
+            file_path, checkpoint_path, parser, counters, quarantine
+        )
+    else:
+        # NOTE: a compressed file cannot be split in chunks: it is read by one process
+        if (
+            nb_workers > 1
+            and quarantine is None
+            and not compressed_log.get_compression(file_path)
+        ):
+            airlines_dic = get_ratings_airlines_parallel(
+                file_path, nb_workers, parser, counters, record_filter
+            )
+        else:
+            # NOTE: records are streamed from the file to the airlines (constant memory)
+            read_records = get_record_parser(
+                file_path, parser, threaded, record_filter, quarantine
+            )
+            records = read_records(file_path, counters=counters)
+            airlines_dic = get_ratings_airlines(records)
+        counters["records"] += count_records(airlines_dic)
+
+    if cache_path:
+        snapshot.save_cached_ratings(file_path, cache_path, airlines_dic, file_key)
+    if quarantine is not None:
+        counters["invalid_lines"] += quarantine.nb_lines - nb_invalid_lines
+    counters["get_delay_calls"] += airlines.count_delay_calls() - nb_delay_calls
+    return airlines_dic
+
+
+def expand_input_paths(patterns):
+    """Get the input files from paths and glob patterns (e.g. "logs/*.txt.gz")
+
+    Args:
+        patterns(list): paths of files or glob patterns
+
+    Returns:
+        list of paths, without duplicates (files of a pattern are sorted)
+
+    Raises:
+        IOError: if a pattern matches no file
+    """
+    import glob
+
+    paths = dict()  # NOTE: a dict keeps the order of the paths, without duplicates
+    for pattern in patterns:
+        if glob.escape(pattern) == pattern:
+            paths[pattern] = None  # Not a pattern (the file is checked when it is read)
+            continue
+        file_paths = sorted(glob.glob(pattern))
+        if not file_paths:
+            raise IOError(f"No input file matches {pattern!r}")
+        paths.update(dict.fromkeys(file_paths))
+    return list(paths)
+
+
+def get_shard_name(file_path: str, pattern: str = None) -> str:
+    """Get the name of the shard (e.g. airport) of the records of a file
+
+    Args:
+        file_path: Path of file
+        pattern: regular expression searched in the name of the file: the shard is
+            its first group, or all the match (e.g. "^[A-Z]{3}" for "PVG_T2.txt")
+            The default (or if not found) is the name of the file without extensions
+
+    Returns:
+        name of shard (e.g. "PVG")
+    """
+    file_name = os.path.basename(file_path)
+    if pattern:
+        import re
+
+        match = re.search(pattern, file_name)
+        if match:
+            return match.group(1) if match.groups() else match.group()
+    return file_name.split(".")[0]
+
+
+def read_ratings_airlines_file(
+    file_path: str,
+    parser: str = "split",
+    threaded: bool = False,
+    record_filter=None,
+    quarantine=None,
+):
+    """Create the dictionary of Airlines of a file (see read_ratings_airlines)
+
+    Returns:
+        dictionary "airlines_dic", counters (e.g. "malformed_lines", "records")
+    """
+    counters = Counter()
+    airlines_dic = read_ratings_airlines(
+        file_path,
+        parser=parser,
+        counters=counters,
+        threaded=threaded,
+        record_filter=record_filter,
+        quarantine=quarantine,
+    )
+    return airlines_dic, counters
+
+
+def read_ratings_shards(
+    file_paths,
+    nb_workers: int = 1,
+    parser: str = "split",
+    shard_pattern: str = None,
+    counters: Counter = None,
+    threaded: bool = False,
+    record_filter=None,
+    quarantine=None,
+):
+    """Create the dictionary of Airlines of each shard (e.g. airport) of several files
+
+    The files of a shard (e.g. the logs of the terminals of an airport) are merged.
+    With several workers, the files are read in parallel (a process per file).
+
+    Args:
+        file_paths(list): Paths of files to read
+        nb_workers(int): number of processes
+        parser(str): name of the function reading the records (key of RECORD_PARSERS)
+        shard_pattern(str): pattern of the name of shard in file names (see get_shard_name)
+        counters(Counter): if given, updated with the counters of each file
+            (see read_ratings_airlines)
+        threaded(bool): decompress compressed files in another thread
+        record_filter(record_filter.RecordFilter): if given, only the matching records
+            are read
+        quarantine(validation.Quarantine): if given, the lines of the files are
+            validated (the files are read one by one by this process)
+
+    Returns:
+        dictionary: name of shard => dictionary "airlines_dic" of its files
+    """
+    if counters is None:
+        counters = Counter()
+    counters.update(malformed_lines=0, records=0, get_delay_calls=0)
+
+    parsers, threaded = repeat(parser, len(file_paths)), repeat(threaded, len(file_paths))
+    filters = repeat(record_filter, len(file_paths))
+    if quarantine is not None:
+        # NOTE: the quarantine file is written by this process only
+        read_file = partial(read_ratings_airlines_file, quarantine=quarantine)
+        results = map(read_file, file_paths, parsers, threaded, filters)
+    elif nb_workers > 1 and len(file_paths) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(nb_workers, len(file_paths))) as executor:
+            # NOTE: "map" returns the results in the order of the files
+            results = list(
+                executor.map(read_ratings_airlines_file, file_paths, parsers, threaded, filters)
+            )
+    else:
+        results = map(read_ratings_airlines_file, file_paths, parsers, threaded, filters)
+
+    shards = dict()  # name of shard => list of dictionaries of its files
+    for file_path, (airlines_dic, file_counters) in zip(file_paths, results):
+        counters.update(file_counters)
+        shards.setdefault(get_shard_name(file_path, shard_pattern), []).append(airlines_dic)
+    return {
+        name: list_dic[0] if len(list_dic) == 1 else merge_ratings_airlines(list_dic)
+        for name, list_dic in shards.items()
+    }
+
+
+def rollup_shards(shards):
+    """Combine the Airlines of several shards (e.g. airports) to rank all the shards
+
+    The Airlines are rolled up from the Airlines of the shards (see Airline.add_shard):
+    their counters are added, the records are not copied.
+
+    Args:
+        shards(dict): name of shard => dictionary "airlines_dic"
+
+    Returns:
+        dictionary "airlines_dic" of all the shards
+    """
+    airlines_dic = dict()
+    for shard_dic in shards.values():
+        for name, shard_airline in shard_dic.items():
+            if name not in airlines_dic:
+                airlines_dic[name] = airlines.Airline(name, shard_airline.code)
+            airlines_dic[name].add_shard(shard_airline)
+    return airlines_dic
+
+
+def get_shard_report_path(report_path: str, shard_name: str) -> str:
+    """Path of the report of a shard, next to the report of all the shards
+    (e.g. "report_airlines.html" => "report_airlines_PVG.html")
+    """
+    root, extension = os.path.splitext(report_path)
+    return f"{root}_{shard_name}{extension}"
+
+
+def write_report(template, report: dict, report_path: str):
+    """Write a report in a file, part by part, and print the result
+
+    Args:
+        template(report_template.ReportTemplate): compiled template of the report
+        report(dict): values of the fields of the template (see prepare_report)
+        report_path(str): Path of report to write
+    """
+    try:
+        with open(report_path, "w") as f:
+            template.render_to_file(f, report)
+    except Exception as e:
+        print(f"Error while trying to write in '{report_path}' ({e})")
+    else:
+        print(f"Successfully wrote report {report_path!r}")
+
+
+def score_airline(t):
+    """From tuple (<airline|flight code>, % late, average delay) calculates a score
+    "% late" * 1000 + "average delay" to sort the airlines
+    """
+    return t[1] * 1000 + t[2]
+
+
+def list_ratings(airlines_dic, start: str = None, end: str = None):
+    """List the ratings of the airlines and flights (not sorted)
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        start, end(str): only records between these dates, e.g. "2015-08-20" (optional)
+            Airlines and flights without records between these dates are not listed
+
+    Returns:
+        rating_airlines(list): list of (<airline>, <% late>, <average delay>)
+        rating_flights(list): list of (<flight code>, <% late>, <average delay>)
     """
-    # end::header[]
     rating_airlines = list()
     rating_flights = list()
+    window = (start, end) if start is not None or end is not None else ()
 
     # Generate the lists
     for name, airline in airlines_dic.items():
         # Airline
-        rating_airline = airline.get_rating_airline()
+        rating_airline = airline.get_rating_airline(*window)
+        if rating_airline[0] is None:
+            continue  # No record in the date range
         # TODO: add code of Airline in the ranking
         # name_code = f"{name} [{airline.code}]"
         # rating_airlines.append((name_code, *rating_airline))
@@ -130,19 +1142,63 @@ def list_sorted_ratings(airlines_dic):
         rating_airlines.append((name, *rating_airline))
         # Flights
         for flight in airline.flights.keys():
-            rating_flight = airline.get_rating_flight(flight)
+            rating_flight = airline.get_rating_flight(flight, *window)
+            if rating_flight[0] is None:
+                continue
             # TODO: add destination of flight in the ranking
             # code_dest = f"{flight} ({airline.destination[flight]})"
             # rating_flights.append((code_dest, *rating_flight))
             rating_flights.append((flight, *rating_flight))
 
-    # Sort the lists based on the probability to be late
-    def score_airline(t):
-        """From tuple (% late, average delay) calculates a score
-        "% late" * 1000 + "average delay" to sort the airlines
-        """
-        return t[1] * 1000 + t[2]
+    return rating_airlines, rating_flights
+
+
+def get_window(airlines_dic, nb_days: int, end: str = None):
+    """Get the date range of the last <nb_days> days of the records
 
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        nb_days(int): number of days of the range
+        end(str): last date of the range (default: last date of the records)
+
+    Returns:
+        (start, end) dates in ISO format, (None, None) if there is no record
+    """
+    if end is None:
+        last_dates = [airline.buckets.get_date_range()[1] for airline in airlines_dic.values()]
+        end = max(filter(None, last_dates), default=None)
+        if end is None:
+            return None, None
+    start = datetime.date.fromisoformat(end) - datetime.timedelta(days=nb_days - 1)
+    return start.isoformat(), end
+
+
+# tag::header[]
+
+
+def list_sorted_ratings(airlines_dic, start: str = None, end: str = None, policy=None):
+    """Sort the airlines and flights based on the probability to be late
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        start, end(str): only records between these dates (optional, see list_ratings)
+        policy: scoring policy instead of "score_airline" (optional, see ranking.py)
+
+    Returns:
+        rating_airlines(list): list of Airlines sorted by late probability (less late first)
+        rating_flights(list): list of flights sorted by late probability (less late first)
+
+    NOTE: Each element of the returned lists contains the following tuple:
+        (<airline|flight code>, <% late>, <average delay>)
+    """
+    # end::header[]
+    if policy is not None:
+        import ranking
+
+        return ranking.sort_ratings(airlines_dic, policy, start, end)
+    rating_airlines, rating_flights = list_ratings(airlines_dic, start, end)
+
+    # Sort the lists based on the probability to be late (see "score_airline")
     rating_airlines = sorted(rating_airlines, key=score_airline)
     rating_flights = sorted(rating_flights, key=score_airline)
 
@@ -175,21 +1231,195 @@ def get_first_last_elem(sorted_list, nb_elem: int):
         return first_elements, last_elements
 
 
+def select_first_last(ratings, nb_elem: int):
+    """Select the first/last <nb_elem> ratings without sorting all the list
+    Same result as get_first_last_elem on the list sorted with "score_airline"
+
+    Args:
+        ratings(list): list of tuples (<airline|flight code>, <% late>, <average delay>)
+        nb_elem(int): number of first/last elements
+
+    Return:
+        first(list): nb_elem ratings with the lowest score (lowest first)
+        last(list): nb_elem ratings with the highest score (highest first)
+    """
+    if nb_elem < 1:
+        return [], []
+    import heapq
+
+    # heapq keeps a heap of <nb_elem> elements: O(len(ratings) * log(nb_elem))
+    # NOTE: like "sorted", nsmallest keeps the order of the list for equal scores
+    first_elements = heapq.nsmallest(nb_elem, ratings, key=score_airline)
+
+    # Last elements of the sorted list are reversed, so for equal scores,
+    # the last element of "ratings" comes first: we use the position as second key
+    def score_position(position_rating):
+        position, rating = position_rating
+        return score_airline(rating), position
+
+    last_elements = heapq.nlargest(nb_elem, enumerate(ratings), key=score_position)
+    return first_elements, [rating for _, rating in last_elements]
+
+
+def list_first_last_ratings(
+    airlines_dic, nb_elem: int, start: str = None, end: str = None, policy=None
+):
+    """Select the best/worse <nb_elem> airlines and flights based on the probability
+    to be late (same result as list_sorted_ratings + get_first_last_elem, but faster)
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        nb_elem(int): number of best/worse elements
+        start, end(str): only records between these dates (optional, see list_ratings)
+        policy: scoring policy instead of "score_airline" (optional, see ranking.py)
+
+    Returns:
+        (best_airlines, worse_airlines), (best_flights, worse_flights)
+    """
+    if policy is not None:
+        import ranking
+
+        sorted_ratings = ranking.sort_ratings(airlines_dic, policy, start, end)
+        return tuple(get_first_last_elem(ratings, nb_elem) for ratings in sorted_ratings)
+    rating_airlines, rating_flights = list_ratings(airlines_dic, start, end)
+    return (
+        select_first_last(rating_airlines, nb_elem),
+        select_first_last(rating_flights, nb_elem),
+    )
+
+
+def load_report_template(file_path: str):
+    """Get the compiled template of the report (see report_template.load_template)
+    If the template cannot be read, the report will show the error
+    """
+    import report_template
+
+    try:
+        return report_template.load_template(file_path)
+    except Exception as e:
+        msg = f"Error while reading template {file_path!r} ({e})"
+        print(msg)
+        return report_template.ReportTemplate(f"<html><body>{msg}</body></html>")
+
+
+def get_ranking_percentiles(airlines_dic, rankings, start: str = None, end: str = None):
+    """Get the percentiles of the delays of the airlines and flights of rankings
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        rankings(list): lists of tuples (<airline|flight code>, <% late>, <average delay>)
+        start, end(str): only records between these dates (optional, see list_ratings)
+
+    Returns:
+        dictionary: airline name or flight code => (p50, p90, p99) (see airlines.PERCENTILES)
+    """
+    names = {rating[0] for ranking in rankings for rating in ranking}
+    percentiles = dict()
+    for name, airline in airlines_dic.items():
+        if name in names:
+            percentiles[name] = airline.get_percentiles_airline(start, end)
+        for flight in names.intersection(airline.flight_records):
+            percentiles[flight] = airline.get_percentiles_flight(flight, start, end)
+    return percentiles
+
+
+def prepare_report(
+    best_airlines,
+    worse_airlines,
+    best_flights,
+    worse_flights,
+    percentiles=None,
+    airports: str = "Shanghai airports",
+):
+    """Get the values of the fields of the report template
+
+    Args:
+        best_airlines, worse_airlines, best_flights, worse_flights(list): rankings,
+            list of tuples (<airline|flight code>, <% late>, <average delay>)
+        percentiles(dict): percentiles of the delays shown after each rating
+            (optional, see get_ranking_percentiles)
+        airports(str): airports of the records (e.g. names of the shards)
+
+    Returns:
+        dictionary: field of template => value (string or generator of strings)
+    """
+    # tag::report_content[]
+    # Prepare the report
+    from report_template import join_items
+
+    report = dict()
+    # time
+    report["date"] = str(datetime.date.today())
+    report["time"] = str(datetime.datetime.now().time())[:8]
+    # rankings
+    def store_ranking(key, ranking):
+        str_info = "<b>{0}</b> ({1}%, avg={2} min)"
+        # NOTE: items are generated while writing the report (no big string)
+        items = (str_info.format(*t) for t in ranking)
+        if percentiles:
+            items = (
+                item + format_percentiles(percentiles.get(t[0]))
+                for item, t in zip(items, ranking)
+            )
+        report[key] = join_items("</li>\n<li>", items)
+
+    store_ranking("best_airlines", best_airlines)
+    store_ranking("worse_airlines", worse_airlines)
+    store_ranking("best_flights", best_flights)
+    store_ranking("worse_flights", worse_flights)
+    # end::report_content[]
+    report["airports"] = airports
+    return report
+
+
+def format_percentiles(percentiles) -> str:
+    """Format percentiles of delays for the report (e.g. " p50/p90/p99=5/42/95 min")"""
+    if percentiles is None:
+        return ""
+    names = "/".join(f"p{percent}" for percent in airlines.PERCENTILES)
+    return f" {names}={'/'.join(map(str, percentiles))} min"
+
+
+def check_date(text: str) -> str:
+    """Check a date given in the command line (e.g. "2015-08-20") and return it"""
+    import argparse
+
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {text!r} (expected YYYY-MM-DD)")
+
+
 # tag::header[]
 
 
 ##=== MAIN PROGRAM ===##
 # tag::main_function[]
-if __name__ == "__main__":
+def main(argv=None, profiler=None):
+    """Generate the report with the command-line arguments
+
+    Args:
+        argv(list): arguments (e.g. ["list_records.txt", "-n", "5"]), default: sys.argv
+        profiler(profiling.Profiler): object measuring the stages of the run
+            (e.g. with hooks called after each stage), created if not given
+    """
+    import argparse
 
     # tag::argparse[]
     # Main Program
     description = """processRecords.py - Generating a report of airines and flights based on their delay"""
     # end::header[]
+    import compressed_log, profiling, ranking
 
     # Parsing options and arguments
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("input_path")
+    parser.add_argument(
+        "input_paths",
+        nargs="+",
+        metavar="input_path",
+        help="File of records, or several files or glob patterns (e.g. 'logs/*.txt'): "
+        "the records of each airport are ranked in their own report",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -204,58 +1434,254 @@ if __name__ == "__main__":
         type=int,
         help="Number of best/worse airlines and flights",
     )
-    cmd = parser.parse_args()
+    parser.add_argument(
+        "--all",
+        dest="full_ranking",
+        action="store_true",
+        help="Rank all the airlines and flights (instead of -n best/worse)",
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=check_date,
+        help="Rank only the records from this date (e.g. 2015-08-20)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=check_date,
+        help="Rank only the records until this date (included)",
+    )
+    parser.add_argument(
+        "--window",
+        dest="nb_days",
+        type=int,
+        help="Rank only the records of the last NB_DAYS days (until --to or the last date)",
+    )
+    parser.add_argument(
+        "--filter-dates",
+        action="store_true",
+        help="Skip the records out of --from/--to while reading the input files "
+        "(flights with the same score may be listed in another order)",
+    )
+    parser.add_argument(
+        "--airline",
+        dest="airlines",
+        action="append",
+        default=[],
+        help="Read only the records of this airline (option can be repeated)",
+    )
+    parser.add_argument(
+        "--code-prefix",
+        dest="code_prefixes",
+        action="append",
+        default=[],
+        help="Read only the records of the flights with codes starting with this prefix "
+        "(e.g. 'MU', option can be repeated)",
+    )
+    parser.add_argument(
+        "--destination",
+        dest="destinations",
+        action="append",
+        default=[],
+        help="Read only the records of this destination (option can be repeated)",
+    )
+    parser.add_argument(
+        "--score",
+        default="late",
+        choices=sorted(ranking.SCORING_POLICIES),
+        help="Score ranking the airlines and flights: '%% late' then average delay, "
+        "average delay or a percentile of the delays",
+    )
+    parser.add_argument(
+        "--min-records",
+        type=int,
+        default=0,
+        help="Rank only the airlines and flights with at least this number of records",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="nb_workers",
+        default=1,
+        type=int,
+        help="Number of processes reading the input file",
+    )
+    parser.add_argument(
+        "--parser",
+        default="columns",
+        choices=sorted(RECORD_PARSERS),
+        help="How to read the input file: 'split' lines, scan a memory-mapped file "
+        "or read blocks of lines as 'columns' (columnar logs are detected and "
+        "memory-mapped with 'mmap', see columnar_log.py)",
+    )
+    parser.add_argument(
+        "--shard-pattern",
+        help="Regular expression giving the airport in the names of the input files "
+        "(e.g. '^[A-Z]{3}' for PVG_T1.txt), default: name of file without extensions",
+    )
+    parser.add_argument(
+        "--quarantine",
+        dest="quarantine_path",
+        help="Check the format of each line of the input files: invalid lines are "
+        "written in this file with their line numbers (instead of being printed, "
+        "added at the end of the file with --incremental)",
+    )
+    parser.add_argument(
+        "--decompress-thread",
+        dest="threaded",
+        action="store_true",
+        help="Decompress a compressed input file (gzip, bz2, xz, zstd) in another thread",
+    )
+    reuse_group = parser.add_mutually_exclusive_group()
+    reuse_group.add_argument(
+        "--cache",
+        dest="cache_path",
+        help="Binary file to save the airlines (reused while the input file is unchanged)",
+    )
+    reuse_group.add_argument(
+        "--incremental",
+        dest="checkpoint_path",
+        help="Binary file to save the airlines and position in input file "
+        "(next runs read only the lines appended to the input file)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        help="Write the measures of each stage in JSON (in this file, or stdout if no file)",
+    )
+    cmd = parser.parse_args(argv)
+    if cmd.nb_days is not None and cmd.start is not None:
+        parser.error("argument --window: not allowed with argument --from")
+    try:
+        input_paths = expand_input_paths(cmd.input_paths)
+    except IOError as e:
+        parser.error(str(e))
+    if len(input_paths) > 1 and (cmd.cache_path or cmd.checkpoint_path):
+        parser.error("arguments --cache/--incremental: not allowed with several input files")
+    if cmd.checkpoint_path and compressed_log.get_compression(input_paths[0]):
+        parser.error("argument --incremental: not allowed with a compressed input file")
+    filter_names = (cmd.airlines, cmd.code_prefixes, cmd.destinations)
+    if (any(filter_names) or cmd.filter_dates) and (cmd.cache_path or cmd.checkpoint_path):
+        parser.error(
+            "arguments --airline/--code-prefix/--destination/--filter-dates: "
+            "not allowed with --cache/--incremental"
+        )
+    if cmd.filter_dates and cmd.nb_days is not None:
+        parser.error("argument --filter-dates: not allowed with argument --window")
     # end::argparse[]
     # =DEBUG=#
     # cmd = parser.parse_args(["list_records.txt"])
 
+    if profiler is None:
+        profiler = profiling.Profiler()
+    profiler.add_stage("import", IMPORT_TIME, budget_s=IMPORT_TIME_BUDGET)
+    if IMPORT_TIME > IMPORT_TIME_BUDGET:
+        profiler.count("import_budget_exceeded")
+
+    # Only the records to rank are read: the other lines are skipped by the reader
+    record_filter = None
+    filter_dates = (cmd.start, cmd.end) if cmd.filter_dates else ()
+    if any(filter_names) or any(filter_dates):
+        from record_filter import RecordFilter
+
+        record_filter = RecordFilter(*filter_names, *filter_dates)
+
     # Getting list of sorted elements
-    records = read_flight_records(cmd.input_path)
-    airlines_dic = get_ratings_airlines(records)
-    rating_airlines, rating_flights = list_sorted_ratings(airlines_dic)
+    # Strict validation of the lines, rejected lines written in a quarantine file
+    quarantine = None
+    if cmd.quarantine_path:
+        from validation import Quarantine
+
+        # NOTE: an incremental update adds the invalid lines of the new records
+        quarantine = Quarantine(cmd.quarantine_path, append=bool(cmd.checkpoint_path))
+
+    with profiler.stage("read_ratings_airlines") as measure, quarantine or nullcontext():
+        shards = dict()  # Airlines of each airport, if there are several input files
+        if len(input_paths) == 1:
+            airlines_dic = read_ratings_airlines(
+                input_paths[0],
+                cmd.nb_workers,
+                cmd.parser,
+                cmd.cache_path,
+                cmd.checkpoint_path,
+                profiler.counters,
+                cmd.threaded,
+                record_filter,
+                quarantine,
+            )
+        else:
+            shards = read_ratings_shards(
+                input_paths,
+                cmd.nb_workers,
+                cmd.parser,
+                cmd.shard_pattern,
+                profiler.counters,
+                cmd.threaded,
+                record_filter,
+                quarantine,
+            )
+            # Rankings of all the airports: Airlines rolled up from the airports
+            airlines_dic = rollup_shards(shards)
+        measure["records"] = profiler.counters["records"]
+    if quarantine is not None:
+        print(f"{quarantine.nb_lines} invalid lines written in {cmd.quarantine_path!r}")
+
+    # Date range of the records to rank (the ratings are combined from counters per date)
+    if cmd.nb_days is not None:
+        cmd.start, cmd.end = get_window(airlines_dic, cmd.nb_days, cmd.end)
 
     # Generate list of  best and worse <nb_ranking> airlines/flights
-    best_airlines, worse_airlines = get_first_last_elem(rating_airlines, cmd.nb_ranking)
-    best_flights, worse_flights = get_first_last_elem(rating_flights, cmd.nb_ranking)
+    # NOTE: same as "list_sorted_ratings" + "get_first_last_elem" without a full sort
+    if cmd.full_ranking:
+        nb_flights = sum(len(airline.flight_records) for airline in airlines_dic.values())
+        cmd.nb_ranking = max(len(airlines_dic), nb_flights)
+    # Default score: "score_airline" (the ranking does not need a full sort)
+    policy = None
+    if cmd.score != "late" or cmd.min_records > 1:
+        policy = ranking.min_records(cmd.min_records, ranking.SCORING_POLICIES[cmd.score])
+    with profiler.stage("list_first_last_ratings"):
+        airlines_first_last, flights_first_last = list_first_last_ratings(
+            airlines_dic, cmd.nb_ranking, cmd.start, cmd.end, policy
+        )
+    best_airlines, worse_airlines = airlines_first_last
+    best_flights, worse_flights = flights_first_last
 
     # Retrieve template of report
-    try:
-        with open("report_Template.html") as f:
-            template = f.read()
-            # Replace single curly brackets by double ones in <STYLE> block
-            for block in re.findall(r"<style>.*?</style>", template, re.I | re.S):
-                updated_block = re.sub(r"([{}])\1*", r"\1" * 2, block)
-                template = template.replace(block, updated_block)
-    except Exception as e:
-        msg = f"Error while reading template 'report_Template.html' ({e})"
-        print(msg)
-        template = f"<html><body>{msg}</body></html>"
+    # NOTE: the template is compiled once (curly brackets in <STYLE> block are kept)
+    with profiler.stage("template"):
+        template = load_report_template("report_Template.html")
 
-    # tag::report_content[]
-    # Prepare the report
-    report = dict()
-    # time
-    report["date"] = str(datetime.date.today())
-    report["time"] = str(datetime.datetime.now().time())[:8]
-    # rankings
-    def store_ranking(key, ranking):
-        str_info = "<b>{0}</b> ({1}%, avg={2} min)"
-        report[key] = "</li>\n<li>".join([str_info.format(*t) for t in ranking])
+    with profiler.stage("format_report"):
+        rankings = [best_airlines, worse_airlines, best_flights, worse_flights]
+        percentiles = get_ranking_percentiles(airlines_dic, rankings, cmd.start, cmd.end)
+        if shards:
+            report = prepare_report(*rankings, percentiles, ", ".join(shards))
+        else:
+            report = prepare_report(*rankings, percentiles)
 
-    store_ranking("best_airlines", best_airlines)
-    store_ranking("worse_airlines", worse_airlines)
-    store_ranking("best_flights", best_flights)
-    store_ranking("worse_flights", worse_flights)
+    # Generate the report, written part by part in the file
+    with profiler.stage("write_report"):
+        write_report(template, report, cmd.report_path)
+
+    # Rankings of each airport, in reports next to the report of all the airports
+    with profiler.stage("shard_reports"):
+        for name, shard_dic in shards.items():
+            rankings = list_first_last_ratings(
+                shard_dic, cmd.nb_ranking, cmd.start, cmd.end, policy
+            )
+            rankings = [*rankings[0], *rankings[1]]
+            percentiles = get_ranking_percentiles(shard_dic, rankings, cmd.start, cmd.end)
+            report = prepare_report(*rankings, percentiles, name)
+            write_report(template, report, get_shard_report_path(cmd.report_path, name))
+
+    if cmd.profile == "-":
+        print(profiler.to_json())
+    elif cmd.profile:
+        with open(cmd.profile, "w") as f:
+            f.write(profiler.to_json())
 
-    # Generate the report
-    report_content = template.format(**report)
-    # end::report_content[]
-    try:
-        with open(cmd.report_path, "w") as f:
-            f.write(report_content)
-    except Exception as e:
-        print(f"Error while trying to write in '{cmd.report_path}' ({e})")
-    else:
-        print(f"Successfully wrote report {cmd.report_path!r}")
 
 # end::main_function[]
+if __name__ == "__main__":
+    main()
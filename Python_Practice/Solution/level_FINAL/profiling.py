@@ -0,0 +1,100 @@
+#!python
+
+"""Measure the stages of a run: wall time, CPU time, records per second and peak memory
+
+Example:
+    profiler = Profiler(hooks=[print])  # "print" is called with each measure
+    with profiler.stage("read") as measure:
+        records = read_flight_records("list_records.txt")
+        measure["records"] = len(records)
+    profiler.count("malformed_lines", 2)
+    print(profiler.to_json())
+"""
+
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: peak RSS is not measured
+    resource = None
+
+
+def get_max_rss():
+    """Get the peak resident memory of the process in kB (None if unknown)"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+class Profiler:
+    """Measures of the stages of a run, with counters (e.g. number of malformed lines)
+
+    Hooks are functions called with the measure (dict) of each stage once it is done.
+    """
+
+    def __init__(self, hooks=None):
+        self.stages = list()
+        self.counters = Counter()
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, callback):
+        """Add a function called with the measure (dict) of each stage"""
+        self.hooks.append(callback)
+
+    @contextmanager
+    def stage(self, name: str):
+        """\
+        Measure a stage (to use with "with")
+
+        The measure (dict) is given to the block, which can set the number of
+        records processed in key "records" to get the number of records/second.
+
+        Args:
+            name: name of the stage
+        """
+        measure = {"stage": name}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield measure
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            measure["wall_s"] = round(wall, 6)
+            measure["cpu_s"] = round(cpu, 6)
+            if measure.get("records") is not None:
+                measure["records_per_s"] = round(measure["records"] / wall) if wall else None
+            measure["max_rss_kb"] = get_max_rss()
+            self.stages.append(measure)
+            for hook in self.hooks:
+                hook(measure)
+
+    def add_stage(self, name: str, wall_s: float, **values):
+        """\
+        Add the measure of a stage measured without "stage" (e.g. time of imports)
+
+        Args:
+            name: name of the stage
+            wall_s: wall time of the stage (seconds)
+            values: other values of the measure (e.g. records=1000)
+        """
+        measure = {"stage": name, "wall_s": round(wall_s, 6), **values}
+        self.stages.append(measure)
+        for hook in self.hooks:
+            hook(measure)
+
+    def count(self, name: str, value: int = 1):
+        """Increment a counter (e.g. "malformed_lines")"""
+        self.counters[name] += value
+
+    def to_dict(self):
+        """All the measures and counters"""
+        return {"stages": self.stages, "counters": dict(self.counters)}
+
+    def to_json(self):
+        """All the measures and counters in JSON"""
+        import json  # Only imported when needed (see processRecords.IMPORT_TIME)
+
+        return json.dumps(self.to_dict(), indent=2)
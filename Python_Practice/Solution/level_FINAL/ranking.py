@@ -0,0 +1,285 @@
+#!python
+
+"""Rankings of airlines and flights with a configurable scoring policy
+
+A scoring policy is a function giving the score of an airline or a flight from the
+counters of its records (see Aggregate): the lower the score, the better the rank.
+A policy returns None for an airline or a flight which shall not be ranked (e.g.
+not enough records, see min_records).
+
+Example:
+    policy = min_records(100, percentile_score(90))
+    rating_airlines, rating_flights = sort_ratings(airlines_dic, policy)
+
+RankingIndex keeps the sorted rankings of Airlines while records are added: only
+the airlines and flights with new records are scored again, and changing the
+policy sorts the counters already known (the records are not read again).
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice, takewhile
+
+import airlines
+
+
+class Aggregate:
+    """Counters of the records of an airline or a flight, given to the scoring policies"""
+
+    __slots__ = ("nb_records", "nb_late", "total_delay", "source", "window")
+
+    def __init__(self, nb_records, nb_late, total_delay, source, window=()):
+        """\
+        Args:
+            nb_records, nb_late, total_delay: counters of the records
+            source: Airline or FlightRecords of the records (for the histogram)
+            window: (start, end) dates of the records counted (empty: all the records)
+        """
+        self.nb_records = nb_records
+        self.nb_late = nb_late
+        self.total_delay = total_delay
+        self.source = source
+        self.window = window
+
+    @property
+    def rating(self):
+        """('% late', 'average delay') of the records (see airlines.get_rating)"""
+        return airlines.get_rating(self.nb_records, self.nb_late, self.total_delay)
+
+    @property
+    def histogram(self):
+        """Histogram of the delays (see airlines.DelayHistogram)"""
+        # NOTE: an Airline merges its histograms per date, a flight counts its records
+        if not self.window:
+            return self.source.histogram
+        return self.source.get_histogram(*self.window)
+
+
+# == Scoring policies ==
+def score_late_average(aggregate: Aggregate):
+    """Score "% late" * 1000 + "average delay" (same as processRecords.score_airline)"""
+    late_percent, average_delay = aggregate.rating
+    return late_percent * 1000 + average_delay
+
+
+def weighted_score(late_weight: float = 1000, delay_weight: float = 1):
+    """\
+    Policy scoring the weighted sum of "% late" and "average delay"
+
+    Args:
+        late_weight, delay_weight: weights of "% late" and "average delay"
+            (the default weights give the same score as score_late_average)
+    """
+
+    def score(aggregate: Aggregate):
+        late_percent, average_delay = aggregate.rating
+        return late_percent * late_weight + average_delay * delay_weight
+
+    return score
+
+
+def percentile_score(percent: int = 90):
+    """\
+    Policy scoring a percentile of the delays (e.g. 90: 90% of the records have
+    a lower delay), then the average delay for equal percentiles
+
+    Args:
+        percent: percentile of the delays (between 1 and 100)
+    """
+
+    def score(aggregate: Aggregate):
+        (percentile,) = aggregate.histogram.get_percentiles((percent,))
+        return percentile, aggregate.rating[1]
+
+    return score
+
+
+def min_records(nb_records: int, policy=score_late_average):
+    """\
+    Policy ranking only the airlines and flights with at least <nb_records> records
+
+    Args:
+        nb_records: minimum number of records
+        policy: scoring policy of the airlines and flights with enough records
+    """
+
+    def score(aggregate: Aggregate):
+        if aggregate.nb_records < nb_records:
+            return None
+        return policy(aggregate)
+
+    return score
+
+
+# Policies selected by name (e.g. in the command line)
+SCORING_POLICIES = {
+    "late": score_late_average,
+    "average": weighted_score(late_weight=0),
+    "p50": percentile_score(50),
+    "p90": percentile_score(90),
+    "p99": percentile_score(99),
+}
+
+
+# == Rankings ==
+def iter_aggregates(airlines_dic, start: str = None, end: str = None):
+    """\
+    Counters of the airlines and flights, in the order of processRecords.list_ratings
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        start, end(str): only records between these dates (optional)
+            Airlines and flights without records between these dates are skipped
+
+    Yields:
+        ("airlines", <airline name>, Aggregate) or ("flights", <flight code>, Aggregate)
+    """
+    window = (start, end) if start is not None or end is not None else ()
+    for name, airline in airlines_dic.items():
+        if window:
+            counters = airline.buckets.get_counters(start, end)
+        else:
+            counters = (airline.nb_records, airline.nb_late, airline.total_delay)
+        if not counters[0]:
+            continue
+        yield "airlines", name, Aggregate(*counters, airline, window)
+        for code, records in airline.flight_records.items():
+            if window:
+                counters = records.buckets.get_counters(start, end)
+            else:
+                counters = (len(records), records.nb_late, records.total_delay)
+            if counters[0]:
+                yield "flights", code, Aggregate(*counters, records, window)
+
+
+def sort_ratings(airlines_dic, policy=score_late_average, start: str = None, end: str = None):
+    """\
+    Sort the airlines and flights with a scoring policy (lowest score first)
+
+    Args:
+        airlines_dic(dict): Dictionary with Airline objects
+        policy: scoring policy (see score_late_average)
+        start, end(str): only records between these dates (optional)
+
+    Returns:
+        rating_airlines, rating_flights: same as processRecords.list_sorted_ratings
+    """
+    scored = {"airlines": list(), "flights": list()}
+    for kind, name, aggregate in iter_aggregates(airlines_dic, start, end):
+        score = policy(aggregate)
+        if score is not None:
+            scored[kind].append((score, len(scored[kind]), (name, *aggregate.rating)))
+    # NOTE: the position is the second key, so equal scores keep the order of the list
+    return tuple([rating for *_, rating in sorted(scored[kind])] for kind in scored)
+
+
+class RankingIndex:
+    """\
+    Sorted rankings of airlines and flights, updated when records are added
+
+    The counters of each airline and flight are kept with its score: "update" scores
+    again only the airlines and flights with new records (see
+    Airline.changed_flights) and moves them in the sorted lists (bisect), so the
+    Airlines are sorted again entirely only when many of them changed.
+    """
+
+    def __init__(self, airlines_dic, policy=score_late_average):
+        """\
+        Args:
+            airlines_dic(dict): Dictionary with Airline objects (records can be added
+                later, airlines shall not be removed)
+            policy: scoring policy (see score_late_average)
+        """
+        self.airlines_dic = airlines_dic
+        self.policy = policy
+        # ("airlines", name) or ("flights", name, code)
+        #   => (<score>, <position>, <rating>, Aggregate)
+        self.entries = dict()
+        # Entries (without Aggregate) sorted by score, then by position
+        self.sorted = {"airlines": list(), "flights": list()}
+        # Airline, number of records and number of flights of each airline when last
+        # updated: name => (Airline, nb_records, nb_flights)
+        self._airlines = dict()
+
+    def update(self):
+        """\
+        Score the airlines and flights with records added since last update
+
+        Returns:
+            number of airlines and flights scored
+        """
+        changes = list()  # (key, position, Aggregate) of the entries to replace
+        for airline_position, (name, airline) in enumerate(self.airlines_dic.items()):
+            known = self._airlines.get(name)
+            if known is None or known[0] is not airline:
+                known = (airline, 0, 0)  # New airline: all its flights are scored
+            _, nb_records, nb_flights = known
+            if nb_records == airline.nb_records:
+                continue  # No new record
+            self._airlines[name] = (airline, airline.nb_records, len(airline.flight_records))
+            counters = (airline.nb_records, airline.nb_late, airline.total_delay)
+            changes.append((("airlines", name), airline_position, Aggregate(*counters, airline)))
+
+            # Flights changed since last update, the last changes first (see
+            # Airline.changed_flights): the other flights are not read
+            changed = airline.changed_flights
+            codes = takewhile(lambda code: changed[code] > nb_records, reversed(changed))
+            # Positions of the new flights (at the end of the flights of the airline)
+            new_flights = islice(airline.flight_records, nb_flights, None)
+            positions = {code: index for index, code in enumerate(new_flights, nb_flights)}
+            for code in codes:
+                records = airline.flight_records[code]
+                key = ("flights", name, code)
+                flight_position = positions.get(code)
+                if flight_position is None:
+                    flight_position = self.entries[key][1][1]
+                counters = (len(records), records.nb_late, records.total_delay)
+                position = (airline_position, flight_position)
+                changes.append((key, position, Aggregate(*counters, records)))
+        self._set(changes)
+        return len(changes)
+
+    def _set(self, changes: list):
+        """Replace the entries of airlines and flights, moved to their sorted positions"""
+        nb_changes = Counter(key[0] for key, *_ in changes)
+        # NOTE: many changes (e.g. first update) are sorted at once, instead of moving
+        # each entry in the sorted list (bisect)
+        sort_kinds = {kind for kind, nb in nb_changes.items() if nb * 16 > len(self.sorted[kind])}
+        for key, position, aggregate in changes:
+            ranking = self.sorted[key[0]]
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and key[0] not in sort_kinds:
+                del ranking[bisect_left(ranking, entry[:2])]
+            score = self.policy(aggregate)
+            rating = (key[-1], *aggregate.rating)
+            self.entries[key] = (score, position, rating, aggregate)
+            if score is not None and key[0] not in sort_kinds:
+                insort(ranking, (score, position, rating))
+        for kind in sort_kinds:
+            self._sort(kind)
+
+    def _sort(self, kind: str):
+        """Sort again all the entries of airlines or flights ("airlines" or "flights")"""
+        self.sorted[kind] = sorted(
+            (score, position, rating)
+            for key, (score, position, rating, _) in self.entries.items()
+            if key[0] == kind and score is not None
+        )
+
+    def set_policy(self, policy):
+        """Sort again with another scoring policy (from the counters already known)"""
+        self.policy = policy
+        for key, (_, position, rating, aggregate) in self.entries.items():
+            self.entries[key] = (policy(aggregate), position, rating, aggregate)
+        for kind in self.sorted:
+            self._sort(kind)
+
+    def get_sorted_ratings(self):
+        """\
+        Ratings of the airlines and flights, sorted (after an update)
+
+        Returns:
+            rating_airlines, rating_flights: same as processRecords.list_sorted_ratings
+        """
+        self.update()
+        return tuple([rating for *_, rating in self.sorted[kind]] for kind in self.sorted)
@@ -0,0 +1,130 @@
+#!python
+
+"""Filters of the records, applied by the readers of logs (predicate pushdown)
+
+Only the records of some airlines, flight codes, destinations or dates are read:
+the other lines are rejected before they are split into records, first by searching
+the names in the raw lines (bytes), then by comparing the fields of the lines left.
+No dict record, no string and no delay is created for a rejected line.
+
+Example:
+    record_filter = RecordFilter(airlines=["Air France"], start="2015-08-20")
+    records = processRecords.RecordBatches("list_records.txt", record_filter=record_filter)
+
+The readers of columnar logs compare the indexes of the names and the days instead
+(see columnar_log.ColumnarLog).
+"""
+
+import re
+
+
+class RecordFilter:
+    """\
+    Criteria on the records: a record is read if it matches all the criteria
+    (a criterion with several values matches any of them, no value matches all)
+    """
+
+    def __init__(
+        self,
+        airlines=(),
+        code_prefixes=(),
+        destinations=(),
+        start: str = None,
+        end: str = None,
+    ):
+        """\
+        Args:
+            airlines: names of airlines (e.g. ["China Eastern Airlines"])
+            code_prefixes: beginnings of flight codes (e.g. ["MU", "EK30"])
+            destinations: names of destinations (e.g. ["Paris"])
+            start, end: dates of the first/last records (e.g. "2015-08-20", included)
+        """
+        self.airlines = frozenset(airlines)
+        self.code_prefixes = tuple(code_prefixes)
+        self.destinations = frozenset(destinations)
+        self.start = start
+        self.end = end
+        # Same criteria on the raw fields of the lines (bytes)
+        self._criteria = {
+            str: (self.airlines, self.code_prefixes, self.destinations, start, end),
+            bytes: (
+                frozenset(name.encode() for name in self.airlines),
+                tuple(prefix.encode() for prefix in self.code_prefixes),
+                frozenset(name.encode() for name in self.destinations),
+                start and start.encode(),
+                end and end.encode(),
+            ),
+        }
+        # A line without any value of a criterion cannot match: the lines are searched
+        # for the values (compiled regular expressions, no loop in Python)
+        self._searches = [
+            re.compile(b"|".join(map(re.escape, sorted(values)))).search
+            for values in self._criteria[bytes][:3]
+            if values
+        ]
+
+    def __bool__(self):
+        """False if the filter has no criterion (all the records match)"""
+        return any(criterion for criterion in self._criteria[str])
+
+    def __repr__(self):
+        criteria = zip(
+            ("airlines", "code_prefixes", "destinations", "start", "end"),
+            self._criteria[str],
+        )
+        return f"RecordFilter({', '.join(f'{k}={v!r}' for k, v in criteria if v)})"
+
+    def match_line(self, line: bytes) -> bool:
+        """Quick check of a raw line: False if it cannot match (see match_fields)"""
+        return all(search(line) for search in self._searches)
+
+    def filter_lines(self, lines):
+        """Lines which can match (same as match_line on each line)"""
+        for search in self._searches:
+            lines = list(filter(search, lines))
+        return lines
+
+    def match_fields(self, fields) -> bool:
+        """\
+        Check the fields of a record
+
+        Args:
+            fields: date, time, code, airline, destination, take-off of the record
+                (str or raw bytes, stripped or not)
+        """
+        airlines, code_prefixes, destinations, start, end = self._criteria[type(fields[0])]
+        day, _, code, airline, destination, _ = fields
+        if start or end:
+            day = day.strip()
+            if (start and day < start) or (end and day > end):
+                return False
+        return (
+            (not airlines or airline.strip() in airlines)
+            and (not code_prefixes or code.strip().startswith(code_prefixes))
+            and (not destinations or destination.strip() in destinations)
+        )
+
+    def match(self, record: dict) -> bool:
+        """Check a dict record (see processRecords.iter_flight_records)"""
+        keys = ("date", "time", "code", "airline", "destination", "take-off")
+        return self.match_fields([record[key] for key in keys])
+
+    def get_name_ids(self, kind: str, names):
+        """\
+        Indexes of the names matching a criterion (e.g. in a dictionary of names)
+
+        Args:
+            kind: "airline", "code" or "destination"
+            names: list of names
+
+        Returns:
+            set of indexes, or None if there is no criterion on this kind of name
+        """
+        if kind == "code":
+            if not self.code_prefixes:
+                return None
+            return {i for i, code in enumerate(names) if code.startswith(self.code_prefixes)}
+        selected = {"airline": self.airlines, "destination": self.destinations}[kind]
+        if not selected:
+            return None
+        return {i for i, name in enumerate(names) if name in selected}
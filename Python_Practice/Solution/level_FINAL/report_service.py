@@ -0,0 +1,366 @@
+#!python
+
+"""Report service: keeps the Airlines of a take-off log in memory and serves rankings
+
+The log is followed like "tail -f": lines appended to the file are added to the
+Airlines every <interval> seconds (all the file is read again if it is truncated
+or replaced); the lines are parsed in a thread, so the requests are answered
+meanwhile. Rankings are computed once per update of the Airlines and served
+over HTTP (TCP or Unix socket):
+
+    GET /airlines?n=10          best/worse airlines (JSON)
+    GET /flights?n=10           best/worse flights (JSON)
+    GET /airlines/<name>        rating of an airline (JSON)
+    GET /flights/<code>         rating of a flight (JSON)
+    GET /report?n=10            full HTML report
+    GET /status                 number of records, position in the log (JSON)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import airlines
+import catalog
+import processRecords as rec
+import ranking
+import snapshot
+
+# Maximum number of bytes of the log read at each update (the service stays
+# responsive while reading a long log: next bytes are read at next update)
+MAX_BYTES_PER_UPDATE = 8 << 20
+
+
+def get_percentiles_dict(percentiles):
+    """Percentiles of delays by name (e.g. {"p50": 5, "p90": 42, "p99": 95})"""
+    return {f"p{percent}": value for percent, value in zip(airlines.PERCENTILES, percentiles)}
+
+
+class ReportService:
+    """Airlines of a take-off log kept up to date, with cached rankings"""
+
+    def __init__(
+        self,
+        file_path: str,
+        parser: str = "split",
+        template_path: str = "report_Template.html",
+        nb_ranking: int = 10,
+        policy=ranking.score_late_average,
+    ):
+        self.file_path = file_path
+        self.parser = parser
+        self.template_path = template_path
+        self.nb_ranking = nb_ranking
+        self.airlines_dic = dict()
+        # IDs of the names read by blocks of records, kept from one update to the next
+        self.catalog = catalog.Catalog()
+        # Sorted rankings, updated with the airlines and flights with new records
+        self.ranking = ranking.RankingIndex(self.airlines_dic, policy)
+        self.offset = 0  # position (bytes) of the end of the records read
+        self.file_id = None  # (device, inode) of the log
+        self._head_size, self._head_digest = 0, None  # to detect a rewritten log
+        self.version = 0  # incremented when records are added
+        self._cache = dict()  # key => (version, value)
+
+    # == Reading the log ==
+    def reset(self):
+        """Forget all the records (the log will be read from the beginning)"""
+        self.airlines_dic = dict()
+        self.ranking = ranking.RankingIndex(self.airlines_dic, self.ranking.policy)
+        self.offset = 0
+        self.version += 1
+
+    def update(self) -> int:
+        """\
+        Add the records of the lines appended to the log since last update
+
+        Returns:
+            number of bytes read
+        """
+        return self.add_block(self.read_block())
+
+    async def update_async(self) -> int:
+        """Same as "update", the block of the log is read and parsed in a thread (the
+        requests are answered meanwhile), then added to the Airlines"""
+        loop = asyncio.get_running_loop()
+        return self.add_block(await loop.run_in_executor(None, self.read_block))
+
+    def read_block(self):
+        """\
+        Read the records of the lines appended to the log since last update, into
+        new Airlines (the Airlines of the service are not modified)
+
+        Returns:
+            (<log replaced>, (device, inode), <start>, <end>, <head digest>, <Airlines>),
+            with the position (bytes) of the records read in the log, or None if
+            there is no new complete line
+        """
+        stat = os.stat(self.file_path)
+        file_id = (stat.st_dev, stat.st_ino)
+        start = self.offset
+        replaced = bool(start) and (
+            file_id != self.file_id
+            or stat.st_size < start
+            or self._head_digest != snapshot.get_head_digest(self.file_path, self._head_size)
+        )
+        if replaced:
+            start = 0  # Log rotated, truncated or rewritten
+
+        # Read up to the last complete line (limited to MAX_BYTES_PER_UPDATE)
+        with open(self.file_path, "rb") as f:
+            f.seek(start)
+            block = f.read(MAX_BYTES_PER_UPDATE)
+        end_line = block.rfind(b"\n")
+        if end_line < 0 and len(block) == MAX_BYTES_PER_UPDATE:
+            end = rec.find_end_last_line(self.file_path)  # Very long line
+        else:
+            end = start + end_line + 1
+        if end <= start:
+            return None
+
+        records = rec.get_record_parser(self.file_path, self.parser)(self.file_path, start, end)
+        airlines_dic = rec.get_ratings_airlines(records, dict(), self.catalog)
+        head_digest = snapshot.get_head_digest(self.file_path, min(end, snapshot.HEAD_SIZE))
+        return replaced, file_id, start, end, head_digest, airlines_dic
+
+    def add_block(self, block) -> int:
+        """\
+        Add the Airlines read by "read_block" to the Airlines of the service
+
+        Returns:
+            number of bytes read
+        """
+        if block is None:
+            return 0
+        replaced, self.file_id, start, end, self._head_digest, airlines_dic = block
+        if replaced:
+            self.reset()
+        for name, airline in airlines_dic.items():
+            if name in self.airlines_dic:
+                self.airlines_dic[name].merge(airline)
+            else:
+                self.airlines_dic[name] = airline
+        self.offset = end
+        self._head_size = min(end, snapshot.HEAD_SIZE)
+        self.version += 1
+        return end - start
+
+    async def follow(self, interval: float = 1.0):
+        """Update the Airlines every <interval> seconds (forever)"""
+        while True:
+            try:
+                nb_bytes = await self.update_async()
+            except OSError as e:
+                print(f"Error while reading {self.file_path!r}: {e}")
+                nb_bytes = 0
+            # NOTE: a log not read completely is read again without waiting
+            await asyncio.sleep(0 if nb_bytes >= MAX_BYTES_PER_UPDATE else interval)
+
+    # == Queries (results are cached until next update of the Airlines) ==
+    def _cached(self, key, compute):
+        version, value = self._cache.get(key, (None, None))
+        if version != self.version:
+            value = compute()
+            self._cache[key] = (self.version, value)
+        return value
+
+    def get_sorted_ratings(self):
+        """Ratings of airlines and flights, sorted (see ranking.RankingIndex)"""
+        return self._cached("sorted", self.ranking.get_sorted_ratings)
+
+    def get_flights_index(self):
+        """Dictionary: flight code => Airline"""
+
+        def index():
+            return {
+                code: airline
+                for airline in self.airlines_dic.values()
+                for code in airline.flight_records
+            }
+
+        return self._cached("flights", index)
+
+    def get_ranking(self, kind: str, nb_elem: int):
+        """\
+        Best/worse airlines or flights
+
+        Args:
+            kind: "airlines" or "flights"
+            nb_elem: number of best/worse elements
+        """
+        rating_airlines, rating_flights = self.get_sorted_ratings()
+        ratings = rating_airlines if kind == "airlines" else rating_flights
+        best, worse = rec.get_first_last_elem(ratings, nb_elem)
+        keys = ("name" if kind == "airlines" else "flight", "late_percent", "average_delay")
+        return {
+            "best": [dict(zip(keys, t)) for t in best],
+            "worse": [dict(zip(keys, t)) for t in worse],
+        }
+
+    def get_flight(self, code: str):
+        """Rating of a flight (None if unknown)"""
+        airline = self.get_flights_index().get(code)
+        if airline is None:
+            return None
+        late_percent, average_delay = airline.get_rating_flight(code)
+        return {
+            "flight": code,
+            "airline": airline.name,
+            "destination": airline.destination[code],
+            "records": len(airline.flight_records[code]),
+            "late_percent": late_percent,
+            "average_delay": average_delay,
+            **get_percentiles_dict(airline.get_percentiles_flight(code)),
+        }
+
+    def get_airline(self, name: str):
+        """Rating of an airline (None if unknown)"""
+        airline = self.airlines_dic.get(name)
+        if airline is None:
+            return None
+        late_percent, average_delay = airline.get_rating_airline()
+        return {
+            "name": name,
+            "code": airline.code,
+            "flights": len(airline.flight_records),
+            "records": airline.nb_records,
+            "late_percent": late_percent,
+            "average_delay": average_delay,
+            **get_percentiles_dict(airline.get_percentiles_airline()),
+        }
+
+    def get_report(self, nb_elem: int) -> str:
+        """HTML report with best/worse <nb_elem> airlines and flights"""
+
+        def render():
+            rating_airlines, rating_flights = self.get_sorted_ratings()
+            rankings = rec.get_first_last_elem(rating_airlines, nb_elem)
+            rankings += rec.get_first_last_elem(rating_flights, nb_elem)
+            percentiles = rec.get_ranking_percentiles(self.airlines_dic, rankings)
+            template = rec.load_report_template(self.template_path)
+            return template.render(rec.prepare_report(*rankings, percentiles))
+
+        return self._cached(("report", nb_elem), render)
+
+    def get_status(self):
+        """Number of airlines and records read, position in the log"""
+        return {
+            "file": self.file_path,
+            "offset": self.offset,
+            "version": self.version,
+            "airlines": len(self.airlines_dic),
+            "records": rec.count_records(self.airlines_dic),
+        }
+
+    # == HTTP ==
+    def handle_request(self, target: str):
+        """\
+        Answer a request
+
+        Args:
+            target: path and query of the request (e.g. "/flights?n=5")
+
+        Returns:
+            (<HTTP status>, <content type>, <content as str>)
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        try:
+            nb_elem = int(query.get("n", [self.nb_ranking])[0])
+        except ValueError:
+            return 400, "text/plain", "Parameter 'n' shall be an integer"
+        parts = [unquote(part) for part in url.path.strip("/").split("/", 1)]
+
+        if parts == ["report"]:
+            return 200, "text/html", self.get_report(nb_elem)
+        if parts == ["status"]:
+            content = self.get_status()
+        elif parts[0] in ("airlines", "flights") and len(parts) == 1:
+            content = self.get_ranking(parts[0], nb_elem)
+        elif parts[0] == "airlines":
+            content = self.get_airline(parts[1])
+        elif parts[0] == "flights":
+            content = self.get_flight(parts[1])
+        else:
+            return 404, "text/plain", f"Unknown path {url.path!r}"
+
+        if content is None:
+            return 404, "text/plain", f"Unknown {parts[0][:-1]} {parts[1]!r}"
+        return 200, "application/json", json.dumps(content)
+
+    async def handle_connection(self, reader, writer):
+        """Read a HTTP request and write the answer"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass  # Headers are not used
+            if len(request_line) < 2 or request_line[0] != "GET":
+                status, content_type, content = 405, "text/plain", "Only GET is supported"
+            else:
+                try:
+                    status, content_type, content = self.handle_request(request_line[1])
+                except Exception as e:
+                    # NOTE: the client gets an answer, the service keeps running
+                    print(f"Error while answering {request_line[1]!r}: {e!r}")
+                    status, content_type, content = 500, "text/plain", "Internal error"
+            body = content.encode()
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, unix_path=None, interval=1.0):
+        """\
+        Follow the log and answer requests (forever)
+
+        Args:
+            host, port: address of the HTTP server (if unix_path is not given)
+            unix_path: Path of Unix socket of the HTTP server
+            interval: time (seconds) between 2 updates of the Airlines
+        """
+        await self.update_async()  # Records available before the first request
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving rankings of {self.file_path!r} on {unix_path or f'{host}:{port}'}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.follow(interval))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input_path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", dest="unix_path", help="Path of Unix socket")
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds between 2 reads of the log"
+    )
+    parser.add_argument("-n", dest="nb_ranking", type=int, default=10)
+    parser.add_argument("--parser", default="columns", choices=sorted(rec.RECORD_PARSERS))
+    parser.add_argument("--template", default="report_Template.html")
+    parser.add_argument("--score", default="late", choices=sorted(ranking.SCORING_POLICIES))
+    cmd = parser.parse_args()
+
+    service = ReportService(
+        cmd.input_path,
+        cmd.parser,
+        cmd.template,
+        cmd.nb_ranking,
+        ranking.SCORING_POLICIES[cmd.score],
+    )
+    try:
+        asyncio.run(service.serve(cmd.host, cmd.port, cmd.unix_path, cmd.interval))
+    except KeyboardInterrupt:
+        pass
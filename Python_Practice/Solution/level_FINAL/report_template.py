@@ -0,0 +1,114 @@
+#!python
+
+"""Templates of reports: "{field}" are replaced by values, except in <style> blocks
+
+A template is compiled once into a list of parts (literal text and fields) and kept
+in cache until the file is modified. Reports are written part by part in a file:
+a field can be given as an iterable of strings (e.g. a generator of ranking items)
+so that long reports are never built as one big string.
+"""
+
+import os
+import re
+from string import Formatter
+
+
+# Conversions of the fields (e.g. "{name!r}"), same as str.format
+CONVERSIONS = (None, "r", "s", "a")
+
+
+class ReportTemplate:
+    """\
+    Template compiled into a list of
+    (<literal text>, <field name>, <format spec>, <conversion>)
+    """
+
+    def __init__(self, text: str):
+        """\
+        Args:
+            text: text of the template
+
+        Raises:
+            ValueError: if a field has an unknown conversion (e.g. "{name!x}")
+        """
+        self.parts = list()
+        # Curly brackets of <style> blocks are not fields (e.g. "th {background:...}")
+        for segment in re.split(r"(<style>.*?</style>)", text, flags=re.I | re.S):
+            if re.match(r"<style>", segment, re.I):
+                self.parts.append((segment, None, "", None))
+                continue
+            for literal, field, format_spec, conversion in Formatter().parse(segment):
+                if conversion not in CONVERSIONS:
+                    raise ValueError(f"Unknown conversion {conversion!r} of field {field!r}")
+                self.parts.append((literal, field, format_spec or "", conversion))
+
+    def fields(self):
+        """Names of the fields of the template"""
+        return [field for _, field, *_ in self.parts if field is not None]
+
+    def iter_render(self, values: dict):
+        """\
+        Generate the report, part by part
+
+        Args:
+            values: value of each field: a string (or any object, converted and
+                formatted like str.format) or an iterable of strings (a field with
+                a conversion converts the iterable, like str.format)
+
+        Yields:
+            strings to write one after the other
+        """
+        formatter = Formatter()
+        for literal, field, format_spec, conversion in self.parts:
+            if literal:
+                yield literal
+            if field is None:
+                continue
+            value = values[field]
+            if conversion is not None:
+                value = formatter.convert_field(value, conversion)
+            if isinstance(value, str) or not hasattr(value, "__iter__"):
+                yield format(value, format_spec)
+            else:
+                yield from value
+
+    def render(self, values: dict) -> str:
+        """Generate the report as a string (see iter_render)"""
+        return "".join(self.iter_render(values))
+
+    def render_to_file(self, f, values: dict):
+        """Write the report in an opened file, part by part (see iter_render)"""
+        f.writelines(self.iter_render(values))
+
+
+# Compiled templates: path => (modification time, ReportTemplate)
+_templates = dict()
+
+
+def load_template(file_path: str) -> ReportTemplate:
+    """\
+    Get the compiled template of a file (compiled again only if the file is modified)
+
+    Args:
+        file_path: Path of template
+    """
+    mtime = os.stat(file_path).st_mtime_ns
+    cached = _templates.get(file_path)
+    if cached is None or cached[0] != mtime:
+        with open(file_path) as f:
+            cached = _templates[file_path] = (mtime, ReportTemplate(f.read()))
+    return cached[1]
+
+
+def join_items(separator: str, items):
+    """\
+    Same as separator.join(items), as a generator (items are not joined in memory)
+
+    Args:
+        separator: string between 2 items
+        items: iterable of strings
+    """
+    for index, item in enumerate(items):
+        if index:
+            yield separator
+        yield item
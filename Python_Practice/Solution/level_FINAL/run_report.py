@@ -0,0 +1,15 @@
+#!python
+
+"""Fast start of processRecords.py, with the same arguments, e.g.:
+
+    python run_report.py list_records.txt -n 5
+
+A script run with "python processRecords.py" is compiled at each run, while a module
+imported by a script is loaded from its compiled file (in __pycache__): for small
+files, compiling processRecords.py takes as much time as reading the records.
+"""
+
+from processRecords import main
+
+if __name__ == "__main__":
+    main()
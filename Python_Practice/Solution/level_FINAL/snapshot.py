@@ -0,0 +1,190 @@
+#!python
+
+"""Save and load the Airlines created from a file of records (binary snapshot)
+
+A cache file contains the dictionary "airlines_dic" returned by get_ratings_airlines
+with the key of the input file (size, modification time and hash of its content):
+it is used only if the input file did not change.
+
+A checkpoint file contains the same dictionary with the position of the end of the
+records read, so that the next run can read only the lines appended to the file.
+"""
+
+import hashlib
+import os
+import pickle
+
+# Version of the content of the snapshots (to change when class Airline changes)
+SNAPSHOT_VERSION = 4
+# Number of bytes at the beginning of a file used to detect that it was replaced
+HEAD_SIZE = 1 << 16
+
+
+def get_file_key(file_path: str, block_size: int = 1 << 20):
+    """\
+    Get the key identifying the content of a file
+
+    Args:
+        file_path: Path of file
+        block_size: size of blocks read to compute the hash
+
+    Returns:
+        (<size>, <modification time in ns>, <hash of content>)
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+def save_snapshot(snapshot_path: str, content: dict):
+    """\
+    Save a snapshot (binary) in a file
+
+    The file is written under a temporary name and then renamed,
+    so an interrupted run never leaves a partial snapshot.
+
+    Args:
+        snapshot_path: Path of snapshot file
+        content: dictionary to save (e.g. with key "airlines")
+    """
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(dict(content, version=SNAPSHOT_VERSION), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path: str):
+    """\
+    Load a snapshot saved with save_snapshot
+
+    Args:
+        snapshot_path: Path of snapshot file
+
+    Returns:
+        dictionary saved, or None if the file does not exist or cannot be used
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            content = pickle.load(f)
+    except Exception:
+        return None  # No snapshot (or a corrupted one): records shall be read again
+    if not isinstance(content, dict) or content.get("version") != SNAPSHOT_VERSION:
+        return None
+    return content
+
+
+def save_cached_ratings(input_path: str, cache_path: str, airlines_dic: dict, file_key=None):
+    """\
+    Save the Airlines created from an input file in a cache file
+
+    Args:
+        input_path: Path of file with the records
+        cache_path: Path of cache file
+        airlines_dic: dictionary returned by get_ratings_airlines for input_path
+        file_key: key of input_path computed before its records were read (see
+            get_file_key): if the file changed while it was read, the cache is
+            not used by the next run (the default key is computed now)
+    """
+    if file_key is None:
+        file_key = get_file_key(input_path)
+    save_snapshot(cache_path, {"key": file_key, "airlines": airlines_dic})
+
+
+def load_cached_ratings(input_path: str, cache_path: str, file_key=None):
+    """\
+    Load the Airlines saved in a cache file if the input file did not change
+
+    Args:
+        input_path: Path of file with the records
+        cache_path: Path of cache file
+        file_key: key of input_path if already computed (see get_file_key)
+
+    Returns:
+        dictionary "airlines_dic", or None if there is no valid cache for input_path
+    """
+    content = load_snapshot(cache_path)
+    if content is None or "airlines" not in content:
+        return None
+
+    # Size and modification time are checked first: the hash is computed only if needed
+    stat = os.stat(input_path)
+    size, mtime, digest = content["key"]
+    if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    if (file_key or get_file_key(input_path)) != (size, mtime, digest):
+        return None
+    return content["airlines"]
+
+
+def get_head_digest(file_path: str, size: int):
+    """\
+    Get the hash of the first <size> bytes of a file
+
+    Args:
+        file_path: Path of file
+        size: number of bytes to read
+    """
+    with open(file_path, "rb") as f:
+        return hashlib.blake2b(f.read(size)).hexdigest()
+
+
+def save_checkpoint(
+    checkpoint_path: str,
+    input_path: str,
+    offset: int,
+    airlines_dic: dict,
+    nb_lines: int = None,
+):
+    """\
+    Save the Airlines created from the beginning of an input file in a checkpoint file
+
+    Args:
+        checkpoint_path: Path of checkpoint file
+        input_path: Path of file with the records
+        offset: position (in bytes) of the end of the records read
+        airlines_dic: dictionary returned by get_ratings_airlines for these records
+        nb_lines: number of lines before the offset (None if they were not counted)
+    """
+    stat = os.stat(input_path)
+    head_size = min(offset, HEAD_SIZE)
+    checkpoint = {
+        "file_id": (stat.st_dev, stat.st_ino),
+        "offset": offset,
+        "nb_lines": nb_lines,
+        "head": (head_size, get_head_digest(input_path, head_size)),
+    }
+    save_snapshot(checkpoint_path, {"checkpoint": checkpoint, "airlines": airlines_dic})
+
+
+def load_checkpoint(checkpoint_path: str, input_path: str):
+    """\
+    Load the Airlines and the position saved in a checkpoint file
+
+    The checkpoint is not used if the input file was truncated
+    or replaced by another file (e.g. rotation of logs).
+
+    Args:
+        checkpoint_path: Path of checkpoint file
+        input_path: Path of file with the records
+
+    Returns:
+        (<offset>, <airlines_dic>, <number of lines before offset or None>) to continue
+        reading the file, or (0, None, 0) to read the file from the beginning
+    """
+    content = load_snapshot(checkpoint_path)
+    if content is None or "checkpoint" not in content:
+        return 0, None, 0
+
+    checkpoint = content["checkpoint"]
+    stat = os.stat(input_path)
+    if checkpoint["file_id"] != (stat.st_dev, stat.st_ino):
+        return 0, None, 0  # Another file (rotated)
+    if stat.st_size < checkpoint["offset"]:
+        return 0, None, 0  # Truncated file
+    head_size, digest = checkpoint["head"]
+    if get_head_digest(input_path, head_size) != digest:
+        return 0, None, 0  # Rewritten file
+    return checkpoint["offset"], content["airlines"], checkpoint.get("nb_lines")
@@ -10,15 +10,48 @@
 # NOTE: if "pytest" is not found, run "python -m pytest ..."
 ##############
 
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+from collections import Counter
+
 import pytest
 from typing import Dict, List, Any
 
-from airlines import Airline, get_delay
+import airlines
+from airlines import Airline, get_delay, get_delays, get_delay_cached, encode_time, decode_time
+from airlines import get_delays_cached
 try:
     from airlines import get_delay_2
 except ImportError:
     get_delay_2 = get_delay
 import processRecords as rec
+import profiling
+import record_filter
+import report_template
+import snapshot
+import validation
+import bench_airlines
+import catalog
+import columnar_log
+import compressed_log
+import generate_records
+import report_service
+import ranking
+
+
+def attributes(airline: Airline) -> Dict[str, Any]:
+    """Public attributes of an airline (records are stored in arrays internally)"""
+    return {
+        "destination": airline.destination,
+        "flights": dict(airline.flights),
+        "code": airline.code,
+        "name": airline.name,
+    }
 
 
 def test_delay():
@@ -33,6 +66,53 @@ def test_delay():
     assert get_delay_2("23:45", "00:45") == 60
     assert get_delay_2("00:45", "23:45") == -60
 
+    # Cached version
+    assert get_delay_cached("12:10", "12:45") == 35
+    assert get_delay_cached("12:10", "11:45") == -25
+    assert get_delay_cached("23:45", "00:45") == 60
+    assert get_delay_cached("00:45", "23:45") == -60
+
+
+def test_delay_cached():
+    """Cached delays are the same as get_delay for all kinds of times"""
+    times = [f"{h}:{m:02d}" for h in range(24) for m in range(0, 60, 7)]
+    times += [f"{h:02d}:{m:02d}" for h in range(10) for m in range(0, 60, 11)]
+    for expected in times[::3]:
+        for takeoff in times:
+            assert get_delay_cached(expected, takeoff) == get_delay_2(expected, takeoff)
+    for expected, takeoff in zip(times, reversed(times)):
+        assert get_delay_cached(expected, takeoff) == get_delay(expected, takeoff)
+    assert get_delay_cached("0:00", "12:00") == get_delay("0:00", "12:00") == 720
+    assert get_delay_cached("12:00", "0:00") == get_delay("12:00", "0:00") == -720
+
+    for invalid in ("24:00", "12:60", "12h10"):
+        with pytest.raises(ValueError):
+            get_delay_cached(invalid, "12:00")
+
+    # Whole columns at once
+    expected = times[::3] * 3
+    takeoff = times[: len(expected)]
+    assert get_delays_cached(expected, takeoff) == list(map(get_delay, expected, takeoff))
+    with pytest.raises(ValueError):
+        get_delays_cached(["12:10"], [])
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_delays(use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(airlines, "np", None)
+
+    expected = ["12:10", "12:10", "23:45", "00:45", "8:20", "0:00", "12:00"]
+    takeoff = ["12:45", "11:45", "00:45", "23:45", "8:25", "12:00", "0:00"]
+    delays = get_delays(expected, takeoff)
+    assert list(delays) == [35, -25, 60, -60, 5, 720, -720]
+    assert list(delays) == [get_delay(e, t) for e, t in zip(expected, takeoff)]
+    assert list(get_delays([], [])) == []
+    with pytest.raises(ValueError):
+        get_delays(["12:10"], [])
+
 
 # Test class "Airline"
 class Test_Airline:
@@ -108,6 +188,23 @@ class Test_Airline:
         }
         assert mu.destination == {"MU511": "Osaka Kansai", "MU721": "Seoul"}
 
+    def test_02_add_info_compact_storage(self):
+        """Records are stored in typed arrays and rebuilt as dict when read"""
+        sq, _ = self.add_info_SQ_MU()
+        records = sq.flight_records["SQ827"]
+        assert len(records) == 2
+        assert list(records.delays) == [63, 30]
+        assert records.dates.typecode == "i"
+        assert records.times.typecode == records.delays.typecode == "h"
+        assert "SQ827" in sq.flights and "MU511" not in sq.flights
+        assert sq.flights["SQ827"][1] == {"date": "2015-08-21", "delay": 30, "time": "08:05"}
+
+    def test_02_encode_time(self):
+        """Times are stored as minutes and rebuilt exactly"""
+        for hhmm in ("0:05", "00:05", "8:25", "08:25", "12:10", "23:59"):
+            assert decode_time(encode_time(hhmm)) == hhmm
+        assert encode_time("12:10") == 730
+
     def test_03_get_rating_flight(self):
         """Get the rating of a given flight"""
         sq, mu = self.add_info_SQ_MU()
@@ -120,6 +217,135 @@ class Test_Airline:
         assert sq.get_rating_airline() == (50, 46)
         assert mu.get_rating_airline() == (50, 32)
 
+    def test_04_running_counters(self):
+        """Ratings follow the records added after a first rating"""
+        sq, _ = self.add_info_SQ_MU()
+        assert (sq.nb_records, sq.nb_late, sq.total_delay) == (2, 1, 93)
+        assert sq.get_rating_airline() == (50, 46)
+        sq.add_info(
+            {
+                "date": "2015-08-22",
+                "time": "23:50",
+                "code": "SQ833",
+                "destination": "Singapore",
+                "take-off": "0:40",
+            }
+        )
+        records = sq.flight_records["SQ833"]
+        assert (len(records), records.nb_late, records.total_delay) == (1, 1, 50)
+        assert sq.get_rating_flight("SQ833") == (100, 50)
+        assert sq.get_rating_flight("SQ827") == (50, 46)
+        assert sq.get_rating_airline() == (66, 47)
+
+    def test_05_merge(self):
+        """Merging Airlines gives the same result as adding all the records"""
+        sq, _ = self.add_info_SQ_MU()
+        first, second = Airline("Singapore Airlines", "SQ"), Airline("Singapore Airlines", "SQ")
+        first.add_info(
+            {
+                "date": "2015-08-20",
+                "time": "08:05",
+                "code": "SQ827",
+                "destination": "Singapore",
+                "take-off": "09:08",
+            }
+        )
+        second.add_info(
+            {
+                "date": "2015-08-21",
+                "time": "08:05",
+                "code": "SQ827",
+                "destination": "Singapore",
+                "take-off": "08:35",
+            }
+        )
+        merged = first.merge(second)
+        assert attributes(merged) == attributes(sq)
+        assert merged.get_rating_flight("SQ827") == sq.get_rating_flight("SQ827")
+        assert merged.get_rating_airline() == sq.get_rating_airline()
+
+    def test_06_percentiles(self):
+        """Percentiles of the delays are the same as percentiles of the sorted delays"""
+
+        def get_percentiles(delays):
+            delays = sorted(delays)
+            return tuple(delays[-(-p * len(delays) // 100) - 1] for p in (50, 90, 99))
+
+        airlines_dic = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        for airline in airlines_dic.values():
+            delays = [d for records in airline.flight_records.values() for d in records.delays]
+            assert airline.get_percentiles_airline() == get_percentiles(delays)
+            for flight, records in airline.flight_records.items():
+                assert airline.get_percentiles_flight(flight) == get_percentiles(records.delays)
+        assert airline.get_percentiles_flight("XX000") is None
+
+        # Histograms are merged by adding the counts
+        histogram = airlines.DelayHistogram([5, 10, -100])
+        histogram.update(airlines.DelayHistogram([400] * 6 + [700]))
+        assert len(histogram) == 10
+        assert histogram.get_percentiles((10, 20, 30, 90, 100)) == (-100, 5, 10, 400, 700)
+        assert airlines.DelayHistogram().get_percentiles() is None
+
+        # Date range
+        sq, _ = self.add_info_SQ_MU()
+        assert sq.get_percentiles_flight("SQ827", end="2015-08-20") == (63, 63, 63)
+        assert sq.get_percentiles_airline(start="2015-08-21") == (30, 30, 30)
+        # Histograms per date of the airlines, records added after the first query
+        airline = airlines_dic["China Eastern Airlines"]
+        assert airline.get_percentiles_airline(start="2015-08-21")
+        airline.add_info(rec.read_flight_records("list_records.txt")[-1])
+        day = airlines.encode_date("2015-08-21")
+        delays = [
+            delay
+            for records in airline.flight_records.values()
+            for date, delay in zip(records.dates, records.delays)
+            if date >= day
+        ]
+        assert airline.get_percentiles_airline(start="2015-08-21") == get_percentiles(delays)
+
+    def test_07_add_records(self):
+        """Adding records as columns gives the same result as adding them one by one"""
+        records = [r for r in rec.read_flight_records("list_records.txt") if r["code"][:2] == "MU"]
+        expected = Airline("China Eastern Airlines", "MU")
+        for record in records:
+            expected.add_info(record)
+
+        batch = {key: [r[key] for r in records] for key in records[0]}
+        mu = Airline("China Eastern Airlines", "MU")
+        mu.add_records(batch)
+        assert attributes(mu) == attributes(expected)
+        assert mu.get_rating_airline() == expected.get_rating_airline()
+
+        # Delays already calculated, records added in 2 blocks
+        batch["delay"] = get_delays_cached(batch.pop("time"), batch.pop("take-off"))
+        batch["time"] = [r["time"] for r in records]
+        mu = Airline("China Eastern Airlines", "MU")
+        mu.add_records({key: column[:7] for key, column in batch.items()})
+        mu.add_records({key: column[7:] for key, column in batch.items()})
+        assert attributes(mu) == attributes(expected)
+
+    def test_08_date_range(self):
+        """Ratings of a date range are combined from the counters of each date"""
+        sq, _ = self.add_info_SQ_MU()
+        assert sq.get_rating_flight("SQ827", "2015-08-20", "2015-08-20") == (100, 63)
+        assert sq.get_rating_flight("SQ827", start="2015-08-21") == (0, 30)
+        assert sq.get_rating_flight("SQ827", end="2015-08-19") == (None, None)
+        assert sq.get_rating_airline("2015-08-20", "2015-08-21") == sq.get_rating_airline()
+        assert sq.buckets.get_date_range() == ("2015-08-20", "2015-08-21")
+
+        # Records added after a query are counted at next query
+        sq.add_info(
+            {
+                "date": "2015-08-22",
+                "time": "08:05",
+                "code": "SQ827",
+                "destination": "Singapore",
+                "take-off": "08:05",
+            }
+        )
+        assert sq.get_rating_flight("SQ827", start="2015-08-21") == (0, 15)
+        assert sq.get_rating_airline(start="2015-08-22") == (0, 0)
+
 
 # Test main program
 class TestMain(object):
@@ -161,6 +387,102 @@ class TestMain(object):
             },
         ]
 
+    def test_01_iter_flight_records(self):
+        """Stream flight records from an existing file"""
+        records = rec.iter_flight_records("mini_record.txt")
+        assert not isinstance(records, list)
+        assert next(records)["code"] == "EK303"
+        assert [r["code"] for r in records] == ["MU553", "MU219"]
+
+    def test_01_iter_flight_records_malformed(self, tmp_path, capsys):
+        """Malformed lines are reported and skipped while streaming"""
+        log = tmp_path / "records.txt"
+        log.write_text(
+            "2015-08-20, 0:05, EK303, Emirates Airlines, Dubai, 0:41\n"
+            "2015-08-20, 0:05, MU553, China Eastern Airlines\n"
+        )
+        records = list(rec.iter_flight_records(str(log)))
+        assert [r["code"] for r in records] == ["EK303"]
+        assert "incorrect number of data" in capsys.readouterr().out
+
+        with pytest.raises(IOError):
+            list(rec.iter_flight_records("unknown.txt"))
+
+    def test_01_record_batches(self, tmp_path, capsys):
+        """Records read as columns are the same as records read line by line"""
+        log = tmp_path / "records.txt"
+        lines = open("list_records.txt").read().splitlines(keepends=True)
+        lines[5] = "2015-08-20, 0:05, MU553, China Eastern Airlines\n"
+        lines[30] = "\n"
+        log.write_text("".join(lines))
+        batches = rec.RecordBatches(str(log), batch_size=1000)
+        assert list(batches) == list(rec.iter_flight_records(str(log)))
+        assert capsys.readouterr().out.count("incorrect number of data") == 2
+        assert sum(len(c["date"]) for c in batches.iter_batches()) == len(lines) - 2
+
+        airlines = rec.get_ratings_airlines(batches)
+        expected = rec.get_ratings_airlines(rec.iter_flight_records(str(log)))
+        assert list(airlines) == list(expected)
+        for name, airline in airlines.items():
+            assert attributes(airline) == attributes(expected[name])
+
+        # Part of the file, read by small blocks
+        start, end = len(lines[0]) + len(lines[1]), sum(map(len, lines[:40]))
+        batches = rec.RecordBatches(str(log), start, end, batch_size=100)
+        assert list(batches) == list(rec.iter_flight_records(str(log), start, end))
+
+        with pytest.raises(IOError):
+            list(rec.RecordBatches("unknown.txt"))
+
+    def test_01_iter_flight_records_mmap(self, tmp_path, capsys):
+        """Memory-mapped parser gives the same records as the split parser"""
+        for file_path in ("mini_record.txt", "list_records.txt"):
+            records = list(rec.iter_flight_records_mmap(file_path))
+            assert records == rec.read_flight_records(file_path)
+        # Same strings are shared between records
+        assert records[0]["date"] is records[1]["date"]
+
+        log = tmp_path / "records.txt"
+        log.write_text(
+            "2015-08-20, 0:05, EK303, Emirates Airlines, Dubai, 0:41\n\n"
+            "2015-08-20, 0:05, MU553, China Eastern Airlines\n"
+        )
+        records = list(rec.iter_flight_records_mmap(str(log)))
+        assert [r["code"] for r in records] == ["EK303"]
+        assert "incorrect number of data" in capsys.readouterr().out
+
+        (tmp_path / "empty.txt").write_text("")
+        assert list(rec.iter_flight_records_mmap(str(tmp_path / "empty.txt"))) == []
+        with pytest.raises(IOError):
+            list(rec.iter_flight_records_mmap("unknown.txt"))
+
+    def test_01_invalid_dates(self, tmp_path, capsys):
+        """Lines with a date which does not exist are reported and skipped by each parser"""
+        log = tmp_path / "records.txt"
+        lines = open("list_records.txt").read().splitlines(keepends=True)
+        lines[3] = lines[3].replace(lines[3][:10], "2015-02-30", 1)
+        lines[40] = lines[40].replace(lines[40][:10], "n/a", 1)
+        log.write_text("".join(lines))
+        expected = list(rec.iter_flight_records("list_records.txt"))
+        del expected[40], expected[3]
+        for parser in rec.RECORD_PARSERS:
+            airlines = rec.get_ratings_airlines(rec.RECORD_PARSERS[parser](str(log)))
+            assert rec.count_records(airlines) == len(expected), parser
+            capsys.readouterr()
+            counters = Counter()
+            records = rec.RECORD_PARSERS[parser](str(log), counters=counters)
+            assert list(records) == expected, parser
+            assert counters == {"malformed_lines": 2}, parser
+            assert capsys.readouterr().out.count("has an invalid date") == 2, parser
+        ids = rec.RecordBatches(str(log)).iter_id_batches(catalog.Catalog())
+        assert sum(len(batch["date"]) for batch in ids) == len(expected)
+
+        # Records added directly: the airline is not modified
+        airline = Airline("Air France", "AF")
+        with pytest.raises(ValueError):
+            airline.add_info(dict(expected[0], date="2015-02-30"))
+        assert airline.flights == {} and airline.destination == {}
+
     def test_02_get_ratings_flight(self):
         """Get rating of flight"""
         af = Airline("Air France", "Air France")
@@ -192,13 +514,16 @@ class TestMain(object):
         """Get ratings of airlines based on the records"""
         records = rec.read_flight_records("mini_record.txt")
         airlines = rec.get_ratings_airlines(records)
-        assert airlines["Emirates Airlines"].__dict__ == {
+        # Records can also be streamed from the file
+        streamed = rec.get_ratings_airlines(rec.iter_flight_records("mini_record.txt"))
+        assert streamed.keys() == airlines.keys()
+        assert attributes(airlines["Emirates Airlines"]) == {
             "destination": {"EK303": "Dubai"},
             "flights": {"EK303": [{"date": "2015-08-20", "delay": 36, "time": "0:05"}]},
             "code": "EK",
             "name": "Emirates Airlines",
         }
-        assert airlines["China Eastern Airlines"].__dict__ == {
+        assert attributes(airlines["China Eastern Airlines"]) == {
             "destination": {"MU553": "Paris Ch. de Gaulle", "MU219": "Frankfurt"},
             "flights": {
                 "MU553": [{"date": "2015-08-20", "delay": 10, "time": "0:05"}],
@@ -238,7 +563,897 @@ class TestMain(object):
         assert first == [("AA", 100), ("ZZ", 2)]
         assert last == [("EE", 3), ("dd", 400)]
 
+    def test_06_select_first_last(self):
+        """Heap selection gives the same ratings as a full sort (including ties)"""
+        rnd = random.Random(42)
+        ratings = [
+            (f"F{i}", rnd.choice([0, 50, 100]), rnd.randrange(-5, 5)) for i in range(200)
+        ]
+        for nb_elem in (0, 1, 7, 200, 300):
+            sorted_ratings = sorted(ratings, key=rec.score_airline)
+            expected = rec.get_first_last_elem(sorted_ratings, nb_elem)
+            assert rec.select_first_last(ratings, nb_elem) == expected
+
+    def test_06_list_first_last_ratings(self):
+        """Select best/worse airlines and flights from the records"""
+        airlines = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        rating_airlines, rating_flights = rec.list_sorted_ratings(airlines)
+        first_last_airlines, first_last_flights = rec.list_first_last_ratings(airlines, 5)
+        assert first_last_airlines == rec.get_first_last_elem(rating_airlines, 5)
+        assert first_last_flights == rec.get_first_last_elem(rating_flights, 5)
+
+    def test_07_split_file(self):
+        """Chunks of a file are cut at the beginning of lines and cover the file"""
+        chunks = rec.split_file("list_records.txt", 7)
+        assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize("list_records.txt")
+        with open("list_records.txt", "rb") as f:
+            content = f.read()
+        for (start, end), (next_start, _) in zip(chunks, chunks[1:]):
+            assert end == next_start
+            assert content[start - 1 : start] in (b"", b"\n")
+
+        records = [
+            record
+            for start, end in chunks
+            for record in rec.iter_flight_records("list_records.txt", start, end)
+        ]
+        assert records == rec.read_flight_records("list_records.txt")
+
+    def test_07_get_ratings_airlines_parallel(self):
+        """Reading a file with several processes gives the same Airlines"""
+        expected = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        for parser in ("split", "columns"):
+            airlines = rec.get_ratings_airlines_parallel("list_records.txt", 3, parser)
+            assert list(airlines) == list(expected)
+            for name, airline in airlines.items():
+                assert attributes(airline) == attributes(expected[name])
+                assert airline.get_rating_airline() == expected[name].get_rating_airline()
+            assert rec.list_sorted_ratings(airlines) == rec.list_sorted_ratings(expected)
+
+    def test_08_read_ratings_airlines_counters(self, tmp_path):
+        """Counters of malformed lines and records added"""
+        log = tmp_path / "records.txt"
+        log.write_text(open("list_records.txt").read() + "2015-08-20, 0:05, EK303\n")
+        for options in ({}, {"nb_workers": 2}, {"checkpoint_path": str(tmp_path / "ckpt")}):
+            get_delay_cached.cache_clear()
+            counters = Counter()
+            airlines = rec.read_ratings_airlines(str(log), counters=counters, **options)
+            assert counters.keys() == {"malformed_lines", "records", "get_delay_calls"}
+            assert counters["malformed_lines"] == 1 and counters["records"] == 468
+            assert rec.count_records(airlines) == 468
+            # Delays really calculated: 451 distinct couples of times (one cache per worker)
+            if "nb_workers" in options:
+                assert 451 <= counters["get_delay_calls"] <= 468
+            else:
+                assert counters["get_delay_calls"] == 451
+
+        # Couples of times already in cache are not calculated again
+        counters = Counter()
+        rec.read_ratings_airlines(str(log), counters=counters)
+        assert counters["get_delay_calls"] == 0
+        # Delays of columns calculated for each record
+        rec.read_ratings_airlines(str(log), parser="columns", counters=counters)
+        assert counters["get_delay_calls"] == 468
+
+    def test_09_main_profile(self, tmp_path):
+        """Main program writes the report and the measures of each stage"""
+        report, profile = tmp_path / "report.html", tmp_path / "profile.json"
+        measures = list()
+        profiler = profiling.Profiler(hooks=[measures.append])
+        rec.main(
+            ["mini_record.txt", "-o", str(report), "--profile", str(profile)], profiler
+        )
+        assert "<b>MU553</b> (0%, avg=10 min)" in report.read_text()
+
+        content = json.loads(profile.read_text())
+        assert [m["stage"] for m in content["stages"]] == [m["stage"] for m in measures]
+        assert content["stages"][0] == measures[0]
+        assert measures[0]["stage"] == "import"
+        assert measures[0]["budget_s"] == rec.IMPORT_TIME_BUDGET
+        assert measures[1]["stage"] == "read_ratings_airlines"
+        assert measures[1]["records"] == 3
+        assert content["counters"]["malformed_lines"] == 0
+        assert all(m["wall_s"] >= 0 and m.get("cpu_s", 0) >= 0 for m in measures)
+
+    def test_09_main_lazy_imports(self, tmp_path):
+        """Modules of options not used are not imported by the main program"""
+        report = tmp_path / "report.html"
+        lazy_modules = ["_strptime", "concurrent.futures", "json", "numpy", "snapshot", "typing"]
+        lazy_modules += ["mmap", "queue", "threading"]
+        # Modules imported by the functions of main, not by the import of processRecords
+        main_modules = ["columnar_log", "compressed_log", "profiling", "ranking"]
+        main_modules += ["report_template", "catalog", "heapq"]
+        code = (
+            "import sys, run_report;"
+            f"print(sorted(set({main_modules}) & set(sys.modules)));"
+            "run_report.main([sys.argv[1], '-o', sys.argv[2]]);"
+            f"print(sorted(set({lazy_modules}) & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code, "mini_record.txt", str(report)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.splitlines()[0] == result.stdout.splitlines()[-1] == "[]"
+        assert "<b>MU553</b>" in report.read_text()
+
+    def test_09_main_full_ranking(self, tmp_path):
+        """All the flights are in the report with option --all"""
+        report = tmp_path / "report.html"
+        rec.main(["list_records.txt", "-o", str(report), "--all"])
+        rating_airlines, rating_flights = rec.list_sorted_ratings(
+            rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        )
+        content = report.read_text()
+        assert content.count("<li>") == 2 * (len(rating_airlines) + len(rating_flights))
+        # Each rating is followed by percentiles of the delays
+        first_flight = "<li><b>{0}</b> ({1}%, avg={2} min) p50/p90/p99=".format(*rating_flights[0])
+        assert first_flight in content
+
+    def test_10_date_range(self, tmp_path):
+        """Ratings of a date range are the same as ratings of the records of the range"""
+        log = tmp_path / "records.txt"
+        generate_records.generate_records(str(log), 3000, nb_airlines=4, nb_flights=5)
+        records = rec.read_flight_records(str(log))
+        airlines = rec.get_ratings_airlines(records)
+        start, end = rec.get_window(airlines, 7)
+        assert end == max(r["date"] for r in records)
+        selected = [r for r in records if start <= r["date"] <= end]
+        # NOTE: flights with the same score may be in another order (order of creation)
+        expected = rec.list_ratings(rec.get_ratings_airlines(selected))
+        assert [sorted(r) for r in rec.list_ratings(airlines, start, end)] == [
+            sorted(r) for r in expected
+        ]
+
+        # Same ranking with --window as with --from/--to
+        reports = [tmp_path / "window.html", tmp_path / "from_to.html"]
+        rec.main([str(log), "-o", str(reports[0]), "--window", "7"])
+        rec.main([str(log), "-o", str(reports[1]), "--from", start, "--to", end])
+        assert reports[0].read_text() == reports[1].read_text()
+
+        with pytest.raises(SystemExit):
+            rec.main([str(log), "--from", "2015-13-01"])
+
+
+# Test templates of reports (report_template.py)
+class TestReportTemplate:
+    """Test compilation and rendering of templates"""
+
+    def test_01_render(self):
+        """Fields are replaced, except in <style> blocks"""
+        template = report_template.ReportTemplate(
+            "<STYLE>td {color:red;}</STYLE><b>{name}</b> {{x}} {value:>3}<ol>{items}</ol>"
+        )
+        assert template.fields() == ["name", "value", "items"]
+        items = report_template.join_items(", ", (str(i) for i in range(3)))
+        assert (
+            template.render({"name": "MU", "value": 5, "items": items})
+            == "<STYLE>td {color:red;}</STYLE><b>MU</b> {x}   5<ol>0, 1, 2</ol>"
+        )
+
+        # Conversions are applied like str.format, unknown conversions are rejected
+        text = "{name!r:>6} {value!s} {name!a}"
+        values = {"name": "Mü", "value": 5}
+        assert report_template.ReportTemplate(text).render(values) == text.format(**values)
+        with pytest.raises(ValueError):
+            report_template.ReportTemplate("{name!x}")
+
+    def test_02_same_as_format(self):
+        """Same report as replacing curly brackets of <style> blocks and using format"""
+        with open("report_Template.html") as f:
+            text = f.read()
+        for block in re.findall(r"<style>.*?</style>", text, re.I | re.S):
+            text = text.replace(block, re.sub(r"([{}])\1*", r"\1" * 2, block))
+
+        values = {key: f"<{key}>" for key in ("airports", "date", "time", "best_airlines")}
+        values.update(worse_airlines="a</li>\n<li>b", best_flights="", worse_flights="c")
+        template = report_template.load_template("report_Template.html")
+        assert template.render(values) == text.format(**values)
+
+    def test_03_load_template_cache(self, tmp_path):
+        """Templates are compiled again only when the file is modified"""
+        path = tmp_path / "template.html"
+        path.write_text("<p>{a}</p>")
+        template = report_template.load_template(str(path))
+        assert report_template.load_template(str(path)) is template
+
+        path.write_text("<p>{b}</p>")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        assert report_template.load_template(str(path)).render({"b": 1}) == "<p>1</p>"
+
+
+# Test snapshots of Airlines (snapshot.py)
+class TestSnapshot:
+    """Test cache of Airlines saved in binary files"""
+
+    def test_01_cached_ratings(self, tmp_path):
+        """Airlines are loaded from the cache while the input file is unchanged"""
+        log, cache = tmp_path / "records.txt", str(tmp_path / "records.cache")
+        log.write_bytes(open("list_records.txt", "rb").read())
+        assert snapshot.load_cached_ratings(str(log), cache) is None
+
+        expected = rec.get_ratings_airlines(rec.iter_flight_records(str(log)))
+        snapshot.save_cached_ratings(str(log), cache, expected)
+        airlines = snapshot.load_cached_ratings(str(log), cache)
+        assert rec.list_sorted_ratings(airlines) == rec.list_sorted_ratings(expected)
+        for name, airline in airlines.items():
+            assert attributes(airline) == attributes(expected[name])
+
+        # Content changed (same size and same modification time)
+        stat = os.stat(log)
+        content = log.read_bytes()
+        log.write_bytes(content.replace(b"EK303", b"EK304", 1))
+        os.utime(log, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert snapshot.load_cached_ratings(str(log), cache) is None
+
+        # Content appended
+        log.write_bytes(content + b"2015-08-21, 0:05, EK303, Emirates Airlines, Dubai, 0:41\n")
+        assert snapshot.load_cached_ratings(str(log), cache) is None
+
+        # Content appended while the file was read: the key before reading is saved
+        file_key = snapshot.get_file_key(str(log))
+        log.write_bytes(log.read_bytes() + content[-100:])
+        snapshot.save_cached_ratings(str(log), cache, expected, file_key)
+        assert snapshot.load_cached_ratings(str(log), cache) is None
+
+    def test_01_read_cached_ratings(self, tmp_path, capsys):
+        """Records of the cache are counted, the cache is not used with a quarantine"""
+        log, cache = tmp_path / "records.txt", str(tmp_path / "records.cache")
+        log.write_bytes(open("list_records.txt", "rb").read() + b"2015-02-30, 0:05, EK303\n")
+        expected = rec.read_ratings_airlines(str(log), cache_path=cache)
+        counters = Counter()
+        airlines = rec.read_ratings_airlines(str(log), cache_path=cache, counters=counters)
+        assert "loaded from cache" in capsys.readouterr().out
+        assert counters["records"] == rec.count_records(expected)
+
+        with validation.Quarantine(str(tmp_path / "invalid.txt")) as quarantine:
+            airlines = rec.read_ratings_airlines(
+                str(log), cache_path=cache, counters=counters, quarantine=quarantine
+            )
+        assert "not used with a quarantine" in capsys.readouterr().out
+        assert counters["invalid_lines"] == quarantine.nb_lines == 1
+        assert rec.list_sorted_ratings(airlines) == rec.list_sorted_ratings(expected)
+
+    def test_01_incremental_ratings(self, tmp_path):
+        """Lines appended to a file are added to the Airlines of the checkpoint"""
+        log, checkpoint = tmp_path / "records.txt", str(tmp_path / "records.ckpt")
+        lines = open("list_records.txt").read().splitlines(keepends=True)
+        log.write_text("".join(lines[:100]) + lines[100][:20])  # last line incomplete
+
+        airlines = rec.get_ratings_airlines_incremental(str(log), checkpoint)
+        assert sum(a.nb_records for a in airlines.values()) == 100
+
+        with open(log, "a") as f:
+            f.write("".join(lines[100:])[20:])
+        airlines = rec.get_ratings_airlines_incremental(str(log), checkpoint, "mmap")
+        expected = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        assert rec.list_sorted_ratings(airlines) == rec.list_sorted_ratings(expected)
+        for name, airline in airlines.items():
+            assert attributes(airline) == attributes(expected[name])
+
+        # Nothing new: Airlines of the checkpoint are returned
+        assert rec.get_ratings_airlines_incremental(str(log), checkpoint).keys() == airlines.keys()
+
+    def test_01_incremental_ratings_truncated(self, tmp_path):
+        """All the file is read again when it is truncated or replaced"""
+        log, checkpoint = tmp_path / "records.txt", str(tmp_path / "records.ckpt")
+        content = open("list_records.txt").read()
+        log.write_text(content)
+        rec.get_ratings_airlines_incremental(str(log), checkpoint)
+
+        # Truncated
+        mini = open("mini_record.txt").read() + "\n"
+        log.write_text(mini)
+        airlines = rec.get_ratings_airlines_incremental(str(log), checkpoint)
+        assert sum(a.nb_records for a in airlines.values()) == 3
+
+        # Rewritten with a longer content
+        log.write_text(mini.replace("EK303", "EK304") + content)
+        airlines = rec.get_ratings_airlines_incremental(str(log), checkpoint)
+        assert "EK304" in airlines["Emirates Airlines"].flights
+        assert sum(a.nb_records for a in airlines.values()) == 3 + len(
+            rec.read_flight_records("list_records.txt")
+        )
+
+    def test_02_corrupted_cache(self, tmp_path):
+        """A corrupted cache file is ignored"""
+        cache = tmp_path / "records.cache"
+        cache.write_bytes(b"not a snapshot")
+        assert snapshot.load_cached_ratings("mini_record.txt", str(cache)) is None
+
+
+# Test benchmark tools (generate_records.py, bench_airlines.py)
+class TestBenchmark:
+    """Test generation of synthetic records and benchmark of the stages"""
+
+    def test_01_generate_records(self, tmp_path, capsys):
+        """Generated records are deterministic and follow the options"""
+        options = dict(nb_airlines=3, nb_flights=4, malformed_rate=0.1, midnight_rate=0.2)
+        lines = list(generate_records.iter_synthetic_lines(1000, **options))
+        assert lines == list(generate_records.iter_synthetic_lines(1000, **options))
+        assert lines != list(generate_records.iter_synthetic_lines(1000, seed=1, **options))
+
+        log = tmp_path / "records.txt"
+        generate_records.generate_records(str(log), 1000, **options)
+        records = rec.read_flight_records(str(log))
+        assert 850 < len(records) < 950  # 10% malformed
+        assert len(capsys.readouterr().out.splitlines()) == 1000 - len(records)
+
+        airlines = rec.get_ratings_airlines(records)
+        assert len(airlines) == 3
+        assert all(len(a.flight_records) <= 4 for a in airlines.values())
+        crossing = [
+            r
+            for r in records
+            if encode_time(r["time"]) >= 23 * 60 and encode_time(r["take-off"]) < 2 * 60
+        ]
+        assert 150 < len(crossing) < 250  # 20% crossing midnight
+
+        # Airline codes are unique (as many as 2 letters or digits allow)
+        codes = [generate_records.get_airline_code(index) for index in range(36 * 36)]
+        assert len(set(codes)) == len(codes) and codes[936] == "0A"
+        with pytest.raises(ValueError):
+            generate_records.get_airline_code(36 * 36)
+
+    def test_02_run_benchmark(self, tmp_path):
+        """Each stage of the pipeline is measured"""
+        log = tmp_path / "records.txt"
+        generate_records.generate_records(str(log), 200)
+        results = bench_airlines.run_benchmark(str(log), 200)
+        stages = [measure["stage"] for measure in results]
+        assert "read+get_ratings_airlines" in stages and "list_sorted_ratings" in stages
+        assert all(measure["wall_s"] >= 0 for measure in results)
+        assert "process_peak_rss_kb" in results[0]
+
+
+# Test report service (report_service.py)
+class TestReportService:
+    """Test the Airlines kept up to date and the answers to requests"""
+
+    def test_01_update(self, tmp_path):
+        """Lines appended to the log are added, all the log is read again if truncated"""
+        log = tmp_path / "records.txt"
+        lines = open("list_records.txt").read().splitlines(keepends=True)
+        log.write_text("".join(lines[:100]) + lines[100][:20])  # last line incomplete
+        service = report_service.ReportService(str(log))
+        service.update()
+        assert service.get_status()["records"] == 100
+        assert service.update() == 0
+
+        with open(log, "a") as f:
+            f.write("".join(lines[100:])[20:])
+        service.update()
+        expected = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        assert service.get_sorted_ratings() == rec.list_sorted_ratings(expected)
+
+        log.write_text(open("mini_record.txt").read() + "\n")
+        service.update()
+        assert service.get_status()["records"] == 3
+
+    def test_02_handle_request(self):
+        """Rankings and ratings are answered in JSON, the report in HTML"""
+        service = report_service.ReportService("list_records.txt")
+        service.update()
+        expected = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        (best_airlines, worse_airlines), (best_flights, _) = rec.list_first_last_ratings(
+            expected, 3
+        )
+
+        status, content_type, content = service.handle_request("/airlines?n=3")
+        assert (status, content_type) == (200, "application/json")
+        assert [a["name"] for a in json.loads(content)["best"]] == [a[0] for a in best_airlines]
+        assert [a["name"] for a in json.loads(content)["worse"]] == [a[0] for a in worse_airlines]
+        content = json.loads(service.handle_request("/flights?n=3")[2])
+        assert [f["flight"] for f in content["best"]] == [f[0] for f in best_flights]
+
+        content = json.loads(service.handle_request("/flights/EK303")[2])
+        assert content["airline"] == "Emirates Airlines"
+        percentiles = expected["Emirates Airlines"].get_percentiles_flight("EK303")
+        assert (content["p50"], content["p90"], content["p99"]) == percentiles
+        assert (content["late_percent"], content["average_delay"]) == expected[
+            "Emirates Airlines"
+        ].get_rating_flight("EK303")
+        name = "Emirates%20Airlines"
+        assert json.loads(service.handle_request(f"/airlines/{name}")[2])["code"] == "EK"
+
+        status, content_type, content = service.handle_request("/report?n=3")
+        assert (status, content_type) == (200, "text/html")
+        assert service.handle_request("/report?n=3")[2] is content  # cached
+        assert service.handle_request("/flights/XX000")[0] == 404
+        assert service.handle_request("/unknown")[0] == 404
+        assert service.handle_request("/airlines?n=x")[0] == 400
+
+    def test_03_serve(self, tmp_path):
+        """Requests are answered over a Unix socket, errors with status 500"""
+        socket_path = str(tmp_path / "service.sock")
+        service = report_service.ReportService("list_records.txt")
+
+        async def request():
+            task = asyncio.create_task(service.serve(unix_path=socket_path, interval=0.01))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            answers = list()
+            for path in (b"/status", b"/airlines/Emirates%20Airlines"):
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+                writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                answers.append(await reader.read())
+                service.get_airline = None  # Error for the next request
+            task.cancel()
+            return answers
+
+        answer, error = asyncio.run(request())
+        assert answer.startswith(b"HTTP/1.1 200 OK")
+        status = json.loads(answer.split(b"\r\n\r\n", 1)[1])
+        assert status["records"] == len(rec.read_flight_records("list_records.txt"))
+        assert error.startswith(b"HTTP/1.1 500 Error")
+
+
+# Test columnar logs (columnar_log.py)
+class TestColumnarLog:
+    """Test conversion of text logs into columnar logs and reading of columnar logs"""
+
+    def convert(self, tmp_path, text: str):
+        text_path, log_path = tmp_path / "records.txt", str(tmp_path / "records.alog")
+        text_path.write_text(text)
+        columnar_log.convert_log(str(text_path), log_path, batch_size=2000)
+        return str(text_path), log_path
+
+    def test_01_convert_log(self, tmp_path, capsys):
+        """Records of a columnar log are the same as records of the text log"""
+        text = open("list_records.txt").read()
+        text += "2015-08-23, 08:05, MU553, China Eastern Airlines\n"  # malformed
+        text += "2015-08-23, 08:05, MU553, China Eastern Airlines, Paris, 09:00\n"
+        text_path, log_path = self.convert(tmp_path, text)
+        assert "incorrect number of data" in capsys.readouterr().out
+        assert columnar_log.is_columnar_log(log_path)
+        assert not columnar_log.is_columnar_log(text_path)
+        assert not columnar_log.is_columnar_log("unknown.txt")
+
+        log = columnar_log.ColumnarLog(log_path)
+        assert len(log.row_groups) > 1
+        assert len(log) == 469
+        expected = rec.read_flight_records(text_path)
+        assert list(log) == expected
+        assert list(columnar_log.ColumnarLog(log_path, use_mmap=True)) == expected
+
+        with pytest.raises(IOError):
+            columnar_log.ColumnarLog(text_path)
+
+    def test_02_get_ratings_airlines(self, tmp_path):
+        """Airlines created from a columnar log are the same as from the text log"""
+        text_path, log_path = self.convert(tmp_path, open("list_records.txt").read())
+        expected = rec.get_ratings_airlines(rec.iter_flight_records(text_path))
+        for use_mmap in (False, True):
+            log = columnar_log.ColumnarLog(log_path, use_mmap=use_mmap)
+            airlines = rec.get_ratings_airlines(log)
+            assert list(airlines) == list(expected)
+            for name, airline in airlines.items():
+                assert attributes(airline) == attributes(expected[name])
+
+        # Chunks of the file: each row group is read once
+        for options in ({"nb_workers": 3}, {"checkpoint_path": str(tmp_path / "ckpt")}):
+            counters = Counter()
+            airlines = rec.read_ratings_airlines(log_path, counters=counters, **options)
+            assert rec.list_sorted_ratings(airlines) == rec.list_sorted_ratings(expected)
+            assert counters["records"] == 468 and counters["get_delay_calls"] == 0
+
+    def test_03_main(self, tmp_path):
+        """Same report from a columnar log as from the text log"""
+        text_path, log_path = self.convert(tmp_path, open("list_records.txt").read())
+        reports = [tmp_path / "text.html", tmp_path / "log.html"]
+        rec.main([text_path, "-o", str(reports[0])])
+        rec.main([log_path, "-o", str(reports[1]), "--parser", "mmap"])
+        text, log = (re.sub(r"Generation:</i>.*", "", r.read_text()) for r in reports)
+        assert text == log
+
+
+# Test the scoring policies and the sorted rankings (ranking.py)
+class TestRanking:
+    """Test the rankings with scoring policies, kept sorted while records are added"""
+
+    def test_01_sort_ratings(self, tmp_path):
+        """Default policy gives the same rankings as list_sorted_ratings"""
+        log = tmp_path / "records.txt"
+        generate_records.generate_records(str(log), 3000, nb_airlines=4, nb_flights=5)
+        airlines_dic = rec.get_ratings_airlines(rec.read_flight_records(str(log)))
+        expected = rec.list_sorted_ratings(airlines_dic)
+        assert ranking.sort_ratings(airlines_dic) == expected
+        assert rec.list_sorted_ratings(airlines_dic, policy=ranking.weighted_score()) == expected
+        start, end = rec.get_window(airlines_dic, 7)
+        assert ranking.sort_ratings(airlines_dic, start=start, end=end) == (
+            rec.list_sorted_ratings(airlines_dic, start, end)
+        )
+
+        # Percentiles: scores from the histograms of the airlines and flights
+        rating_airlines, _ = ranking.sort_ratings(airlines_dic, ranking.percentile_score(90))
+        p90 = [airlines_dic[name].get_percentiles_airline()[1] for name, *_ in rating_airlines]
+        assert p90 == sorted(p90)
+
+        # Minimum number of records: flights with less records are not ranked
+        nb_records = sorted(
+            len(r) for a in airlines_dic.values() for r in a.flight_records.values()
+        )
+        policy = ranking.min_records(nb_records[5])
+        _, rating_flights = ranking.sort_ratings(airlines_dic, policy)
+        assert len(rating_flights) == len([n for n in nb_records if n >= nb_records[5]])
+        best, worse = rec.list_first_last_ratings(airlines_dic, 3, policy=policy)[1]
+        assert (best, worse) == rec.get_first_last_elem(rating_flights, 3)
+
+    def test_02_ranking_index(self, tmp_path):
+        """The index is updated when records are added, and sorted again with a new policy"""
+        log = tmp_path / "records.txt"
+        generate_records.generate_records(str(log), 3000, nb_airlines=4, nb_flights=5)
+        records = rec.read_flight_records(str(log))
+        airlines_dic = dict()
+        index = ranking.RankingIndex(airlines_dic)
+        assert index.get_sorted_ratings() == ([], [])
+        for start in range(0, len(records), 1000):
+            rec.get_ratings_airlines(records[start : start + 1000], airlines_dic)
+            assert index.get_sorted_ratings() == rec.list_sorted_ratings(airlines_dic)
+        assert index.update() == 0  # No new record: nothing scored again
+
+        # One record added: only its airline and its flight are scored again
+        rec.get_ratings_airlines(records[:1], airlines_dic)
+        changed = airlines_dic[records[0]["airline"]].changed_flights
+        assert list(changed)[-1] == records[0]["code"]
+        assert index.update() == 2
+        assert index.get_sorted_ratings() == rec.list_sorted_ratings(airlines_dic)
+
+        policy = ranking.min_records(150, ranking.percentile_score(50))
+        index.set_policy(policy)
+        assert index.get_sorted_ratings() == ranking.sort_ratings(airlines_dic, policy)
+
+    def test_03_main_score(self, tmp_path):
+        """Option --score ranks with another policy, --min-records skips small flights"""
+        report = tmp_path / "report.html"
+        rec.main(["list_records.txt", "-o", str(report), "--all", "--score", "p90"])
+        airlines_dic = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        _, rating_flights = ranking.sort_ratings(airlines_dic, ranking.percentile_score(90))
+        first_flight = "<li><b>{0}</b> ({1}%, avg={2} min)".format(*rating_flights[0])
+        assert first_flight in report.read_text()
+
+        rec.main(["list_records.txt", "-o", str(report), "--all", "--min-records", "1000000"])
+        assert "<li><b>" not in report.read_text()
+
+
+# Test the compressed logs (compressed_log.py)
+class TestCompressedLog:
+    """Test the compressed logs, decompressed while the records are read"""
+
+    @pytest.fixture
+    def compressed_logs(self, tmp_path):
+        """list_records.txt compressed with each compression of the standard library"""
+        import bz2, gzip, lzma
+
+        content = open("list_records.txt", "rb").read()
+        logs = dict()
+        for compression, module in (("gzip", gzip), ("bz2", bz2), ("xz", lzma)):
+            logs[compression] = tmp_path / f"list_records.txt.{compression}"
+            logs[compression].write_bytes(module.compress(content))
+        return logs
+
+    def test_01_open_log(self, compressed_logs):
+        """Compression is detected and the lines are the same as in the text log"""
+        lines = open("list_records.txt", "rb").readlines()
+        assert compressed_log.get_compression("list_records.txt") is None
+        for compression, log in compressed_logs.items():
+            assert compressed_log.get_compression(str(log)) == compression
+            for threaded in (False, True):
+                with compressed_log.open_log(str(log), threaded=threaded) as f:
+                    assert f.readlines() == lines
+            start = len(b"".join(lines[:10]))
+            with compressed_log.open_log(str(log), start) as f:
+                assert f.readline() == lines[10]
+        # The thread stops when the log is closed before the end
+        with compressed_log.open_log(str(compressed_logs["gzip"]), threaded=True) as f:
+            f.readline()
+        assert not f.raw.thread.is_alive()
+
+    def test_02_get_ratings_airlines(self, compressed_logs, tmp_path):
+        """Same ratings with any parser, and same report, as with the text log"""
+        expected = rec.list_sorted_ratings(
+            rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        )
+        for log in map(str, compressed_logs.values()):
+            records = rec.read_flight_records(log)
+            assert rec.list_sorted_ratings(rec.get_ratings_airlines(records)) == expected
+            for parser in rec.RECORD_PARSERS:
+                records = rec.get_record_parser(log, parser, threaded=True)(log)
+                assert rec.list_sorted_ratings(rec.get_ratings_airlines(records)) == expected
+
+        reports = [tmp_path / "text.html", tmp_path / "gzip.html"]
+        rec.main(["list_records.txt", "-o", str(reports[0])])
+        log = str(compressed_logs["gzip"])
+        rec.main([log, "-o", str(reports[1]), "--decompress-thread", "--workers", "2"])
+        # NOTE: the reports differ only by the time of generation (before the rankings)
+        rankings = [report.read_text().split("</h1>", 1)[1] for report in reports]
+        assert rankings[0] == rankings[1]
+        with pytest.raises(SystemExit):
+            rec.main([log, "--incremental", str(tmp_path / "checkpoint")])
+
+    def test_03_errors(self, compressed_logs, tmp_path):
+        """Errors while decompressing are raised as IOError"""
+        log = compressed_logs["gzip"]
+        log.write_bytes(log.read_bytes()[:-100])  # Truncated
+        for threaded in (False, True):
+            with pytest.raises(IOError):
+                list(rec.iter_flight_records(str(log), threaded=threaded))
+            with pytest.raises(IOError):
+                list(rec.RecordBatches(str(log), threaded=threaded))
+
+        zstd_log = tmp_path / "records.txt.zst"
+        zstd_log.write_bytes(b"\x28\xb5\x2f\xfd" + b"\0" * 10)
+        assert compressed_log.get_compression(str(zstd_log)) == "zstd"
+        with pytest.raises(IOError):
+            list(rec.iter_flight_records(str(zstd_log)))  # Not a valid zstd log
+
+
+# Test the rankings of several airports (shards)
+class TestShards:
+    """Test the Airlines of each airport, rolled up to rank all the airports"""
+
+    @pytest.fixture
+    def logs(self, tmp_path):
+        """Logs of 2 terminals of an airport and of another airport"""
+        logs = [tmp_path / name for name in ("PVG_T1.txt", "PVG_T2.txt", "SHA.txt")]
+        for seed, log in enumerate(logs):
+            generate_records.generate_records(
+                str(log), 1000, nb_airlines=4, nb_flights=6, seed=seed
+            )
+        return list(map(str, logs))
+
+    def test_01_read_ratings_shards(self, logs):
+        """Each airport has the records of its files"""
+        for nb_workers in (1, 2):
+            counters = Counter()
+            shards = rec.read_ratings_shards(logs, nb_workers, "columns", "^[A-Z]{3}", counters)
+            assert list(shards) == ["PVG", "SHA"]
+            expected = rec.get_ratings_airlines(
+                rec.read_flight_records(logs[0]) + rec.read_flight_records(logs[1])
+            )
+            assert rec.list_sorted_ratings(shards["PVG"]) == rec.list_sorted_ratings(expected)
+            assert counters["records"] == 3000
+        assert list(rec.read_ratings_shards(logs)) == ["PVG_T1", "PVG_T2", "SHA"]
+
+    def test_02_rollup_shards(self, logs):
+        """Airlines rolled up from the airports have the ratings of all the records"""
+        shards = rec.read_ratings_shards(logs, shard_pattern="^[A-Z]{3}")
+        rolled_up = rec.rollup_shards(shards)
+        expected = rec.get_ratings_airlines(sum(map(rec.read_flight_records, logs), []))
+        assert rec.list_sorted_ratings(rolled_up) == rec.list_sorted_ratings(expected)
+        start, end = rec.get_window(rolled_up, 7)
+        assert (start, end) == rec.get_window(expected, 7)
+        assert rec.list_sorted_ratings(rolled_up, start, end) == (
+            rec.list_sorted_ratings(expected, start, end)
+        )
+        for name, airline in expected.items():
+            assert rolled_up[name].get_percentiles_airline() == (
+                airline.get_percentiles_airline()
+            )
+            for code in airline.flight_records:
+                assert rolled_up[name].get_percentiles_flight(code, start, end) == (
+                    airline.get_percentiles_flight(code, start, end)
+                )
+                assert sorted(rolled_up[name].flights[code], key=str) == sorted(
+                    airline.flights[code], key=str
+                )
+
+        # The records of the airports are not copied
+        name, airline = next(iter(shards["PVG"].items()))
+        code, records = next(iter(airline.flight_records.items()))
+        assert rolled_up[name].flight_records[code].parts[0] is records
+
+    def test_03_main(self, logs, tmp_path):
+        """A report for all the airports and a report for each airport"""
+        report = tmp_path / "report.html"
+        pattern = str(tmp_path / "*.txt")
+        rec.main([pattern, "-o", str(report), "--shard-pattern", "^[A-Z]{3}", "--workers", "2"])
+        assert "Ranking for PVG, SHA</b>" in report.read_text()
+        for name in ("PVG", "SHA"):
+            assert f"Ranking for {name}</b>" in (tmp_path / f"report_{name}.html").read_text()
+
+        rec.main(["mini_record.txt", "-o", str(report)])
+        assert "Ranking for Shanghai airports</b>" in report.read_text()
+        for argv in ([str(tmp_path / "*.log")], [*logs, "--cache", str(tmp_path / "cache")]):
+            with pytest.raises(SystemExit):
+                rec.main(argv)
+
+
+# Test the IDs of the names read by blocks of records (catalog.py)
+class TestCatalog:
+    """Test the symbol tables and the Airlines created from columns of IDs"""
+
+    def test_01_symbol_table(self):
+        """Dense IDs in order of first appearance, names found by ID"""
+        table = catalog.SymbolTable(["MU553", "EK303"])
+        assert table["MU553"] == 0 and table["KL2612"] == 2
+        assert table.get_ids(["EK303", "MU553", "QF130"]) == [1, 0, 3]
+        assert table.names == ["MU553", "EK303", "KL2612", "QF130"]
+        names = catalog.Catalog()
+        names.code["MU553"], names["destination"]["Paris"]
+        assert len(names) == 2 and not names.airline
+
+    def test_02_get_ratings_airlines(self, tmp_path):
+        """Same Airlines from columns of IDs as from dict records, with a shared catalog"""
+        text = open("list_records.txt").read()
+        text_path, log_path = tmp_path / "records.txt", str(tmp_path / "records.alog")
+        text_path.write_text(text + "2015-08-23, 08:05, MU553\n")  # malformed
+        columnar_log.convert_log(str(text_path), log_path, batch_size=2000)
+        expected = rec.get_ratings_airlines(rec.iter_flight_records(str(text_path)))
+
+        names = catalog.Catalog()
+        for records in (
+            rec.RecordBatches(str(text_path), batch_size=2000),
+            columnar_log.ColumnarLog(log_path),
+        ):
+            airlines_dic = rec.get_ratings_airlines(records, catalog=names)
+            assert list(airlines_dic) == list(expected)
+            for name, airline in airlines_dic.items():
+                assert attributes(airline) == attributes(expected[name])
+        # The names of both files have the same IDs
+        assert names.airline.names == list(expected)
+        assert len(names.code) == sum(len(a.flight_records) for a in expected.values())
+
+
+# Test the filters of the records applied by the readers (record_filter.py)
+class TestRecordFilter:
+    """Test that each reader gives only the records matching a filter"""
+
+    FILTERS = [
+        {"airlines": ["China Eastern Airlines", "Emirates Airlines"]},
+        {"code_prefixes": ["MU5", "EK"], "start": "2015-08-21"},
+        {"destinations": ["Paris Ch. de Gaulle"], "end": "2015-08-21"},
+        {"airlines": ["Unknown"]},
+    ]
+
+    def test_01_match(self):
+        """Lines and fields are checked with the same criteria"""
+        line = b"2015-08-23, 8:05, MU553, China Eastern Airlines, Paris Ch. de Gaulle, 9:00"
+        fields = [field.strip() for field in line.decode().split(",")]
+        record = dict(zip(rec.RecordBatches.record_keys, fields))
+        for options, expected in zip(self.FILTERS, (True, True, False, False)):
+            selection = record_filter.RecordFilter(**options)
+            assert selection.match(record) == expected
+            assert selection.match_fields(line.split(b",")) == expected
+            assert selection.match_line(line) or not expected
+        assert not record_filter.RecordFilter()
+        assert record_filter.RecordFilter(start="2015-08-20")
+        # The quick check of the line finds "Paris" in the destination, not the airline
+        selection = record_filter.RecordFilter(airlines=["Paris"])
+        assert selection.match_line(line) and not selection.match_fields(line.split(b","))
+
+    def test_02_readers(self, tmp_path):
+        """Same Airlines from each reader as from the matching dict records"""
+        text_path, log_path = "list_records.txt", str(tmp_path / "records.alog")
+        columnar_log.convert_log(text_path, log_path, batch_size=2000)
+        records = rec.read_flight_records(text_path)
+        for options in self.FILTERS:
+            selection = record_filter.RecordFilter(**options)
+            selected = [record for record in records if selection.match(record)]
+            assert rec.read_flight_records(text_path, selection) == selected
+            expected = rec.get_ratings_airlines(selected)
+            for file_path in (text_path, log_path):
+                for parser in rec.RECORD_PARSERS:
+                    read_records = rec.get_record_parser(file_path, parser, False, selection)
+                    airlines_dic = rec.get_ratings_airlines(read_records(file_path))
+                    assert {n: attributes(a) for n, a in airlines_dic.items()} == {
+                        n: attributes(a) for n, a in expected.items()
+                    }
+            counters = Counter()
+            airlines_dic = rec.read_ratings_airlines(
+                text_path, 2, counters=counters, record_filter=selection
+            )
+            assert counters["records"] == len(selected)
+            assert rec.list_sorted_ratings(airlines_dic) == rec.list_sorted_ratings(expected)
+
+    def test_03_main(self, tmp_path):
+        """Report of the filtered records, filters not allowed with a cache"""
+        report = tmp_path / "report.html"
+        options = ["--all", "--airline", "Emirates Airlines"]
+        rec.main(["list_records.txt", "-o", str(report), *options])
+        assert "<b>Emirates Airlines</b>" in report.read_text()
+        assert "<b>China Eastern Airlines</b>" not in report.read_text()
+
+        options = ["--all", "--from", "2015-08-21", "--to", "2015-08-22"]
+        reports = [tmp_path / "read_all.html", tmp_path / "filtered.html"]
+        rec.main(["list_records.txt", "-o", str(reports[0]), *options])
+        rec.main(["list_records.txt", "-o", str(reports[1]), *options, "--filter-dates"])
+        read_all, filtered = (r.read_text().split("</h1>", 1)[1] for r in reports)
+        assert sorted(read_all.splitlines()) == sorted(filtered.splitlines())
+
+        for argv in (
+            ["--destination", "Dubai", "--cache", str(tmp_path / "cache")],
+            ["--filter-dates", "--window", "3"],
+        ):
+            with pytest.raises(SystemExit):
+                rec.main(["list_records.txt", *argv])
+
+
+# Test the strict validation of the lines and the quarantine file (validation.py)
+class TestValidation:
+    """Test that invalid lines are written in the quarantine file by each reader"""
+
+    INVALID_LINES = [
+        "2015-02-30, 8:05, MU553, China Eastern Airlines, Paris Ch. de Gaulle, 9:00",
+        "2015-08-2x, 8:05, MU553, China Eastern Airlines, Paris Ch. de Gaulle, 9:00",
+        "2015-08-20, 8:65, MU553, China Eastern Airlines, Paris Ch. de Gaulle, 9:00",
+        "2015-08-20, 8:05, mu553, China Eastern Airlines, Paris Ch. de Gaulle, 9:00",
+        "2015-08-20, 8:05, MU553, , Paris Ch. de Gaulle, 9:00",
+        "2015-08-20, 8:05, MU553, China Eastern Airlines, Paris Ch. de Gaulle",
+    ]
+
+    @pytest.fixture
+    def log(self, tmp_path):
+        """Log with invalid lines (line numbers => line) and an empty line"""
+        lines = open("list_records.txt").read().splitlines()
+        lines.insert(100, "")
+        invalid = dict(zip((3, 50, 51, 200, 300, 400), self.INVALID_LINES))
+        for line_number, line in invalid.items():
+            lines.insert(line_number - 1, line)
+        log = tmp_path / "records.txt"
+        log.write_text("\n".join(lines) + "\n")
+        return str(log), invalid
+
+    def test_01_patterns(self):
+        """Same validation of the lines and of the fields of blocks of lines"""
+        valid_line = b"2015-08-20, 23:45, MU269Y, China Eastern Airlines, Paris, 0:05\n"
+        assert validation.LINE_PATTERN.fullmatch(valid_line)
+        lines = [valid_line] + [line.encode() for line in self.INVALID_LINES[:-1]]
+        columns = zip(*(line.split(b",") for line in lines))
+        columns = dict(zip(rec.RecordBatches.record_keys, columns))
+        invalid = validation.FieldValidator().get_invalid_positions(columns)
+        assert invalid == {1, 2, 3, 4, 5}
+        validator = validation.LineValidator()
+        for position, line in enumerate(lines):
+            assert validator.match(line) == (position not in invalid)
+        assert validation.LINE_PATTERN.fullmatch(lines[1])  # Day checked after the format
+
+    def test_02_quarantine(self, log, tmp_path):
+        """Invalid lines written by batches with their line numbers, valid lines read"""
+        file_path, invalid = log
+        expected_lines = [f"{file_path}:{n}: {line}" for n, line in invalid.items()]
+        expected = rec.get_ratings_airlines(rec.read_flight_records("list_records.txt"))
+        for parser in rec.RECORD_PARSERS:
+            with validation.Quarantine(str(tmp_path / "invalid.txt"), batch_size=2) as q:
+                records = rec.get_record_parser(file_path, parser, quarantine=q)(file_path)
+                airlines_dic = rec.get_ratings_airlines(records)
+                assert q.nb_lines == len(invalid)
+            assert (tmp_path / "invalid.txt").read_text().splitlines() == expected_lines
+            assert rec.list_sorted_ratings(airlines_dic) == rec.list_sorted_ratings(expected)
+
+        counters = Counter()
+        with validation.Quarantine(str(tmp_path / "invalid.txt")) as q:
+            rec.read_ratings_airlines(file_path, 2, counters=counters, quarantine=q)
+        assert counters["invalid_lines"] == len(invalid) and counters["malformed_lines"] == 0
+        assert counters["records"] == 468
+
+    def test_03_main(self, log, tmp_path, capsys):
+        """Invalid lines are not printed with option --quarantine"""
+        file_path, invalid = log
+        quarantine = tmp_path / "invalid.txt"
+        rec.main([file_path, "-o", str(tmp_path / "report.html"), "--quarantine", str(quarantine)])
+        out = capsys.readouterr().out
+        assert "incorrect number of data" not in out
+        assert f"{len(invalid)} invalid lines written in {str(quarantine)!r}" in out
+        assert len(quarantine.read_text().splitlines()) == len(invalid)
+
+    def test_04_incremental(self, log, tmp_path):
+        """Incremental updates add the invalid lines of the new lines, with their numbers"""
+        file_path, invalid = log
+        quarantine, checkpoint = tmp_path / "invalid.txt", tmp_path / "checkpoint"
+        lines = open(file_path).read().splitlines(keepends=True)
+        options = ["-o", str(tmp_path / "report.html"), "--incremental", str(checkpoint)]
+        options += ["--quarantine", str(quarantine)]
+        with open(file_path, "w") as f:
+            f.writelines(lines[:100])
+        rec.main([file_path, *options])
+        with open(file_path, "a") as f:
+            f.writelines(lines[100:])
+        rec.main([file_path, *options])
+        expected = [f"{file_path}:{n}: {line}" for n, line in invalid.items()]
+        assert quarantine.read_text().splitlines() == expected
+
 
 if __name__ == "__main__":
     pytest.main(args=["-v"])
-